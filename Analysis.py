@@ -1,15 +1,33 @@
+import heapq
+import itertools
 import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from operator import itemgetter
 
 import r2pipe
 from miasm.analysis.binary import Container, ContainerELF, ContainerPE
 from miasm.analysis.machine import Machine
 from miasm.analysis.sandbox import Sandbox_Linux_x86_32, Sandbox_Linux_x86_64, Sandbox_Win_x86_32, Sandbox_Win_x86_64
-from miasm.core.interval import interval
-from miasm.expression.expression import ExprInt, ExprLoc, ExprMem, ExprId, ExprOp
+from miasm.core.asmblock import AsmCFG, AsmBlock, AsmBlockBad, DecodedInstrCache
+from miasm.expression.expression import Expr, ExprInt, ExprLoc, ExprMem, ExprId, ExprOp
 
 import Utils
 from BinaryParser import PEInfo, ELFInfo
-from RadareParser import Function
+from Coverage import CoverageMap
+from Database import AnalysisDB
+from Discovery import CALLTYPES, addressedStarts, describeFunctions, functionSeeds, inRanges, scanCFG
+from Instructions import InstructionStore, MASK64
+from Pending import PendingFunctions
+from RawData import RawData
+from References import XrefIndex, XREF_CALL, XREF_CODE, XREF_DATA
+from Strings import extractStrings
+from RadareParser import Function, iterJson
 
 def detect_func_name(cur_bloc, loc_db, *args, **kwargs):
     for line in cur_bloc.lines:
@@ -50,6 +68,110 @@ def detect_func_name(cur_bloc, loc_db, *args, **kwargs):
                                     pass
 
 
+_worker = threading.local()
+
+# functions read from radare per afij command
+FUNCTIONS_PAGE = 512
+# functions disassembled in advance by each background worker, and loaded at once by collectBackground
+BACKGROUND_QUEUE = 4
+BACKGROUND_CHUNK = 16
+# seconds collectBackground spends loading the finished functions at each call
+BACKGROUND_BUDGET = 0.02
+# functions whose AsmCFG is kept, the others are rebuilt from BinaryAnalysis.code when they are used
+LIVE_CFGS = 64
+
+
+def createDisasmEngine(machine, container):
+    """
+    disasmEngine of container with its own decoded instruction cache, functions overlapping each other don't
+    decode the same instructions twice
+    """
+    disasmEngine = machine.dis_engine(container.bin_stream, loc_db=container.loc_db,
+                                      instr_cache=DecodedInstrCache(machine.mn))
+    disasmEngine.dis_block_callback = detect_func_name
+    return disasmEngine
+
+
+def initDisasmWorker(path):
+    """
+    Give the current worker its own container, LocationDB and disasmEngine
+    :param path: path of the analysed binary
+    """
+    container = Container.from_stream(open(path, 'rb'))
+    _worker.disasmEngine = createDisasmEngine(Machine(container.arch), container)
+    _worker.path = path
+
+
+def initBackgroundWorker(path):
+    """
+    initDisasmWorker for the background workers of the lazy mode, which give way to the interface
+    """
+    if hasattr(os, 'nice'):
+        os.nice(10)
+    initDisasmWorker(path)
+
+
+def disasmWorker(job):
+    """
+    Disassemble one function in the current worker
+    :param job: (address, minBound, maxBound) of the function
+    :return: (blocks, locs, decoded) where locs gives (offset, names) of every LocKey used by blocks and decoded
+        the (hits, misses, decodeTime, totalTime) counters of the instruction cache for this function
+    """
+    address, minBound, maxBound = job
+    cfg, decoded = disasmCFG(address)
+    return exportCFG(cfg, minBound, maxBound) + (decoded,)
+
+
+def discoverWorker(address):
+    """
+    Disassemble the code reached from a function start in the current worker, for the function discovery
+    :return: (scan, result) where scan is the scanCFG summary and result is like the one of disasmWorker
+    """
+    cfg, decoded = disasmCFG(address)
+    return scanCFG(cfg, _worker.disasmEngine.loc_db), exportCFG(cfg, 0, MASK64) + (decoded,)
+
+
+def disasmCFG(address):
+    """
+    :return: (cfg, decoded) CFG disassembled from address by the disasmEngine of the current worker and its
+        instruction cache counters
+    """
+    instrCache = _worker.disasmEngine.instr_cache
+    instrCache.reset_stats()
+    cfg = _worker.disasmEngine.dis_multiblock(address)
+    return cfg, (instrCache.hits, instrCache.misses, instrCache.decode_time, instrCache.total_time)
+
+
+def exportCFG(cfg, minBound, maxBound):
+    """
+    :return: (blocks, locs) picklable blocks of cfg starting in [minBound, maxBound) and the LocKeys they use
+    """
+    locDB = _worker.disasmEngine.loc_db
+    blocks = []
+    locs = {}
+
+    def collectLoc(expr):
+        if expr.is_loc():
+            locs[expr.loc_key] = None
+        return expr
+
+    for block in cfg.blocks:
+        if len(block.lines) > 0:
+            if block.lines[0].offset < minBound or block.lines[0].offset >= maxBound:
+                continue
+        blocks.append(block)
+        locs[block.loc_key] = None
+        for cst in block.bto:
+            locs[cst.loc_key] = None
+        for line in block.lines:
+            for arg in line.args:
+                arg.visit(collectLoc)
+    for locKey in locs:
+        locs[locKey] = (locDB.get_location_offset(locKey), sorted(locDB.get_location_names(locKey)))
+    return blocks, locs
+
+
 class BinaryAnalysis:
     path = None
     container = None
@@ -60,109 +182,517 @@ class BinaryAnalysis:
     disasmEngine = None
     binaryInfo = None
     radare = None
+    db = None
+    # workers of the disassembly pools, None for Utils.WORKERS or 1 without Utils.USE_PROCESSES
+    workers = None
     funcs = []
-    blocks = []
+    code = InstructionStore()
     dataType = {}
-    dataXrefs = {}
+    xrefs = XrefIndex()
     doneAddress = set()
-    doneInterval = interval()
+    doneInterval = CoverageMap()
     data = []
     locDB = None
     strings = {}
+    allStrings = {}
     maxSizeData = None
+    irCache = {}
+    # id of a function -> function whose AsmCFG is kept, least recently used first
+    liveCFGs = OrderedDict()
+    # key of a graph -> Layout.GraphLayout
+    layoutCache = {}
+    # rendered arguments and expressions of CommonView, least recently used first
+    renderCache = OrderedDict()
+    decodeStats = None
+    # PendingFunctions in lazy mode, None once everything is loaded or in eager mode
+    pending = None
+    background = None
+    backgroundJobs = {}
+    # pending functions not submitted to the background workers yet, by start
+    backgroundQueue = deque()
+    # pending functions whose result is there, loaded by collectBackground
+    backgroundReady = deque()
+    # addresses of the functions which could not be disassembled in the background -> exception
+    failedFunctions = {}
 
     @staticmethod
-    def init(binary):
+    def init(binary, sandbox=True, fast=False, lazy=False, database=True, workers=None):
+        """
+        Load binary and analyse it, or restore its analysis from the project database
+        :param binary: path of the binary
+        :param sandbox: create the miasm sandbox used by emulation, not needed without the GUI
+        :param fast: find the functions with discoverFunctions instead of the radare analysis
+        :param lazy: disassemble the functions when they are shown, see loadFunctions
+        :param database: restore and save the analysis in the project database
+        :param workers: number of workers disassembling the functions, 1 to disassemble them in the current process
+        """
         BinaryAnalysis.clear()
         BinaryAnalysis.path = binary
-        BinaryAnalysis.rawData = list(open(binary, 'rb').read())
-        BinaryAnalysis.container = Container.from_stream(open(binary, 'rb'))
-        BinaryAnalysis.locDB = BinaryAnalysis.container.loc_db
-        BinaryAnalysis.machine = Machine(BinaryAnalysis.container.arch)
-        BinaryAnalysis.iraType = BinaryAnalysis.machine.ira
-        if isinstance(BinaryAnalysis.container, ContainerPE):
-            BinaryAnalysis.binaryInfo = PEInfo(binary)
-        elif isinstance(BinaryAnalysis.container, ContainerELF):
-            BinaryAnalysis.binaryInfo = ELFInfo(binary)
-        if BinaryAnalysis.binaryInfo.type == 'PE':
-            if BinaryAnalysis.container.arch == 'x86_32':
-                parser = Sandbox_Win_x86_32.parser(description="PE sandboxer")
-                options = parser.parse_args()
-                BinaryAnalysis.sb = Sandbox_Win_x86_32(BinaryAnalysis.path, options, globals())
-            elif BinaryAnalysis.container.arch == 'x86_64':
-                parser = Sandbox_Win_x86_64.parser(description="PE sandboxer")
-                options = parser.parse_args()
-                BinaryAnalysis.sb = Sandbox_Win_x86_64(BinaryAnalysis.path, options, globals())
-        elif BinaryAnalysis.binaryInfo.type == 'ELF':
-            if BinaryAnalysis.container.arch == 'x86_32':
-                parser = Sandbox_Linux_x86_32.parser(description="PE sandboxer")
-                options = parser.parse_args()
-                BinaryAnalysis.sb = Sandbox_Linux_x86_32(BinaryAnalysis.path, options, globals())
-            elif BinaryAnalysis.container.arch == 'x86_64':
-                parser = Sandbox_Linux_x86_64.parser(description="PE sandboxer")
-                options = parser.parse_args()
-                BinaryAnalysis.sb = Sandbox_Linux_x86_64(BinaryAnalysis.path, options, globals())
-        BinaryAnalysis.disasmEngine = BinaryAnalysis.machine.dis_engine(BinaryAnalysis.container.bin_stream,
-                                                                        loc_db=BinaryAnalysis.container.loc_db)
-        BinaryAnalysis.disasmEngine.dis_block_callback = detect_func_name
+        if workers is None and not Utils.USE_PROCESSES:
+            workers = 1
+        BinaryAnalysis.workers = workers
+        with Utils.timeStage('load'):
+            BinaryAnalysis.rawData = RawData(binary)
+            BinaryAnalysis.container = Container.from_stream(open(binary, 'rb'))
+            BinaryAnalysis.locDB = BinaryAnalysis.container.loc_db
+            BinaryAnalysis.machine = Machine(BinaryAnalysis.container.arch)
+            BinaryAnalysis.iraType = BinaryAnalysis.machine.ira
+            if isinstance(BinaryAnalysis.container, ContainerPE):
+                BinaryAnalysis.binaryInfo = PEInfo(binary)
+            elif isinstance(BinaryAnalysis.container, ContainerELF):
+                BinaryAnalysis.binaryInfo = ELFInfo(binary)
+        if sandbox:
+            with Utils.timeStage('sandbox'):
+                BinaryAnalysis.sb = BinaryAnalysis.createSandbox()
+        BinaryAnalysis.disasmEngine = createDisasmEngine(BinaryAnalysis.machine, BinaryAnalysis.container)
         BinaryAnalysis.maxSizeData = BinaryAnalysis.disasmEngine.attrib // 8
-        BinaryAnalysis.strings = BinaryAnalysis.binaryInfo.findStrings()
-        BinaryAnalysis.radare = r2pipe.open(binary)
-        BinaryAnalysis.radare.cmd('aaa;')
-        BinaryAnalysis.detectFunctions()
-        BinaryAnalysis.disassembly()
-        for start, end in (BinaryAnalysis.binaryInfo.codeRange - BinaryAnalysis.doneInterval):
-            BinaryAnalysis.data.append((start - 1, end))
-        for start, end in BinaryAnalysis.binaryInfo.dataRange:
-            BinaryAnalysis.data.append((start, end - 1))
+        with Utils.timeStage('strings'):
+            BinaryAnalysis.allStrings = extractStrings(BinaryAnalysis.rawData,
+                                                       BinaryAnalysis.binaryInfo.stringSections())
+            BinaryAnalysis.strings = BinaryAnalysis.allStrings.dataStrings()
+        state = None
+        if database:
+            with Utils.timeStage('dbload'):
+                BinaryAnalysis.db = AnalysisDB(binary, 'fast' if fast else '')
+                state = BinaryAnalysis.db.load()
+        if state is not None:
+            BinaryAnalysis.restoreState(state)
+            return
+        results = None
+        if fast:
+            with Utils.timeStage('functions'):
+                results = BinaryAnalysis.discoverFunctions()
+        else:
+            with Utils.timeStage('radare'):
+                BinaryAnalysis.radare = r2pipe.open(binary)
+                BinaryAnalysis.radare.cmd('aaa;')
+            with Utils.timeStage('functions'):
+                BinaryAnalysis.detectFunctions()
+        if lazy:
+            BinaryAnalysis.deferDisassembly(results)
+        else:
+            BinaryAnalysis.disassembly(results)
+        with Utils.timeStage('coverage'):
+            # the section end stored in codeRange is exclusive, like the ones of dataRange
+            for codeStart, codeEnd in BinaryAnalysis.binaryInfo.codeRange:
+                for start, end in BinaryAnalysis.doneInterval.gaps(codeStart, codeEnd):
+                    BinaryAnalysis.data.append((start, end - 1))
+            for start, end in BinaryAnalysis.binaryInfo.dataRange:
+                BinaryAnalysis.data.append((start, end - 1))
+        if BinaryAnalysis.pending is None:
+            with Utils.timeStage('dbsave'):
+                BinaryAnalysis.saveDatabase()
+
+    @staticmethod
+    def saveDatabase():
+        """
+        Save the analysis in the project database, if it has one. The database is only a cache: a failure is logged
+        and the analysis goes on
+        """
+        if BinaryAnalysis.db is None:
+            return
+        try:
+            BinaryAnalysis.db.save(BinaryAnalysis.saveState())
+        except Exception as e:
+            logging.warning('cannot save the project database %s: %r', BinaryAnalysis.db.path, e)
+
+    @staticmethod
+    def createSandbox():
+        """
+        Create the sandbox of the loaded binary with the default options. The options are not parsed from sys.argv,
+        which belongs to the program embedding the analysis
+        :return: Sandbox instance or None if the format or the architecture is not supported
+        """
+        sandboxes = {
+            ('PE', 'x86_32'): Sandbox_Win_x86_32,
+            ('PE', 'x86_64'): Sandbox_Win_x86_64,
+            ('ELF', 'x86_32'): Sandbox_Linux_x86_32,
+            ('ELF', 'x86_64'): Sandbox_Linux_x86_64,
+        }
+        sandbox = sandboxes.get((BinaryAnalysis.binaryInfo.type, BinaryAnalysis.container.arch))
+        if sandbox is None:
+            return None
+        parser = sandbox.parser(description="%s sandboxer" % BinaryAnalysis.binaryInfo.type)
+        options = parser.parse_args([])
+        return sandbox(BinaryAnalysis.path, options, globals())
+
+    @staticmethod
+    def saveState():
+        return {
+            'locDB': BinaryAnalysis.locDB,
+            'funcs': BinaryAnalysis.funcs,
+            'code': BinaryAnalysis.code,
+            'dataType': BinaryAnalysis.dataType,
+            'xrefs': BinaryAnalysis.xrefs,
+            'doneAddress': BinaryAnalysis.doneAddress,
+            'doneInterval': BinaryAnalysis.doneInterval,
+            'data': BinaryAnalysis.data,
+        }
+
+    @staticmethod
+    def restoreState(state):
+        BinaryAnalysis.locDB = state['locDB']
+        BinaryAnalysis.disasmEngine.loc_db = BinaryAnalysis.locDB
+        BinaryAnalysis.funcs = state['funcs']
+        BinaryAnalysis.code = state['code']
+        BinaryAnalysis.liveCFGs = OrderedDict()
+        BinaryAnalysis.dataType = state['dataType']
+        BinaryAnalysis.xrefs = state['xrefs']
+        BinaryAnalysis.doneAddress = state['doneAddress']
+        BinaryAnalysis.doneInterval = state['doneInterval']
+        BinaryAnalysis.data = state['data']
 
     @staticmethod
     def detectFunctions():
-        funcsJson = BinaryAnalysis.radare.cmd('aflj;')
-        funcsParses = json.loads(funcsJson)
-        Utils.runMultiThread(funcsParses, BinaryAnalysis.parseFunc)
+        """
+        Read the functions found by radare, FUNCTIONS_PAGE functions per command so the whole JSON of the binary
+        is never held in memory
+        """
+        addresses = json.loads(BinaryAnalysis.radare.cmd('aflqj;') or '[]')
+        funcs = []
+        done = set()
+        for i in range(0, len(addresses), FUNCTIONS_PAGE):
+            page = BinaryAnalysis.radare.cmd('afij @@=%s;' % ' '.join('0x%x' % address
+                                                                        for address in addresses[i:i + FUNCTIONS_PAGE]))
+            for funcsJson in iterJson(page):
+                for funcJson in funcsJson:
+                    if funcJson['offset'] not in done:
+                        done.add(funcJson['offset'])
+                        funcs.append(BinaryAnalysis.parseFunc(funcJson))
+            del page
+        BinaryAnalysis.funcs = funcs
+
+    @staticmethod
+    def discoverFunctions():
+        """
+        Find the functions without radare: disassemble from the entry point, the exported functions and the
+        functions of the symbol table, then from the targets of the calls found, in parallel as soon as they are
+        found. Then the code addresses used as constants outside of the blocks found are disassembled the same way,
+        until there are no more. The functions only referenced from data, like the ones of vtables, are not found
+        :return: disassembly results of BinaryAnalysis.funcs, see disassembly
+        """
+        binaryInfo = BinaryAnalysis.binaryInfo
+        seeds = functionSeeds(BinaryAnalysis.container.entry_point, binaryInfo)
+        codeRanges = list(binaryInfo.codeRange or [])
+        results = {}
+
+        def newStarts(address, result):
+            return [target for _, target in result[0][1] if inRanges(target, codeRanges) and target not in results]
+
+        starts = sorted(seeds)
+        while starts:
+            results.update(Utils.runWorklist(starts, discoverWorker, newStarts, workers=BinaryAnalysis.workers,
+                                             processes=True,
+                                             initializer=initDisasmWorker, initargs=(BinaryAnalysis.path,)))
+            starts = addressedStarts(dict((address, result[0]) for address, result in results.items()), codeRanges)
+        calltype = CALLTYPES.get((binaryInfo.type, BinaryAnalysis.disasmEngine.attrib), 'cdecl')
+        funcsJson = describeFunctions(dict((address, result[0]) for address, result in results.items()), seeds,
+                                      calltype, binaryInfo.inDataSection)
+        BinaryAnalysis.funcs = [BinaryAnalysis.parseFunc(funcJson) for funcJson in funcsJson]
+        return [results[func.address][1] for func in BinaryAnalysis.funcs]
+
+    @staticmethod
+    def disassembly(results=None):
+        """
+        Disassemble the functions and record their blocks
+        :param results: disasmWorker results of BinaryAnalysis.funcs if they are already disassembled
+        """
+        if results is None:
+            jobs = [(func.address, func.minBound, func.maxBound) for func in BinaryAnalysis.funcs]
+            # miasm keeps decoding state on the mnemonic classes, so workers must be processes
+            with Utils.timeStage('disassembly'):
+                results = Utils.runPool(jobs, disasmWorker, workers=BinaryAnalysis.workers, processes=True,
+                                        initializer=initDisasmWorker, initargs=(BinaryAnalysis.path,))
+        hits = misses = decodeTime = totalTime = 0
+        entries = []
+        with Utils.timeStage('merge'):
+            for func, (blocks, locs, decoded) in zip(BinaryAnalysis.funcs, results):
+                entries.extend(BinaryAnalysis.disasmFunc(func, BinaryAnalysis.importCFG(blocks, locs)))
+                hits += decoded[0]
+                misses += decoded[1]
+                decodeTime += decoded[2]
+                totalTime += decoded[3]
+            for func in BinaryAnalysis.funcs:
+                BinaryAnalysis.addFuncXrefs(func)
+        with Utils.timeStage('instructions'):
+            # stable, the block listed at an address is the one of the first function; never compares the blocks
+            entries.sort(key=itemgetter(0))
+            BinaryAnalysis.code = InstructionStore.fromBlocks([(block, func) for _, block, func in entries],
+                                                              BinaryAnalysis.locDB)
+            BinaryAnalysis.releaseCFGs()
+        with Utils.timeStage('xrefs'):
+            BinaryAnalysis.xrefs.flush()
+        BinaryAnalysis.decodeStats = {'hits': hits, 'misses': misses, 'decodeTime': decodeTime, 'totalTime': totalTime,
+                                      'instrsPerSec': (hits + misses) / totalTime if totalTime else 0.0,
+                                      'decodeRate': misses / decodeTime if decodeTime else 0.0}
+
+    @staticmethod
+    def deferDisassembly(results=None):
+        """
+        Lazy mode: record the functions to disassemble when they are first shown instead of disassembling them,
+        until then their bytes are listed as data
+        :param results: disasmWorker results of BinaryAnalysis.funcs if they are already disassembled
+        """
+        BinaryAnalysis.pending = PendingFunctions(BinaryAnalysis.funcs, results)
+        for func in BinaryAnalysis.funcs:
+            BinaryAnalysis.addFuncXrefs(func)
+        BinaryAnalysis.xrefs.flush()
+
+    @staticmethod
+    @Utils.analysisLocked
+    def loadFunctions(funcs):
+        """
+        Disassemble the given pending functions and list their blocks, in lazy mode. A function which cannot be
+        disassembled is recorded in failedFunctions and stays pending, it is not tried again; the others are listed.
+        The analysis is saved in the project database when the last function is loaded
+        :return: (start, end) range of addresses whose blocks or data changed, None if nothing changed
+        """
+        pending = BinaryAnalysis.pending
+        if pending is None:
+            return None
+        entries = []
+        start = end = None
+        for func in funcs:
+            if func not in pending or func.address in BinaryAnalysis.failedFunctions:
+                continue
+            try:
+                result = pending.result(func)
+                if result is None:
+                    if getattr(_worker, 'path', None) != BinaryAnalysis.path:
+                        initDisasmWorker(BinaryAnalysis.path)
+                    result = disasmWorker((func.address, func.minBound, func.maxBound))
+                blocks, locs, _ = result
+                funcEntries = BinaryAnalysis.disasmFunc(func, BinaryAnalysis.importCFG(blocks, locs))
+            except Exception as e:
+                BinaryAnalysis.failFunction(func, e)
+                continue
+            pending.pop(func)
+            entries.extend(funcEntries)
+            funcStart, funcEnd = PendingFunctions.bounds(func)
+            for block in func.cfg.blocks:
+                if block.lines:
+                    # the last block may end past maxBound
+                    funcEnd = max(funcEnd, block.lines[-1].offset + block.lines[-1].l)
+            start = funcStart if start is None else min(start, funcStart)
+            end = funcEnd if end is None else max(end, funcEnd)
+        if start is None:
+            return None
+        # the names of the loaded functions are shown in the arguments rendered before
+        BinaryAnalysis.renderCache = OrderedDict()
+        entries.sort(key=itemgetter(0))
+        BinaryAnalysis.code.replaceBlocks(set(), [(block, func) for _, block, func in entries], BinaryAnalysis.locDB)
+        BinaryAnalysis.releaseCFGs()
+        changed = BinaryAnalysis.updateData(start, end)
+        if BinaryAnalysis.loadingDone():
+            BinaryAnalysis.finishLoading()
+        return changed
+
+    @staticmethod
+    def failFunction(func, error):
+        """
+        Record that func cannot be disassembled, it is left pending without blocks
+        """
+        logging.warning('cannot disassemble the function %s at 0x%x: %r', func.name, func.address, error)
+        BinaryAnalysis.failedFunctions[func.address] = error
+
+    @staticmethod
+    def loadingDone():
+        """
+        :return: whether every pending function is loaded or failed
+        """
+        pending = BinaryAnalysis.pending
+        failed = BinaryAnalysis.failedFunctions
+        return len(pending) <= len(failed) and all(func.address in failed for func in pending.remaining())
+
+    @staticmethod
+    def finishLoading():
+        """
+        Leave the lazy mode once every function is loaded. The analysis is saved in the project database, unless
+        functions failed to be disassembled: they are tried again the next time the binary is opened
+        """
+        BinaryAnalysis.pending = None
+        BinaryAnalysis.stopBackground()
+        if not BinaryAnalysis.failedFunctions:
+            BinaryAnalysis.saveDatabase()
+
+    @staticmethod
+    def loadRange(start, end):
+        """
+        Load the pending functions whose bytes intersect [start, end), see loadFunctions
+        """
+        if BinaryAnalysis.pending is None:
+            return None
+        funcs = [func for func in BinaryAnalysis.pending.overlapping(start, end)
+                 if func.address not in BinaryAnalysis.failedFunctions]
+        if not funcs:
+            # nothing to load, the lock of loadFunctions is not needed
+            return None
+        return BinaryAnalysis.loadFunctions(funcs)
+
+    @staticmethod
+    def loadAll():
+        if BinaryAnalysis.pending is None:
+            return None
+        return BinaryAnalysis.loadFunctions(BinaryAnalysis.pending.remaining())
+
+    @staticmethod
+    def startBackground(workers=1):
+        """
+        Disassemble the pending functions in low priority worker processes, their results are loaded by
+        collectBackground
+        """
+        if BinaryAnalysis.pending is None or BinaryAnalysis.background is not None:
+            return
+        BinaryAnalysis.background = BinaryAnalysis.backgroundPool(workers)
+        BinaryAnalysis.backgroundJobs = {}
+        BinaryAnalysis.backgroundQueue = deque(BinaryAnalysis.pending.remaining())
+        BinaryAnalysis.backgroundReady = deque()
+        BinaryAnalysis.submitBackground()
+
+    @staticmethod
+    def backgroundPool(workers):
+        return ProcessPoolExecutor(max_workers=workers, initializer=initBackgroundWorker,
+                                   initargs=(BinaryAnalysis.path,))
+
+    @staticmethod
+    def submitBackground():
+        """
+        Keep the background workers busy with the next functions of backgroundQueue, the functions loaded meanwhile
+        are skipped and the ones already disassembled go to backgroundReady
+        """
+        pending = BinaryAnalysis.pending
+        jobs = BinaryAnalysis.backgroundJobs
+        queue = BinaryAnalysis.backgroundQueue
+        limit = BinaryAnalysis.background._max_workers * BACKGROUND_QUEUE
+        while queue and len(jobs) < limit:
+            func = queue.popleft()
+            if func not in pending:
+                continue
+            if pending.hasResult(func):
+                BinaryAnalysis.backgroundReady.append(func)
+            else:
+                jobs[BinaryAnalysis.background.submit(disasmWorker, (func.address, func.minBound,
+                                                                     func.maxBound))] = func
 
     @staticmethod
-    def disassembly():
-        Utils.runMultiThread(BinaryAnalysis.funcs, BinaryAnalysis.disasmFunc)
-        BinaryAnalysis.blocks = sorted(BinaryAnalysis.blocks, key=lambda x: x[0].lines[0].offset)
+    @Utils.analysisLocked
+    def collectBackground():
+        """
+        Load the functions disassembled by the background workers, or already disassembled, by chunks of
+        BACKGROUND_CHUNK functions for at most BACKGROUND_BUDGET seconds. A function whose worker failed is recorded
+        in failedFunctions and left pending without blocks; when a worker crashed, the pool is replaced and all the functions
+        it had are failed, the one which crashed it is not known.
+        :return: (start, end) range of addresses whose blocks or data changed, None if nothing changed
+        """
+        pending = BinaryAnalysis.pending
+        if pending is None or BinaryAnalysis.background is None:
+            return None
+        ready = BinaryAnalysis.backgroundReady
+        broken = False
+        for future, func in list(BinaryAnalysis.backgroundJobs.items()):
+            if not future.done():
+                continue
+            del BinaryAnalysis.backgroundJobs[future]
+            error = future.exception()
+            if error is None:
+                pending.setResult(func, future.result())
+                ready.append(func)
+            else:
+                broken = broken or isinstance(error, BrokenProcessPool)
+                if func in pending:
+                    BinaryAnalysis.failFunction(func, error)
+        if broken:
+            # the jobs of the broken pool which are not failed yet are given to the new one
+            BinaryAnalysis.backgroundQueue.extendleft(BinaryAnalysis.backgroundJobs.values())
+            BinaryAnalysis.backgroundJobs = {}
+            workers = BinaryAnalysis.background._max_workers
+            BinaryAnalysis.background.shutdown(wait=False)
+            BinaryAnalysis.background = BinaryAnalysis.backgroundPool(workers)
+        BinaryAnalysis.submitBackground()
+        changed = None
+        deadline = time.perf_counter() + BACKGROUND_BUDGET
+        while ready and time.perf_counter() < deadline:
+            funcs = [ready.popleft() for _ in range(min(BACKGROUND_CHUNK, len(ready)))]
+            loaded = BinaryAnalysis.loadFunctions(funcs)
+            if loaded is not None:
+                changed = loaded if changed is None else (min(changed[0], loaded[0]), max(changed[1], loaded[1]))
+            if BinaryAnalysis.pending is None:
+                return changed
+            BinaryAnalysis.submitBackground()
+        if BinaryAnalysis.loadingDone():
+            BinaryAnalysis.finishLoading()
+        return changed
 
     @staticmethod
-    def disasmFunc(func, lock):
-        lock.acquire()
-        func.cfg = BinaryAnalysis.disasmEngine.dis_multiblock(func.address)
+    def stopBackground():
+        if BinaryAnalysis.background is not None:
+            # only the functions being disassembled are waited for
+            for future in BinaryAnalysis.backgroundJobs:
+                future.cancel()
+            BinaryAnalysis.background.shutdown()
+        BinaryAnalysis.background = None
+        BinaryAnalysis.backgroundJobs = {}
+        BinaryAnalysis.backgroundQueue = deque()
+        BinaryAnalysis.backgroundReady = deque()
+
+    @staticmethod
+    def importCFG(blocks, locs):
+        """
+        Rebuild a worker result as an AsmCFG of BinaryAnalysis.locDB.
+        LocKeys are matched by offset, names found by the worker are added if they are still free
+        """
+        locDB = BinaryAnalysis.locDB
+        locMap = {}
+        for locKey, (offset, names) in locs.items():
+            if offset is not None:
+                newLocKey = locDB.get_or_create_offset_location(offset)
+            else:
+                newLocKey = locDB.add_location()
+            for name in names:
+                if locDB.get_name_location(name) is None and len(locDB.get_location_names(newLocKey)) == 0:
+                    locDB.add_location_name(newLocKey, name)
+            locMap[locKey] = newLocKey
+
+        def remapLoc(expr):
+            if expr.is_loc():
+                return ExprLoc(locMap[expr.loc_key], expr.size)
+            return expr
+
+        cfg = AsmCFG(locDB)
+        for block in blocks:
+            if isinstance(block, AsmBlockBad):
+                newBlock = AsmBlockBad(locMap[block.loc_key], block.alignment, block.errno)
+            else:
+                newBlock = AsmBlock(locMap[block.loc_key], block.alignment)
+            for cst in block.bto:
+                newBlock.add_cst(locMap[cst.loc_key], cst.c_t)
+            for line in block.lines:
+                line.args = [arg.visit(remapLoc) for arg in line.args]
+                newBlock.addline(line)
+            cfg.add_block(newBlock)
+        return cfg
+
+    @staticmethod
+    def disasmFunc(func, cfg):
+        """
+        Record the disassembled CFG of func
+        :return: list of (address, block, func) of its blocks to store in BinaryAnalysis.code, the blocks without
+            lines at the offset of their location
+        """
+        func.cfg = cfg
+        entries = []
         lockey = BinaryAnalysis.locDB.get_offset_location(func.address)
         name = BinaryAnalysis.locDB.pretty_str(lockey)
         if not 'loc_' in name:
             func.name = name
-        delBlocks = []
-        for block in func.cfg.blocks:
-            if len(block.lines) > 0:
-                address = block.lines[0].offset
-                if address < func.minBound or address >= func.maxBound:
-                    delBlocks.append(block)
-        for block in delBlocks:
-            func.cfg.del_block(block)
-        for block in func.cfg.blocks:
+        for block in cfg.blocks:
             if len(block.lines) > 0:
-                if block.lines[0].offset not in BinaryAnalysis.doneAddress:
-                    BinaryAnalysis.blocks.append((block, func))
-                    BinaryAnalysis.doneAddress.add(block.lines[0].offset)
+                entries.append((block.lines[0].offset, block, func))
+                BinaryAnalysis.doneAddress.add(block.lines[0].offset)
                 for line in block.lines:
-                    BinaryAnalysis.doneInterval += interval([(line.offset, line.offset + line.l)])
-                    for arg in line.args:
-                        if isinstance(arg, ExprInt):
-                            if arg.arg in func.dataRefs and BinaryAnalysis.binaryInfo.inDataSection(arg.arg):
-                                num = int(arg.arg)
-                                BinaryAnalysis.dataType[num] = Utils.typeBySize[arg.size]
-                                if num in BinaryAnalysis.dataXrefs:
-                                    BinaryAnalysis.dataXrefs[num].append(line.offset)
-                                else:
-                                    BinaryAnalysis.dataXrefs[num] = [line.offset]
-        for address, string in BinaryAnalysis.strings.items():
-            BinaryAnalysis.dataType[address] = 'string'
-
-        lock.release()
+                    BinaryAnalysis.addLine(line, func)
+            else:
+                entries.append((BinaryAnalysis.locDB.get_location_offset(block.loc_key) or 0, block, func))
         locKey = BinaryAnalysis.locDB.get_offset_location(func.address)
         names = BinaryAnalysis.locDB.get_location_names(locKey)
         if len(names) == 0:
@@ -170,28 +700,253 @@ class BinaryAnalysis:
                 BinaryAnalysis.locDB.add_location_name(locKey, func.name)
             else:
                 BinaryAnalysis.locDB.add_location_name(locKey, '_' + func.name)
+        return entries
+
+    @staticmethod
+    def functionCFG(func):
+        """
+        AsmCFG of func, see Function.cfg. It is rebuilt from BinaryAnalysis.code if it was released
+        :return: AsmCFG or None if func is not disassembled
+        """
+        if func._cfg is None:
+            if not BinaryAnalysis.code.hasFunction(func):
+                return None
+            func._cfg = BinaryAnalysis.code.functionCFG(func, BinaryAnalysis.disasmEngine)
+            BinaryAnalysis.keepCFG(func)
+            BinaryAnalysis.releaseCFGs()
+        else:
+            BinaryAnalysis.keepCFG(func)
+        return func._cfg
+
+    @staticmethod
+    def keepCFG(func):
+        """
+        Mark the AsmCFG of func as the most recently used one
+        """
+        key = id(func)
+        BinaryAnalysis.liveCFGs[key] = func
+        BinaryAnalysis.liveCFGs.move_to_end(key)
+
+    @staticmethod
+    def releaseCFGs():
+        """
+        Drop the AsmCFGs of the least recently used functions beyond LIVE_CFGS, the ones BinaryAnalysis.code owns.
+        The CFGs of the functions not stored yet are kept
+        """
+        live = BinaryAnalysis.liveCFGs
+        code = BinaryAnalysis.code
+        for key, func in list(itertools.islice(live.items(), max(0, len(live) - LIVE_CFGS))):
+            if code.hasFunction(func):
+                del live[key]
+                func._cfg = None
+
+    @staticmethod
+    def addFuncXrefs(func):
+        """
+        Record the calls and jumps found by radare in func
+        """
+        for at, address in func.iterCallRefs():
+            BinaryAnalysis.xrefs.add(address, at, XREF_CALL)
+        for address, source in func.iterCodeXRefs():
+            BinaryAnalysis.xrefs.add(address, source, XREF_CODE)
+
+    @staticmethod
+    def addLine(line, func):
+        """
+        Mark the bytes of line as code and record its references to data
+        """
+        BinaryAnalysis.doneInterval.add(line.offset, line.offset + line.l)
+        for arg in line.args:
+            if isinstance(arg, ExprInt):
+                num = int(arg.arg)
+                if func.hasDataRef(num) and BinaryAnalysis.binaryInfo.inDataSection(num):
+                    # strings take precedence over the sizes guessed from the instructions, see getDataType
+                    if num not in BinaryAnalysis.strings:
+                        BinaryAnalysis.dataType[num] = Utils.typeBySize[arg.size]
+                    BinaryAnalysis.xrefs.add(num, line.offset, XREF_DATA)
+
+    @staticmethod
+    def removeLine(line, func):
+        """
+        Forget the data references recorded by addLine for line
+        """
+        for arg in line.args:
+            if isinstance(arg, ExprInt) and func.hasDataRef(int(arg.arg)):
+                BinaryAnalysis.xrefs.remove(int(arg.arg), line.offset, XREF_DATA)
+
+    @staticmethod
+    @Utils.analysisLocked
+    def patch(address, data):
+        """
+        Write data at address and update the analysis of the code containing it.
+        Only the blocks containing patched bytes are disassembled again: the offsets of the other instructions of
+        their functions are given to dis_multiblock as already done, so the disassembly stops when it reaches them.
+        :return: (start, end) range of addresses whose blocks or data changed
+        """
+        end = address + len(data)
+        # the pending functions are disassembled from the bytes before the patch
+        BinaryAnalysis.loadRange(address, end)
+        code = BinaryAnalysis.code
+        # the CFGs are rebuilt from the bytes before the patch, and held here so that the LRU cannot release them
+        cfgs = [(func, func.cfg) for func in BinaryAnalysis.funcs
+                if not (func.maxBound < address or end <= func.minBound) and code.hasFunction(func)]
+        BinaryAnalysis.rawData.write(BinaryAnalysis.binaryInfo.getOffsetAtAddress(address), data)
+        BinaryAnalysis.container.bin_stream.setbytes(address, data)
+        BinaryAnalysis.disasmEngine.instr_cache.invalidate(address, end)
+        patched = []
+        start, stop = address, end
+        for func, funcCFG in cfgs:
+            func.cfg = funcCFG
+            removed = set()
+            added = []
+            affected = []
+            jobDone = set()
+            for block in func.cfg.blocks:
+                if any(line.offset < end and address < line.offset + line.l for line in block.lines):
+                    affected.append(block)
+                else:
+                    jobDone.update(line.offset for line in block.lines)
+            if not affected:
+                continue
+            for block in affected:
+                start = min(start, block.lines[0].offset)
+                stop = max(stop, block.lines[-1].offset + block.lines[-1].l)
+                for line in block.lines:
+                    BinaryAnalysis.removeLine(line, func)
+                BinaryAnalysis.doneInterval.remove(block.lines[0].offset,
+                                                   block.lines[-1].offset + block.lines[-1].l)
+                func.cfg.del_block(block)
+                removed.add((block.lines[0].offset, func))
+            cfg = AsmCFG(BinaryAnalysis.locDB)
+            for block in affected:
+                BinaryAnalysis.disasmEngine.dis_multiblock(block.lines[0].offset, cfg, jobDone)
+            sizes = dict((block, len(block.lines)) for block in func.cfg.blocks)
+            for block in cfg.blocks:
+                if len(block.lines) > 0 and func.minBound <= block.lines[0].offset < func.maxBound:
+                    func.cfg.add_block(block)
+            # a new jump into an old block splits it
+            func.cfg.apply_splitting(BinaryAnalysis.locDB, dis_block_callback=detect_func_name,
+                                     mn=BinaryAnalysis.machine.mn, attrib=BinaryAnalysis.disasmEngine.attrib,
+                                     pool_bin=BinaryAnalysis.container.bin_stream)
+            for block in func.cfg.blocks:
+                if block in sizes:
+                    if len(block.lines) == sizes[block]:
+                        continue
+                    removed.add((block.lines[0].offset, func))
+                added.append((block, func))
+                for line in block.lines:
+                    BinaryAnalysis.addLine(line, func)
+                start = min(start, block.lines[0].offset)
+                stop = max(stop, block.lines[-1].offset + block.lines[-1].l)
+            func.cfg.rebuild_edges()
+            func.changed = True
+            patched.append(func)
+            BinaryAnalysis.invalidateIR(func)
+            # stored at once, the AsmCFG of func may be released while the next functions are patched
+            code.replaceBlocks(removed, added, BinaryAnalysis.locDB)
+            code.updateLabels(func)
+        # the labels shown in the arguments may have changed
+        BinaryAnalysis.renderCache = OrderedDict()
+        BinaryAnalysis.doneAddress = set(code.blockAddresses[b] for b in code.listedBlocks())
+        # blocks of other functions may share the bytes which were removed from doneInterval
+        for b in code.blocksOverlapping(start, stop):
+            for r in code.rowsOfBlock(b):
+                BinaryAnalysis.doneInterval.add(code.addresses[r], code.addresses[r] + code.lengths[r])
+        return BinaryAnalysis.updateData(start, stop)
+
+    @staticmethod
+    def updateData(start, end):
+        """
+        Recompute the data ranges of the code section between start and end after its coverage changed
+        :return: (start, end) extended to the data ranges which were replaced
+        """
+        codeRanges = [(codeStart, codeEnd) for codeStart, codeEnd in BinaryAnalysis.binaryInfo.codeRange]
+        data = []
+        for dataStart, dataEnd in BinaryAnalysis.data:
+            inCode = any(codeStart <= dataStart < codeEnd for codeStart, codeEnd in codeRanges)
+            if inCode and dataStart <= end and start <= dataEnd + 1:
+                start = min(start, dataStart)
+                end = max(end, dataEnd + 1)
+            else:
+                data.append((dataStart, dataEnd))
+        for codeStart, codeEnd in codeRanges:
+            for gapStart, gapEnd in BinaryAnalysis.doneInterval.gaps(max(start, codeStart), min(end, codeEnd)):
+                data.append((gapStart, gapEnd - 1))
+        BinaryAnalysis.data = sorted(data)
+        return start, end
+
+    @staticmethod
+    def invalidateIR(func):
+        """
+        Mark the cached IR of func as outdated after its blocks were patched and forget the layouts of its IRCFGs.
+        The IR of its blocks is kept, IRAnalysis only lifts again the blocks which changed
+        """
+        entry = BinaryAnalysis.irCache.get(func.address)
+        if entry is not None:
+            BinaryAnalysis.irCache[func.address] = (None, entry[1])
+        for key in [key for key in BinaryAnalysis.layoutCache if key[:2] == ('ir', func.address)]:
+            del BinaryAnalysis.layoutCache[key]
+
+    @staticmethod
+    def getDataType(address):
+        """
+        :return: type of the data at address, strings are looked up in the string index
+        """
+        if address in BinaryAnalysis.dataType:
+            return BinaryAnalysis.dataType[address]
+        if address in BinaryAnalysis.strings:
+            return 'string'
+        return None
+
+    @staticmethod
+    def typedAddresses():
+        """
+        :return: sorted addresses which have a data type
+        """
+        addresses = []
+        for address in heapq.merge(sorted(BinaryAnalysis.dataType), BinaryAnalysis.strings):
+            if not addresses or addresses[-1] != address:
+                addresses.append(address)
+        return addresses
 
     @staticmethod
-    def parseFunc(funcJson, lock):
-        func = Function(funcJson)
-        BinaryAnalysis.funcs.append(func)
+    def parseFunc(funcJson):
+        return Function(funcJson)
 
     @staticmethod
     def clear():
         BinaryAnalysis.path = None
         BinaryAnalysis.container = None
         BinaryAnalysis.machine = None
+        if BinaryAnalysis.rawData is not None:
+            BinaryAnalysis.rawData.close()
         BinaryAnalysis.rawData = None
         BinaryAnalysis.iraType = None
         BinaryAnalysis.disasmEngine = None
         BinaryAnalysis.binaryInfo = None
+        BinaryAnalysis.sb = None
+        if BinaryAnalysis.radare is not None:
+            BinaryAnalysis.radare.quit()
         BinaryAnalysis.radare = None
+        BinaryAnalysis.db = None
+        BinaryAnalysis.workers = None
         BinaryAnalysis.funcs = []
-        BinaryAnalysis.blocks = []
+        BinaryAnalysis.code = InstructionStore()
         BinaryAnalysis.dataType = {}
-        BinaryAnalysis.dataXrefs = {}
+        BinaryAnalysis.xrefs = XrefIndex()
         BinaryAnalysis.doneAddress = set()
-        BinaryAnalysis.doneInterval = interval()
+        BinaryAnalysis.doneInterval = CoverageMap()
         BinaryAnalysis.data = []
         BinaryAnalysis.locDB = None
-        BinaryAnalysis.strings = {}
\ No newline at end of file
+        BinaryAnalysis.strings = {}
+        BinaryAnalysis.allStrings = {}
+        BinaryAnalysis.irCache = {}
+        BinaryAnalysis.liveCFGs = OrderedDict()
+        BinaryAnalysis.layoutCache = {}
+        BinaryAnalysis.renderCache = OrderedDict()
+        BinaryAnalysis.decodeStats = None
+        BinaryAnalysis.stopBackground()
+        BinaryAnalysis.pending = None
+        BinaryAnalysis.failedFunctions = {}
+        # the expressions of the unloaded binary are freed with their last user
+        Expr.release_recent()
\ No newline at end of file
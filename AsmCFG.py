@@ -3,16 +3,11 @@ from functools import partial
 from PyQt5.QtCore import Qt
 from PyQt5.QtCore import pyqtSignal
 from PyQt5.QtWidgets import QMenu, QAction, QApplication
-from grandalf.graphs import Vertex, Edge, Graph
-from grandalf.layouts import SugiyamaLayout
-from grandalf.routing import route_with_lines
-from miasm.analysis.data_flow import DiGraphDefUse, ReachingDefinitions, AssignblkNode
-from miasm.analysis.depgraph import DependencyGraph
-from future.utils import viewitems
 
 from Analysis import BinaryAnalysis
-from CFG import CFG, BasicBlock, BasicEdge
-from CommonView import AsmLineNoOpcode, LocLine
+from CFG import CFG, BasicBlock, BasicEdge, BlockItem
+from CommonView import AsmLineNoOpcode, LocLine, textLength
+from Scheduler import PRIORITY_VIEW, getScheduler
 from miasm.expression.expression import ExprId, Expr
 
 
@@ -27,18 +22,7 @@ class AsmBlockView(BasicBlock):
         self.endLockey = endLockey
         for block in blocks:
             for line in block.lines:
-                detectBlock = None
-                for block in func.cfg.blocks:
-                    if detectBlock is None:
-                        for line2 in block.lines:
-                            if line == line2:
-                                detectBlock = block
-                                break
-                asmLine = AsmLineNoOpcode(line, detectBlock, func)
-                self.model.appendRow(asmLine)
-        self.setSize()
-        self.w = self.width()
-        self.h = self.height()
+                self.model.appendRow(AsmLineNoOpcode(line, block.loc_key, func))
         self.toHexAct = QAction("Follow hex view", self)
 
     def mouseDoubleClickEvent(self, event):
@@ -67,8 +51,10 @@ class AsmCFGView(CFG):
         self.findDepAct.triggered.connect(self.findDep)
 
     def initView(self):
+        from IRAnalysis import blockHash
         cfg = self.func.cfg
-        vertexs = {}
+        items = {}
+        hashes = {}
         done = set()
         for block in cfg.blocks:
             if block in done:
@@ -85,41 +71,37 @@ class AsmCFGView(CFG):
                 blocks.append(block)
                 endLockey = block.loc_key
                 done.add(block)
-            vertex = Vertex(startLockey)
-            vertexs[startLockey] = vertex
-            vertex.view = AsmBlockView(startLockey, endLockey, blocks, self.func)
+            name = LocLine.locName(startLockey)
+            lines = [line for block in blocks for line in block.lines]
+            item = BlockItem(startLockey, (endLockey, blocks), name,
+                             [len(name)] + [textLength(AsmLineNoOpcode.lineComponents(line)[1]) for line in lines])
+            item.addresses = frozenset(line.offset for line in lines)
+            items[startLockey] = item
+            hashes[item] = b''.join(blockHash(block) for block in blocks)
         edges = []
-        for src in vertexs.values():
-            successLocKeys = cfg.successors(src.view.endLockey)
-            for key in successLocKeys:
-                vSrc = vertexs[src.view.lockey]
-                vDst = vertexs[key]
-                edge = Edge(vSrc, vDst)
-                edge.view = BasicEdge(vDst)
-                edges.append(edge)
-                vSrc.view.outBlocks.append(vDst.view)
-                vDst.view.inBlocks.append(vSrc.view)
-        self.graph = Graph(vertexs.values(), edges)
-        sugLayout = SugiyamaLayout(self.graph.C[0])
-        sugLayout.route_edge = route_with_lines
-        sugLayout.init_all()
-        sugLayout.draw()
-        for v in vertexs.values():
-            self.addBlock(v.view, v.view.xy[0] - (v.view.w / 2), v.view.xy[1] - (v.view.h / 2))
-            v.view.gotoAddress.connect(self.selectAddress)
-        for e in edges:
-            srcView = e.v[0].view
-            srcBlock = e.v[0].data
-            dstBlock = e.v[1].data
-            if len(srcView.outBlocks) == 1:
+        for srcItem in items.values():
+            endLockey, _ = srcItem.data
+            for key in cfg.successors(endLockey):
+                dstItem = items[key]
+                edges.append((srcItem, dstItem, BasicEdge(dstItem)))
+                srcItem.outBlocks.append(dstItem)
+                dstItem.inBlocks.append(srcItem)
+        self.placeBlocks(('asm', self.func.address), hashes, edges)
+        for srcItem, dstItem, edgeView in edges:
+            if len(srcItem.outBlocks) == 1:
                 color = Qt.darkBlue
-            elif dstBlock == cfg.successors(srcBlock)[0]:
+            elif dstItem.lockey == cfg.successors(srcItem.data[0])[0]:
                 color = Qt.darkRed
             else:
                 color = Qt.darkGreen
-            edge_view = e.view
-            edge_view.color = color
-            self.scene.addItem(edge_view)
+            edgeView.color = color
+            self.scene.addItem(edgeView)
+
+    def createBlockView(self, item):
+        endLockey, blocks = item.data
+        view = AsmBlockView(item.lockey, endLockey, blocks, self.func)
+        view.gotoAddress.connect(self.selectAddress)
+        return view
 
     def keyReleaseEvent(self, event) -> None:
         modifier = QApplication.keyboardModifiers()
@@ -135,6 +117,8 @@ class AsmCFGView(CFG):
         super(AsmCFGView, self).keyReleaseEvent(event)
 
     def contextMenuEvent(self, event) -> None:
+        if self.clickedBlock is None:
+            return
         menu = QMenu(self)
         line = self.clickedBlock.getLineSelected()
         self.clickedBlock.getClickedIndex(line)
@@ -158,66 +142,29 @@ class AsmCFGView(CFG):
         self.gotoHexView.emit(offset, lenData)
 
     def highlightText(self, clickedBlock, text, index):
-        for block in self.mapItems:
-            if block != clickedBlock:
-                if index > 0:
-                    start = 1
-                else:
-                    start = 0
-                block.highlighRelation(text, start)
+        if index > 0:
+            start = 1
+        else:
+            start = 0
+        self.highlightBlocks(clickedBlock, text, start)
 
     def taintAnalysis(self, item):
-        func = item.func
-        if func.ircfg is None:
-            func.ira = BinaryAnalysis.iraType(func.cfg.loc_db)
-            func.ircfg = func.ira.new_ircfg_from_asmcfg(func.cfg)
-            func.defUse = DiGraphDefUse(ReachingDefinitions(func.ircfg))
-        current_block = func.ircfg.get_block(item.block.loc_key)
-        index = 0
-        dstArg = None
-        for index, assignblk in enumerate(current_block):
-            if assignblk.instr.offset == item.address:
-                for dst, src in assignblk.items():
-                    dstArg = dst
-                break
-        queue = [AssignblkNode(item.block.loc_key, index, dstArg)]
-        currentPoint = 0
-        endPoint = 0
-        while currentPoint <= endPoint:
-            node = queue[currentPoint]
-            currentPoint += 1
-            assign = func.ircfg.blocks[node.label][node.index]
-            self.selectAddress(assign.instr.offset, False, False)
-            for node2 in func.defUse.successors(node):
-                endPoint += 1
-                queue.append(node2)
+        from IRAnalysis import taintedAddresses
+        task = getScheduler().submit(taintedAddresses, item.func, item.lockey, item.address,
+                                     priority=PRIORITY_VIEW, name='Taint of %#x' % item.address)
+        task.finished.connect(self.showTainted)
+        task.failed.connect(self.log.emit)
+
+    def showTainted(self, addresses):
+        for address in addresses:
+            self.selectAddress(address, False, False)
 
     def findDep(self):
+        from IRAnalysis import dependencyReport
         item = self.clickedBlock.getLineSelected()
         arg = item.args[self.clickedBlock.lastClickIndex]
         address = item.address + item.instr.l
-        func = item.func
-        if func.ircfg is None:
-            func.ira = BinaryAnalysis.iraType(func.cfg.loc_db)
-            func.ircfg = func.ira.new_ircfg_from_asmcfg(func.cfg)
-            func.defUse = DiGraphDefUse(ReachingDefinitions(func.ircfg))
-        indexReg = eval('BinaryAnalysis.machine.mn.regs.regs' + str(arg.size).zfill(2) + '_expr').index(arg)
-        arg = eval('BinaryAnalysis.machine.mn.regs.regs' + str(BinaryAnalysis.disasmEngine.attrib).zfill(2) + '_expr')[indexReg]
-        elements = set()
-        elements.add(arg)
-        depgraph = DependencyGraph(func.ircfg, implicit=False, apply_simp=True, follow_call=False, follow_mem=True)
-        currentLockey = next(iter(func.ircfg.getby_offset(address)))
-        assignblkIndex = 0
-        currentBlock = func.ircfg.get_block(currentLockey)
-        for assignblkIndex, assignblk in enumerate(currentBlock):
-            if assignblk.instr.offset == address:
-                break
-        outputLog = ''
-        for solNum, sol in enumerate(depgraph.get(currentBlock.loc_key, elements, assignblkIndex, set())):
-            results = sol.emul(func.ira, ctx={})
-            outputLog += 'Solution %d:\n' % solNum
-            for k, v in viewitems(results):
-                outputLog += str(k) + ' = ' + str(v) + '\n'
-            path = ' -> '.join(BinaryAnalysis.locDB.pretty_str(h) for h in sol.history[::-1])
-            outputLog += path + '\n\n'
-        self.log.emit(outputLog)
+        task = getScheduler().submit(dependencyReport, item.func, address, arg, priority=PRIORITY_VIEW,
+                                     name='Dependencies of %s' % arg)
+        task.finished.connect(self.log.emit)
+        task.failed.connect(self.log.emit)
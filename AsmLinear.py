@@ -2,19 +2,18 @@ from functools import partial
 import sys
 from io import StringIO
 
-from PyQt5.QtCore import pyqtSignal, Qt
+from PyQt5.QtCore import pyqtSignal, QPoint, Qt, QTimer
 from PyQt5.QtWidgets import QApplication, QAbstractItemView, QDialog, QHBoxLayout, QMenu, QAction, QInputDialog, \
     QMessageBox
-from future.utils import viewitems
-from miasm.analysis.data_flow import DiGraphDefUse, ReachingDefinitions, AssignblkNode
-from miasm.analysis.depgraph import DependencyGraph
 from miasm.core.utils import Disasm_Exception
 from miasm.expression.expression import Expr, ExprId, ExprInt
 
+import Utils
 from Analysis import BinaryAnalysis
 from CommonView import AsmLineWithOpcode, LocLine, DataLine, AsmLineNoOpcode
 from CommonView import CommonListView
-from Utils import sizeByType
+from LinearModel import LinearModel, LinearAddressMap
+from Scheduler import PRIORITY_VIEW, getScheduler, whenAnalysisFree
 
 
 class AsmLinear(CommonListView):
@@ -27,6 +26,7 @@ class AsmLinear(CommonListView):
     def __init__(self):
         super(AsmLinear, self).__init__()
         self.setSelectionMode(QAbstractItemView.ExtendedSelection)
+        self.setUniformItemSizes(True)
         self.initModel()
         self.hookCode = {}
         self.emulateView = None
@@ -47,67 +47,64 @@ class AsmLinear(CommonListView):
         self.upgradeAct.triggered.connect(self.upgrade)
         self.downgradeAct = QAction("Downgrade data", self)
         self.downgradeAct.triggered.connect(self.downgrade)
+        # in lazy mode the functions scrolled into view are disassembled once the scrolling settles
+        self.loadTimer = QTimer(self)
+        self.loadTimer.setSingleShot(True)
+        self.loadTimer.timeout.connect(self.loadVisible)
+        self.verticalScrollBar().valueChanged.connect(lambda value: self.loadTimer.start())
 
     def initModel(self):
-        codePoint = 0
-        dataPoint = 0
-        code = BinaryAnalysis.blocks[codePoint]
-        data = BinaryAnalysis.data[dataPoint]
-        while codePoint < len(BinaryAnalysis.blocks) or dataPoint < len(BinaryAnalysis.data):
-            if codePoint < len(BinaryAnalysis.blocks) and (
-                    (code[0].lines[0].offset < data[0]) or (dataPoint == len(BinaryAnalysis.data))):
-                pres = code[1].cfg.predecessors(code[0].loc_key)
-                if len(pres) == 1:
-                    preBlock = code[1].cfg.loc_key_to_block(pres[0])
-                    if preBlock.lines[-1].name != 'CALL':
-                        item = LocLine(code[0].loc_key, code[1])
-                        address = code[0].lines[0].offset
-                        if address in code[1].codeXRefs:
-                            item.xrefs = code[1].codeXRefs[address]
-                        self.model.appendRow(item)
-                else:
-                    item = LocLine(code[0].loc_key, code[1])
-                    address = code[0].lines[0].offset
-                    if address in code[1].codeXRefs:
-                        item.xrefs = code[1].codeXRefs[address]
-                    self.model.appendRow(item)
-                for line in code[0].lines:
-                    item = AsmLineWithOpcode(line, code[0], code[1])
-                    self.addressMap[item.address] = item
-                    self.model.appendRow(item)
-                codePoint += 1
-                if codePoint < len(BinaryAnalysis.blocks):
-                    code = BinaryAnalysis.blocks[codePoint]
-            elif dataPoint < len(BinaryAnalysis.data):
-                i, end = data
-                if i == 0x400840:
-                    pass
-                while i <= end:
-                    if i in BinaryAnalysis.dataType:
-                        typeData = BinaryAnalysis.dataType[i]
-                        if i in BinaryAnalysis.dataXrefs:
-                            xrefs = BinaryAnalysis.dataXrefs[i]
-                        else:
-                            xrefs = None
-                        if typeData == 'string':
-                            data = BinaryAnalysis.strings[i]
-                        else:
-                            data = BinaryAnalysis.container.bin_stream.getbytes(i, sizeByType[typeData])
-                    else:
-                        xrefs = None
-                        typeData = 'byte'
-                        data = BinaryAnalysis.container.bin_stream.getbytes(i, 1)
-                    if typeData == 'string':
-                        item = DataLine(i, data.replace('\n', ''), typeData)
-                    else:
-                        item = DataLine(i, data, typeData)
-                    item.xrefs = xrefs
-                    self.addressMap[i] = item
-                    self.model.appendRow(item)
-                    i += len(data)
-                dataPoint += 1
-                if dataPoint < len(BinaryAnalysis.data):
-                    data = BinaryAnalysis.data[dataPoint]
+        self.model = LinearModel(self)
+        self.setModel(self.model)
+        self.addressMap = LinearAddressMap(self.model)
+
+    @whenAnalysisFree
+    def loadRange(self, start, end):
+        """
+        Disassemble the pending functions of [start, end) in lazy mode and rebuild their rows
+        """
+        self.refreshLoaded(BinaryAnalysis.loadRange(start, end))
+
+    def refreshLoaded(self, changed):
+        """
+        Rebuild the rows of the range changed by loading functions, the first visible address stays at the top
+        :param changed: (start, end) returned by BinaryAnalysis.loadFunctions or None
+        """
+        if changed is None:
+            return
+        top = self.indexAt(QPoint(0, 0))
+        topAddress = self.getItemFormIndex(top).address if top.isValid() else None
+        self.model.refreshRange(*changed)
+        if topAddress is not None:
+            row = self.model.rowOfAddress(topAddress)
+            if row != -1:
+                self.scrollTo(self.model.index(row, 0), QAbstractItemView.PositionAtTop)
+
+    def loadVisible(self):
+        if BinaryAnalysis.pending is None or self.model.rowCount() == 0 or not self.isVisible():
+            return
+        top = self.indexAt(QPoint(0, 0)).row()
+        bottom = self.indexAt(QPoint(0, self.viewport().height() - 1)).row()
+        if top == -1:
+            top = 0
+        if bottom == -1:
+            bottom = self.model.rowCount() - 1
+        with Utils.tryAnalysisLock() as locked:
+            if not locked:
+                # a task uses the analysis, try again later
+                self.loadTimer.start()
+                return
+            changed = BinaryAnalysis.loadRange(self.getItem(top).address, self.getItem(bottom).address + 1)
+        self.refreshLoaded(changed)
+
+    def showEvent(self, event):
+        super(AsmLinear, self).showEvent(event)
+        self.loadTimer.start()
+
+    @whenAnalysisFree
+    def focusAddress(self, address, focus=True):
+        self.loadRange(address, address + 1)
+        super(AsmLinear, self).focusAddress(address, focus)
 
     def mouseDoubleClickEvent(self, event) -> None:
         index = self.selectedIndexes()[0]
@@ -150,7 +147,7 @@ class AsmLinear(CommonListView):
             if arg is not None and isinstance(arg, ExprId):
                 menu.addAction(self.findDepAct)
                 self.findDepAct.triggered.connect(partial(self.findDep, item))
-        if (item.xrefs is not None) and len(item.xrefs) > 0:
+        if self.itemXrefs(item):
             menu.addAction(self.showXrefsAct)
         if not isinstance(item, LocLine):
             menu.addAction(self.toHexView)
@@ -166,32 +163,20 @@ class AsmLinear(CommonListView):
     def upgrade(self):
         index = self.selectedIndexes()[0]
         item = self.getItemFormIndex(index)
-        data = self.countData(index.row())
-        data = item.data + data[:len(item.data)]
-        address = item.address
         if item.typeData == 'byte':
             typeData = 'short'
         elif item.typeData == 'short':
             typeData = 'int'
         elif item.typeData == 'int':
             typeData = 'long'
-        count = 0
-        row = index.row()
-        while count < len(data):
-            item = self.getItem(row)
-            count += len(item.data)
-            self.model.removeRow(index.row())
-            row += 1
-        newDataLine = DataLine(address, data, typeData)
-        self.model.insertRow(index.row(), newDataLine)
-        self.focusItem(index)
-
+        BinaryAnalysis.dataType[item.address] = typeData
+        self.model.refreshData(item.address)
+        self.focusItem(self.model.index(self.model.rowOfAddress(item.address), 0))
 
     def downgrade(self):
         index = self.selectedIndexes()[0]
         item = self.getItem(index.row())
-        data = item.data
-        length = len(data)
+        length = len(item.data)
         if length == 2:
             typeData = 'byte'
         elif length == 4:
@@ -200,56 +185,35 @@ class AsmLinear(CommonListView):
             typeData = 'int'
         address = item.address
         half = length // 2
-        self.model.removeRow(index.row())
-        newDataLine1 = DataLine(address, data[0: half], typeData)
-        newDataLine2 = DataLine(address + half, data[half:], typeData)
-        self.model.insertRow(index.row(), newDataLine2)
-        self.model.insertRow(index.row(), newDataLine1)
-        self.focusItem(index)
+        BinaryAnalysis.dataType[address] = typeData
+        BinaryAnalysis.dataType[address + half] = typeData
+        self.model.refreshData(address)
+        self.focusItem(self.model.index(self.model.rowOfAddress(address), 0))
 
     def fillNop(self):
-        indexs = self.selectedIndexes()
-        row = indexs[0].row()
-        fIndex = None
-        block = None
-        func = None
-        lenBytes = 0
-        fIndexBlock = -1
-        for index in indexs:
-            if fIndex is None:
-                fIndex = index
-            line = self.getItemFormIndex(fIndex)
-            if block is None:
-                block = line.block
-                func = line.func
-                startAddress = line.instr.offset
-            lenBytes += line.instr.l
-            if line.instr in block.lines:
-                if fIndexBlock == -1:
-                    fIndexBlock = block.lines.index(line.instr)
-                block.lines.remove(line.instr)
-                func.changed = True
-            self.model.removeRow(row)
-        for i in range(lenBytes):
-            nopInstr = BinaryAnalysis.machine.mn.dis(b'\x90', BinaryAnalysis.disasmEngine.attrib)
-            nopInstr.offset = startAddress + i
-            block.lines.insert(fIndexBlock + i, nopInstr)
-            instrView = AsmLineWithOpcode(nopInstr, block, func)
-            self.addressMap[startAddress + i] = instrView
-            self.model.insertRow(row, instrView)
-            row += 1
-        self.changedData.emit(BinaryAnalysis.binaryInfo.getOffsetAtAddress(startAddress), b'\x90' * lenBytes)
-        self.focusItem(fIndex)
+        rows = sorted(index.row() for index in self.selectedIndexes())
+        lines = [self.getItem(row) for row in rows]
+        startAddress = lines[0].instr.offset
+        lenBytes = sum(line.instr.l for line in lines)
+        self.patch(startAddress, b'\x90' * lenBytes)
+        self.focusItem(self.model.index(rows[0], 0))
+
+    @whenAnalysisFree
+    def patch(self, address, data):
+        """
+        Write data at address then rebuild the rows of the code which was disassembled again
+        """
+        self.loadRange(address, address + len(data))
+        start, end = BinaryAnalysis.patch(address, data)
+        self.model.refreshRange(start, end)
+        self.changedData.emit(BinaryAnalysis.binaryInfo.getOffsetAtAddress(address), data)
 
     def replaceAsm(self):
         indexes = self.selectedIndexes()
         totalBytes = 0
         lastIndex = 0
         fLine = self.getItemFormIndex(indexes[0])
-        block = fLine.block
-        func = fLine.func
         startAddress = fLine.instr.offset
-        fIndexBlock = block.lines.index(fLine.instr)
         for index in indexes:
             line = self.getItemFormIndex(index)
             totalBytes += line.instr.l
@@ -284,57 +248,36 @@ class AsmLinear(CommonListView):
                     except Disasm_Exception:
                         is_valid = False
             if is_valid:
-                if (totalNewInstr <= totalBytes) or (totalNewInstr <= totalBytes + totalNop):
-                    row = None
-                    fIndex = None
-                    for index in indexes:
-                        if row is None:
-                            row = index.row()
-                            fIndex = index
-                            address = self.getItemFormIndex(index).instr.offset
-                        self.model.removeRow(row)
-                        del block.lines[fIndexBlock]
-                        func.changed = True
-                    if totalNewInstr > totalBytes:
-                        for i in range(totalBytes + totalNop - totalNewInstr):
-                            self.model.removeRow(row)
-                            del block.lines[fIndexBlock]
-                    dataChange = b''
-                    for i in range(len(listInstrs)):
-                        instr = listInstrs[i]
-                        instr.offset = address
-                        dataChange += instr.b
-                        block.lines.insert(fIndexBlock + i, instr)
-                        instrView = AsmLineWithOpcode(instr, block, func)
-                        self.addressMap[address] = instrView
-                        address += len(instr.b)
-                        self.model.insertRow(row, instrView)
-                        row += 1
-                    remain_nop = totalBytes - totalNewInstr
-                    for i in range(remain_nop):
-                        nopInstr = BinaryAnalysis.machine.mn.dis(b'\x90', BinaryAnalysis.disasmEngine.attrib)
-                        nopInstr.offset = address + i
-                        instrView = AsmLineWithOpcode(nopInstr, block, func)
-                        block.lines.insert(fIndexBlock + len(listInstrs) + i, nopInstr)
-                        self.addressMap[address + i] = instrView
-                        self.model.insertRow(row, instrView)
-                        dataChange += b'\x90'
-                        row += 1
-                    self.focusItem(fIndex)
-                    self.changedData.emit(BinaryAnalysis.binaryInfo.getOffsetAtAddress(startAddress), dataChange)
+                if totalNewInstr <= totalBytes + totalNop:
+                    fRow = min(index.row() for index in indexes)
+                    dataChange = b''.join(instr.b for instr in listInstrs)
+                    # the following nops are overwritten when the new code is longer
+                    dataChange += b'\x90' * (totalBytes - totalNewInstr)
+                    self.patch(startAddress, dataChange)
+                    self.focusItem(self.model.index(fRow, 0))
                 else:
                     QMessageBox.warning(self, "Assemble", "Can't assemble. New assembly code longer than older")
             else:
                 QMessageBox.warning(self, "Assemble", "Invalid assembly code")
 
+    @staticmethod
+    def itemXrefs(item):
+        """
+        :return: sorted addresses referencing the label or the data of item
+        """
+        if isinstance(item, (LocLine, DataLine)):
+            return BinaryAnalysis.xrefs.sourcesTo(item.address)
+        return []
+
     def showXrefs(self):
         indexes = self.selectedIndexes()
         if len(indexes) == 1:
             index = indexes[0]
             item = self.getItemFormIndex(index)
-            if item.xrefs:
+            xrefs = self.itemXrefs(item)
+            if xrefs:
                 items = []
-                for address in item.xrefs:
+                for address in xrefs:
                     if address in self.addressMap:
                         items.append(self.addressMap[address])
                 title = "X-References "
@@ -348,60 +291,24 @@ class AsmLinear(CommonListView):
                 xrefsDialog.show()
 
     def taintAnalysis(self, item):
-        func = item.func
-        if func.ircfg is None:
-            func.ira = BinaryAnalysis.iraType(func.cfg.loc_db)
-            func.ircfg = func.ira.new_ircfg_from_asmcfg(func.cfg)
-            func.defUse = DiGraphDefUse(ReachingDefinitions(func.ircfg))
-        current_block = func.ircfg.get_block(item.block.loc_key)
-        index = 0
-        dstArg = None
-        for index, assignblk in enumerate(current_block):
-            if assignblk.instr.offset == item.address:
-                for dst, src in assignblk.items():
-                    dstArg = dst
-                break
-        queue = [AssignblkNode(item.block.loc_key, index, dstArg)]
-        currentPoint = 0
-        endPoint = 0
-        while currentPoint <= endPoint:
-            node = queue[currentPoint]
-            currentPoint += 1
-            assign = func.ircfg.blocks[node.label][node.index]
-            self.focusAddress(assign.instr.offset, False)
-            for node2 in func.defUse.successors(node):
-                endPoint += 1
-                queue.append(node2)
+        from IRAnalysis import taintedAddresses
+        task = getScheduler().submit(taintedAddresses, item.func, item.lockey, item.address,
+                                     priority=PRIORITY_VIEW, name='Taint of %#x' % item.address)
+        task.finished.connect(self.showTainted)
+        task.failed.connect(self.log.emit)
+
+    def showTainted(self, addresses):
+        for address in addresses:
+            self.focusAddress(address, False)
 
     def findDep(self, item):
+        from IRAnalysis import dependencyReport
         arg = item.args[self.lastClickIndex]
         address = item.address + item.instr.l
-        func = item.func
-        if func.ircfg is None:
-            func.ira = BinaryAnalysis.iraType(func.cfg.loc_db)
-            func.ircfg = func.ira.new_ircfg_from_asmcfg(func.cfg)
-            func.defUse = DiGraphDefUse(ReachingDefinitions(func.ircfg))
-        indexReg = eval('BinaryAnalysis.machine.mn.regs.regs' + str(arg.size).zfill(2) + '_expr').index(arg)
-        arg = eval('BinaryAnalysis.machine.mn.regs.regs' + str(BinaryAnalysis.disasmEngine.attrib).zfill(2) + '_expr')[
-            indexReg]
-        elements = set()
-        elements.add(arg)
-        depgraph = DependencyGraph(func.ircfg, implicit=False, apply_simp=True, follow_call=False, follow_mem=True)
-        currentLockey = next(iter(func.ircfg.getby_offset(address)))
-        assignblkIndex = 0
-        currentBlock = func.ircfg.get_block(currentLockey)
-        for assignblkIndex, assignblk in enumerate(currentBlock):
-            if assignblk.instr.offset == address:
-                break
-        outputLog = ''
-        for solNum, sol in enumerate(depgraph.get(currentBlock.loc_key, elements, assignblkIndex, set())):
-            results = sol.emul(func.ira, ctx={})
-            outputLog += 'Solution %d:\n' % solNum
-            for k, v in viewitems(results):
-                outputLog += str(k) + ' = ' + str(v) + '\n'
-            path = ' -> '.join(BinaryAnalysis.locDB.pretty_str(h) for h in sol.history[::-1])
-            outputLog += path + '\n\n'
-        self.log.emit(outputLog)
+        task = getScheduler().submit(dependencyReport, item.func, address, arg, priority=PRIORITY_VIEW,
+                                     name='Dependencies of %s' % arg)
+        task.finished.connect(self.log.emit)
+        task.failed.connect(self.log.emit)
 
     def hook(self, jitter):
         address = jitter.pc
@@ -490,7 +397,7 @@ class XrefsView(QDialog):
         self.setWindowTitle(title)
         self.listInstrs = CommonListView()
         for item in items:
-            self.listInstrs.model.appendRow(AsmLineNoOpcode(item.instr, item.block, item.func))
+            self.listInstrs.model.appendRow(AsmLineNoOpcode(item.instr, item.lockey, item.func))
         self.listInstrs.dblAddress.connect(self.finish)
         self.layout = QHBoxLayout(self)
         self.layout.addWidget(self.listInstrs)
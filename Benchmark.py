@@ -0,0 +1,392 @@
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import Utils
+
+CORPUS_DIR = os.path.join(os.path.expanduser('~'), '.nkn', 'benchmark')
+SEED = 1234
+# bytes reserved for every function of the generated PE binaries
+SLOT_SIZE = 0x200
+IMPORTS = ['ExitProcess', 'GetStdHandle', 'WriteFile']
+# name, format, arch, number of functions, compiler options of the ELF binaries
+CORPUS = [
+    ('elf64-small-O0', 'ELF', 'x86_64', 20, ['-O0']),
+    ('elf64-small-O2', 'ELF', 'x86_64', 20, ['-O2']),
+    ('elf64-medium-O0', 'ELF', 'x86_64', 200, ['-O0']),
+    ('elf64-medium-O2', 'ELF', 'x86_64', 200, ['-O2']),
+    ('elf32-small-O0', 'ELF', 'x86_32', 20, ['-O0', '-m32']),
+    ('pe32-small', 'PE', 'x86_32', 20, None),
+    ('pe64-small', 'PE', 'x86_64', 20, None),
+    ('pe64-medium', 'PE', 'x86_64', 200, None),
+]
+INIT_STAGES = ['load', 'sandbox', 'strings', 'dbload', 'radare', 'functions', 'disassembly', 'merge', 'instructions',
+               'xrefs', 'coverage', 'dbsave']
+VIEW_STAGES = ['model', 'background', 'lift', 'ssa', 'maxir', 'layout']
+
+
+# ============================== corpus ==============================
+
+def cSource(numFuncs, rand):
+    """
+    C program with numFuncs functions made of loops, switches, calls and references to strings and globals
+    """
+    lines = ['#include <stdio.h>', '#include <string.h>', '']
+    for i in range(numFuncs):
+        lines.append('const char *s%d = "benchmark string %d %s";' % (i, i, 'x' * rand.randint(0, 24)))
+    lines.append('int table[256];')
+    lines.append('')
+    for i in range(numFuncs):
+        callee = rand.randint(i + 1, numFuncs - 1) if i + 1 < numFuncs else None
+        lines.append('__attribute__((noinline)) int f%d(int x) {' % i)
+        lines.append('    int r = %d;' % rand.randint(0, 100))
+        for j in range(rand.randint(1, 4)):
+            lines.append('    for (int i%d = 0; i%d < x %% %d; i%d++) {' % (j, j, rand.randint(3, 17), j))
+            lines.append('        r += table[(r + i%d) & 0xff] ^ %d;' % (j, rand.randint(0, 1 << 16)))
+            lines.append('        if (r & %d) r -= strlen(s%d);' % (1 << rand.randint(0, 7), rand.randrange(numFuncs)))
+            lines.append('    }')
+        lines.append('    switch (x & 7) {')
+        for case in range(rand.randint(2, 7)):
+            lines.append('    case %d: r ^= %d; break;' % (case, rand.randint(0, 1 << 20)))
+        lines.append('    default: puts(s%d);' % i)
+        lines.append('    }')
+        if callee is not None:
+            lines.append('    if (r > %d) r += f%d(x - 1);' % (rand.randint(0, 1000), callee))
+        lines.append('    table[x & 0xff] = r;')
+        lines.append('    return r;')
+        lines.append('}')
+        lines.append('')
+    lines.append('int main(int argc, char **argv) {')
+    lines.append('    int r = 0;')
+    for i in range(0, numFuncs, max(1, numFuncs // 16)):
+        lines.append('    r += f%d(argc + %d);' % (i, i))
+    lines.append('    return r & 0xff;')
+    lines.append('}')
+    return '\n'.join(lines) + '\n'
+
+
+def asmSources(numFuncs, arch, dataAddress, rand):
+    """
+    x86 assembly of main and of numFuncs functions made of loops, conditional branches, calls and reads of the
+    data section
+    :return: list of sources, one per function
+    """
+    if arch == 'x86_64':
+        ax, cx, bp, sp, ptr, size = 'RAX', 'RCX', 'RBP', 'RSP', 'QWORD', 8
+    else:
+        ax, cx, bp, sp, ptr, size = 'EAX', 'ECX', 'EBP', 'ESP', 'DWORD', 4
+    lines = ['main:']
+    for i in range(0, numFuncs, max(1, numFuncs // 16)):
+        lines.append('    CALL f%d' % i)
+    # ExitProcess, the first entry of the import address table which starts 0x100 bytes before the globals
+    lines.append('    CALL %s PTR [0x%x]' % (ptr, dataAddress - 0x100))
+    lines.append('    RET')
+    sources = ['\n'.join(lines) + '\n']
+    for i in range(numFuncs):
+        lines = ['f%d:' % i]
+        lines.append('    PUSH %s' % bp)
+        lines.append('    MOV %s, %s' % (bp, sp))
+        lines.append('    MOV %s, 0x%x' % (cx, rand.randint(1, 100)))
+        for j in range(rand.randint(1, 4)):
+            lines.append('f%d_loop%d:' % (i, j))
+            lines.append('    ADD %s, %s PTR [0x%x]' % (ax, ptr, dataAddress + size * rand.randrange(256)))
+            lines.append('    CMP %s, 0x%x' % (ax, rand.randint(0, 1 << 16)))
+            lines.append('    JG f%d_skip%d' % (i, j))
+            if i + 1 < numFuncs:
+                lines.append('    CALL f%d' % rand.randint(i + 1, numFuncs - 1))
+            lines.append('    XOR %s, 0x%x' % (ax, rand.randint(0, 1 << 16)))
+            lines.append('f%d_skip%d:' % (i, j))
+            lines.append('    DEC %s' % cx)
+            lines.append('    JNZ f%d_loop%d' % (i, j))
+        lines.append('    MOV %s PTR [0x%x], %s' % (ptr, dataAddress + size * rand.randrange(256), ax))
+        lines.append('    POP %s' % bp)
+        lines.append('    RET')
+        sources.append('\n'.join(lines) + '\n')
+    return sources
+
+
+def assemble(arch, sources, address):
+    """
+    Assemble every function in its own SLOT_SIZE bytes slot, function i starts at address + i * SLOT_SIZE.
+    The addresses of all functions are known beforehand, so the calls between them are resolved while the
+    functions are assembled one by one, instead of letting miasm place the blocks of the whole program.
+    :param sources: list of sources starting with the label of their function
+    :return: bytes of the slots
+    """
+    from miasm.analysis.machine import Machine
+    from miasm.core import asmblock, parse_asm
+    from miasm.core.locationdb import LocationDB
+    machine = Machine(arch)
+    attrib = 64 if arch == 'x86_64' else 32
+    names = [source.split(':', 1)[0] for source in sources]
+    code = bytearray(b'\xcc' * (SLOT_SIZE * len(sources)))
+    for i, source in enumerate(sources):
+        asmcfg, locDB = parse_asm.parse_txt(machine.mn, attrib, source, LocationDB())
+        for j, name in enumerate(names):
+            locKey = locDB.get_name_location(name)
+            if locKey is not None:
+                locDB.set_location_offset(locKey, address + j * SLOT_SIZE)
+        for offset, data in asmblock.asm_resolve_final(machine.mn, asmcfg, locDB).items():
+            if offset + len(data) > address + (i + 1) * SLOT_SIZE:
+                raise ValueError('%s is larger than %d bytes' % (names[i], SLOT_SIZE))
+            code[offset - address:offset - address + len(data)] = data
+    return bytes(code)
+
+
+def buildPE(path, arch, numFuncs, seed):
+    from miasm.loader import pe_init
+    imageBase = 0x400000
+    pe = pe_init.PE(wsize=64 if arch == 'x86_64' else 32)
+    pe.Opthdr.ImageBase = imageBase
+    rand = random.Random(seed)
+    strings = b''.join(b'benchmark string %d %s\x00' % (i, b'x' * rand.randint(0, 24)) for i in range(numFuncs))
+    text = pe.SHList.add_section(name='.text', rawsize=(SLOT_SIZE * (numFuncs + 1) + 0xfff) & ~0xfff)
+    data = pe.SHList.add_section(name='.data', rawsize=(0x800 + len(strings) + 0xfff) & ~0xfff)
+    # the import address table is at the start of the data section, the globals read by the code follow it
+    pe.DirImport.add_dlldesc([({'name': 'kernel32.dll', 'firstthunk': data.addr}, IMPORTS)])
+    imports = pe.SHList.add_section(name='.idata', rawsize=len(pe.DirImport))
+    pe.DirImport.set_rva(imports.addr)
+    sources = asmSources(numFuncs, arch, imageBase + data.addr + 0x100, rand)
+    pe.virt.set(imageBase + text.addr, assemble(arch, sources, imageBase + text.addr))
+    pe.virt.set(imageBase + data.addr + 0x800, strings)
+    pe.Opthdr.AddressOfEntryPoint = text.addr
+    with open(path, 'wb') as f:
+        f.write(bytes(pe))
+
+
+def buildELF(path, numFuncs, options, seed):
+    source = path + '.c'
+    with open(source, 'w') as f:
+        f.write(cSource(numFuncs, random.Random(seed)))
+    try:
+        subprocess.run(['gcc', '-no-pie', '-o', path, source] + options, check=True, stdout=subprocess.DEVNULL,
+                       stderr=subprocess.DEVNULL)
+    finally:
+        os.remove(source)
+
+
+def generateCorpus(directory, names=None):
+    """
+    Build the binaries of CORPUS in directory, the ones already there are kept.
+    The programs are generated from SEED, so the corpus only depends on the compiler.
+    :param names: names of the binaries to build, all by default
+    :return: list of (name, path or None if it could not be built, error)
+    """
+    os.makedirs(directory, exist_ok=True)
+    corpus = []
+    for index, (name, fmt, arch, numFuncs, options) in enumerate(CORPUS):
+        if names and name not in names:
+            continue
+        path = os.path.join(directory, name + ('.exe' if fmt == 'PE' else ''))
+        error = None
+        if not os.path.exists(path):
+            try:
+                if fmt == 'PE':
+                    buildPE(path, arch, numFuncs, SEED + index)
+                else:
+                    buildELF(path, numFuncs, options, SEED + index)
+            except (OSError, subprocess.CalledProcessError) as e:
+                error = '%s: %s' % (type(e).__name__, e)
+        corpus.append((name, path if error is None else None, error))
+    return corpus
+
+
+# ============================== run ==============================
+
+def peakMemory():
+    """
+    :return: (peak RSS of this process, peak RSS of its largest terminated child) in KiB
+    """
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+
+
+def timeIt(timings, name, target, *args):
+    start = time.perf_counter()
+    result = target(*args)
+    timings[name] = timings.get(name, 0) + time.perf_counter() - start
+    return result
+
+
+def benchBinary(job):
+    """
+    Load one binary and build its views, run in a fresh process so the peak memory is the one of this binary
+    :param job: (path, number of functions lifted and laid out, fast function discovery, lazy disassembly)
+    :return: dict of the measures
+    """
+    path, numFuncs, fast, lazy = job
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    from PyQt5.QtWidgets import QApplication
+    from Analysis import BinaryAnalysis
+    from Database import AnalysisDB
+    app = QApplication.instance() or QApplication([])
+    AnalysisDB(path, 'fast' if fast else '').remove()
+    Utils.TIMINGS = {}
+    start = time.perf_counter()
+    BinaryAnalysis.init(path, fast=fast, lazy=lazy)
+    Utils.TIMINGS['init'] = time.perf_counter() - start
+    from AsmLinear import AsmLinear
+    linear = timeIt(Utils.TIMINGS, 'model', AsmLinear)
+    if lazy:
+        # what the background loader does while the window is open, the rows are counted once it is done
+        timeIt(Utils.TIMINGS, 'background', BinaryAnalysis.loadAll)
+        linear = AsmLinear()
+    from AsmCFG import AsmCFGView
+    from IRAnalysis import IRAnalysis
+    from miasm.expression.simplifications import expr_simp
+    expr_simp.reset_stats()
+    # the largest functions which can be lifted, the failures are reported but not timed
+    funcs = []
+    errors = []
+    code = BinaryAnalysis.code
+    for func in sorted((func for func in BinaryAnalysis.funcs if code.hasFunction(func)),
+                       key=lambda func: (-code.functionBlockCount(func), func.address)):
+        if len(funcs) == numFuncs:
+            break
+        ira = IRAnalysis(func.address, func.cfg)
+        timings = {}
+        try:
+            timeIt(timings, 'lift', ira.getRawIRCFG)
+            timeIt(timings, 'ssa', ira.getSSAIRCFG)
+            timeIt(timings, 'maxir', ira.getMaxIRCFG)
+            timeIt(timings, 'layout', AsmCFGView, func)
+        except Exception as e:
+            errors.append('%s at 0x%x: %s: %s' % (func.name, func.address, type(e).__name__, e))
+            continue
+        funcs.append(func)
+        for name, value in timings.items():
+            Utils.TIMINGS[name] = Utils.TIMINGS.get(name, 0) + value
+    peakRss, peakChildRss = peakMemory()
+    simpStats = expr_simp.stats()
+    result = {
+        'stages': Utils.TIMINGS,
+        'peakRss': peakRss,
+        'peakChildRss': peakChildRss,
+        'size': os.path.getsize(path),
+        'format': BinaryAnalysis.binaryInfo.type,
+        'arch': BinaryAnalysis.container.arch,
+        'functions': len(BinaryAnalysis.funcs),
+        'blocks': BinaryAnalysis.code.blockCount(),
+        'instructions': len(BinaryAnalysis.code),
+        'codeBytes': BinaryAnalysis.code.nbytes(),
+        'xrefs': len(BinaryAnalysis.xrefs),
+        'rows': linear.model.rowCount(),
+        'lifted': [func.address for func in funcs],
+        'errors': errors,
+        'decoder': BinaryAnalysis.decodeStats,
+        'simplifier': dict((key, simpStats[key]) for key in ('hits', 'misses', 'evictions', 'size')),
+    }
+    BinaryAnalysis.clear()
+    return result
+
+
+def runBenchmark(corpus, repeat=3, numFuncs=5, fast=False, lazy=False):
+    """
+    Run benchBinary repeat times on every binary of corpus, each run in a new process
+    :param fast: find the functions without radare, see BinaryAnalysis.init
+    :param lazy: disassemble the functions after the linear view is built, see BinaryAnalysis.init
+    :return: list of result dicts, one per binary
+    """
+    context = multiprocessing.get_context('spawn')
+    results = []
+    for name, path, error in corpus:
+        result = {'name': name, 'runs': []}
+        if path is None:
+            result['error'] = error
+            results.append(result)
+            continue
+        for _ in range(repeat):
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                try:
+                    result['runs'].append(pool.submit(benchBinary, (path, numFuncs, fast, lazy)).result())
+                except Exception as e:
+                    result['error'] = '%s: %s' % (type(e).__name__, e)
+                    break
+        if result['runs']:
+            stages = set()
+            for run in result['runs']:
+                stages.update(run['stages'])
+            result['median'] = dict((stage, statistics.median(run['stages'].get(stage, 0) for run in result['runs']))
+                                    for stage in sorted(stages))
+            result['peakRss'] = max(run['peakRss'] for run in result['runs'])
+            result['peakChildRss'] = max(run['peakChildRss'] for run in result['runs'])
+        results.append(result)
+        sys.stderr.write('%s: %s\n' % (name, result.get('error') or '%.2fs, %d KiB' % (
+            result['median'].get('init', 0), result['peakRss'])))
+    return results
+
+
+def gitRevision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compareResults(old, new, output):
+    """
+    Write the ratio new / old of the median time of every stage and of the peak memory
+    """
+    oldResults = dict((result['name'], result) for result in old['results'] if 'median' in result)
+    for result in new['results']:
+        base = oldResults.get(result['name'])
+        if base is None or 'median' not in result:
+            continue
+        output.write('%s\n' % result['name'])
+        for stage in INIT_STAGES + ['init'] + VIEW_STAGES:
+            if stage in result['median'] and base['median'].get(stage):
+                output.write('    %-12s %9.4fs %9.4fs %6.2fx\n' % (stage, base['median'][stage], result['median'][stage],
+                                                                 result['median'][stage] / base['median'][stage]))
+        output.write('    %-12s %9dK %9dK %6.2fx\n' % ('peakRss', base['peakRss'], result['peakRss'],
+                                                     result['peakRss'] / base['peakRss']))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the loading and the views on a generated corpus")
+    parser.add_argument('-o', '--output', default='benchmark.json', help="JSON file of the results")
+    parser.add_argument('-c', '--corpus', default=CORPUS_DIR, help="directory of the generated binaries")
+    parser.add_argument('-r', '--repeat', type=int, default=3, help="runs per binary, the median is reported")
+    parser.add_argument('-f', '--functions', type=int, default=5,
+                        help="number of functions, the largest ones, lifted and laid out per binary")
+    parser.add_argument('-b', '--binary', action='append', help="only run this binary of the corpus")
+    parser.add_argument('--rebuild', action='store_true', help="generate the corpus again")
+    parser.add_argument('--compare', help="results of a previous run to compare with")
+    parser.add_argument('--fast', action='store_true', help="find the functions without radare")
+    parser.add_argument('--lazy', action='store_true', help="disassemble the functions after opening the views")
+    args = parser.parse_args(argv)
+    if args.rebuild and os.path.isdir(args.corpus):
+        shutil.rmtree(args.corpus)
+    corpus = generateCorpus(args.corpus, args.binary)
+    results = {
+        'revision': gitRevision(),
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': Utils.WORKERS,
+        'repeat': args.repeat,
+        'functions': args.functions,
+        'fast': args.fast,
+        'lazy': args.lazy,
+        'results': runBenchmark(corpus, args.repeat, args.functions, args.fast, args.lazy),
+    }
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=1)
+    if args.compare:
+        with open(args.compare) as f:
+            compareResults(json.load(f), results, sys.stdout)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -4,8 +4,8 @@ from elftools.elf.sections import SymbolTableSection
 from elftools.elf.relocation import RelocationSection
 from elftools.elf.descriptions import describe_e_type
 from miasm.core.interval import interval
+from miasm.core.address_space import AddressSpace
 import os
-import re
 
 
 class Section:
@@ -37,8 +37,6 @@ class PEInfo:
         self.imageBase = self.parser.OPTIONAL_HEADER.ImageBase
         self.entryPoint = self.parser.OPTIONAL_HEADER.AddressOfEntryPoint
         self.sections = []
-        self.stringAddrs = []
-        self.strings = self.strings()
         for section in self.parser.sections:
             s = Section(section.Name.decode().replace('\x00', ''), section.VirtualAddress + self.imageBase,
                         section.Misc_VirtualSize)
@@ -49,79 +47,61 @@ class PEInfo:
                 importFunc = ImportFunction(imp.name.decode(), imp.address, entry.dll.decode())
                 self.imports.append(importFunc)
         self.exports = []
+        # address -> name of the functions of the symbol table, none in a PE
+        self.functionSymbols = {}
         if hasattr(self.parser, "DIRECTORY_ENTRY_EXPORT"):
             for exp in self.parser.DIRECTORY_ENTRY_EXPORT.symbols:
-                exportFunc = ExportFunction(self.imageBase + exp.address, exp.name.decode())
+                name = exp.name.decode() if exp.name else 'ord_%d' % exp.ordinal
+                exportFunc = ExportFunction(name, self.imageBase + exp.address)
                 self.exports.append(exportFunc)
-        self.findStrings()
-
-    def getOffsetAtAddress(self, address):
-        for section in self.parser.sections:
-            if section.contains_rva(address):
-                return section.get_offset_from_rva(address)
-        return None
-
-    @property
-    def codeRange(self):
-        for section in self.parser.sections:
-            if '.text' in section.Name.decode():
-                return interval([(
-                    section.VirtualAddress + self.imageBase,
-                    section.VirtualAddress + self.imageBase + section.Misc_VirtualSize)])
-
-    @property
-    def dataRange(self):
+        self.codeRange = None
         dataRanges = []
         for section in self.parser.sections:
+            start = section.VirtualAddress + self.imageBase
+            if '.text' in section.Name.decode() and self.codeRange is None:
+                self.codeRange = interval([(start, start + section.Misc_VirtualSize)])
             if 'data' in section.Name.decode():
-                dataRanges.append((section.VirtualAddress + self.imageBase,
-                                   section.VirtualAddress + self.imageBase + section.Misc_VirtualSize))
-        return dataRanges
-
-    def inDataSection(self, address):
-        for start, end in self.dataRange:
-            if start <= address and address < end:
-                return True
-        else:
-            return False
+                dataRanges.append((start, start + section.Misc_VirtualSize))
+        self.dataRange = dataRanges
+        # address translation and section lookups are done by bisection in indexes built once
+        self.sectionSpace = AddressSpace(self.sectionRanges())
+        self.dataSpace = AddressSpace((start, end, True) for start, end in self.dataRange)
+
+    def sectionRanges(self):
+        """
+        :return: list of (start, end, section) of the addresses of the sections, as found by pefile
+        """
+        ranges = []
+        for section in self.parser.sections:
+            # contains_rva computes and stores the bounds of the section in recent versions of pefile
+            section.contains_rva(section.VirtualAddress)
+            start = getattr(section, 'section_min_addr', None)
+            end = getattr(section, 'section_max_addr', None)
+            if start is None or end is None:
+                start = section.VirtualAddress
+                end = start + max(section.SizeOfRawData, section.Misc_VirtualSize)
+            ranges.append((self.imageBase + start, self.imageBase + end, section))
+        return ranges
 
-    def getData(self, start, size):
-        f = open(self.path, 'rb')
-        f.seek(start)
-        data = f.read(size)
-        f.close()
-        return data
+    def getOffsetAtAddress(self, address):
+        rva = address - self.imageBase
+        section = self.sectionSpace.get(address)
+        if section is None or not section.contains_rva(rva):
+            return None
+        return section.get_offset_from_rva(rva)
 
-    def findStrings(self):
-        strings = {}
-        for section in self.parser.sections:
-            if 'data' in section.Name.decode():
-                start = section.PointerToRawData
-                size = section.SizeOfRawData
-                address = self.imageBase + section.VirtualAddress
-                data = self.getData(start, size)
-                indexs = re.finditer(b"([a-zA-Z0-9` \n~!@#$%^&*()-_=+|';\":.,?><*-]{2,})", data)
-                for index in indexs:
-                    strings[address + index.start(0)] = str(data[index.start(0):index.end(0)])[2:-1]
-        return strings
+    def inDataSection(self, address):
+        return address in self.dataSpace
 
-    def strings(self):
-        strings = []
-        for address, string in self.findStrings().items():
-            strings.append((hex(address), string))
+    def stringSections(self):
+        """
+        :return: list of (offset, size, address, inData) of the sections to search strings in
+        """
+        sections = []
         for section in self.parser.sections:
-            if 'data' not in section.name:
-                start = section.PointerToRawData
-                size = section.SizeOfRawData
-                vAddress = self.imageBase + section.VirtualAddress
-                data = self.getData(start, size)
-                indexs = re.finditer(b"([a-zA-Z0-9` \n~!@#$%^&*()-_=+|';\":.,?><*-]{2,})", data)
-                for index in indexs:
-                    address = hex(vAddress + index.start(0))
-                    string = str(data[index.start(0):index.end(0)])[2:-1]
-                    strings.append((address, string))
-                    self.stringAddrs.append(vAddress + index.start(0))
-        return strings
+            sections.append((section.PointerToRawData, section.SizeOfRawData, self.imageBase + section.VirtualAddress,
+                             'data' in section.Name.decode()))
+        return sections
 
     def info(self):
         text = 'File name: <b>' + os.path.basename(self.path) + '</b><br/>'
@@ -136,8 +116,6 @@ class ELFInfo:
         self.parser = ELFFile(open(path, 'rb'))
         self.type = 'ELF'
         self.sections = []
-        self.stringAddrs = []
-        self.strings = self.strings()
         self.imageBase = 0
         self.entryPoint = 0
         for section in self.parser.iter_sections():
@@ -157,9 +135,28 @@ class ELFInfo:
         self.symbols = {}
         self.imports = []
         self.exports = []
+        # address -> name of the functions defined in the symbol tables, the local ones included
+        self.functionSymbols = {}
         self.populateSymbols()
         self.populateIEFunctions()
-        self.findStrings()
+        codeStart = 0
+        codeEnd = 0
+        self.dataRange = interval()
+        for section in self.parser.iter_sections():
+            if section.name == '.init':
+                codeStart = section.header.sh_addr
+            if section.name == '.fini':
+                codeEnd = section.header.sh_addr + section.header.sh_size
+            if 'data' in section.name:
+                start = section.header.sh_addr
+                self.dataRange += interval([(start, start + section.header.sh_size)])
+        self.codeRange = interval([(codeStart, codeEnd)])
+        # address translation and section lookups are done by bisection in indexes built once,
+        # the loaded segments map an address to the difference between its file offset and itself
+        self.segmentSpace = AddressSpace((seg.header.p_vaddr, seg.header.p_vaddr + seg.header.p_filesz,
+                                          seg.header.p_offset - seg.header.p_vaddr)
+                                         for seg in self.iter_segments_by_type('PT_LOAD'))
+        self.dataSpace = AddressSpace((start, end, True) for start, end in self.dataRange)
 
     def populateSymbols(self):
         for section in self.parser.iter_sections():
@@ -189,78 +186,36 @@ class ELFInfo:
                                 importFunc = ImportFunction(sym.name, self.symbols[sym.name])
                                 self.imports.append(importFunc)
                         else:
+                            if sym.entry.st_value:
+                                self.functionSymbols.setdefault(sym.entry.st_value, sym.name)
                             if sym.name in self.symbols:
                                 exportFunc = ExportFunction(sym.name, self.symbols[sym.name])
                                 self.exports.append(exportFunc)
 
-    @property
-    def codeRange(self):
-        start = 0
-        end = 0
-        for section in self.parser.iter_sections():
-            if section.name == '.init':
-                start = section.header.sh_addr
-            if section.name == '.fini':
-                end = section.header.sh_addr + section.header.sh_size
-        return interval([(start, end)])
-
-    @property
-    def dataRange(self):
-        dataRanges = interval()
-        for section in self.parser.iter_sections():
-            if 'data' in section.name:
-                start = section.header.sh_addr
-                end = start + section.header.sh_size
-                dataRanges += interval([(start, end)])
-        return dataRanges
-
     def getOffsetAtAddress(self, address):
-        return address - self.imageBase
+        delta = self.segmentSpace.get(address)
+        if delta is None:
+            return address - self.imageBase
+        return address + delta
 
     def iter_segments_by_type(self, t):
         for seg in self.parser.iter_segments():
             if t == seg.header.p_type or t in str(seg.header.p_type):
                 yield seg
 
-    def getData(self, offset, size):
-        file = open(self.parser.stream.name, 'rb')
-        file.seek(offset)
-        data = file.read(size)
-        file.close()
-        return data
-
-    def findStrings(self):
-        strings = {}
+    def stringSections(self):
+        """
+        :return: list of (offset, size, address, inData) of the sections to search strings in
+        """
+        sections = []
         for section in self.parser.iter_sections():
-            if 'data' in section.name:
-                data = self.getData(section.header.sh_offset, section.header.sh_size)
-                indexs = re.finditer(b"([a-zA-Z0-9` \n~!@#$%^&*()-_=+|';\":.,?><*-]{2,})", data)
-                for index in indexs:
-                    strings[section.header.sh_addr + index.start(0)] = data[index.start(0):index.end(0)].decode()
-        return strings
-
-    def strings(self):
-        strings = []
-        for address, string in self.findStrings().items():
-            strings.append((hex(address), string))
-        for section in self.parser.iter_sections():
-            if 'data' not in section.name:
-                data = self.getData(section.header.sh_offset, section.header.sh_size)
-                indexs = re.finditer(b"([a-zA-Z0-9` \n~!@#$%^&*()-_=+|';\":.,?><*-]{2,})", data)
-                for index in indexs:
-                    address = hex(section.header.sh_addr + index.start(0))
-                    string = data[index.start(0):index.end(0)].decode()
-                    strings.append((address, string))
-                    self.stringAddrs.append(section.header.sh_addr)
-        return strings
-
+            if section.header.sh_type != 'SHT_NOBITS' and section.header.sh_addr != 0:
+                sections.append((section.header.sh_offset, section.header.sh_size, section.header.sh_addr,
+                                 'data' in section.name))
+        return sections
 
     def inDataSection(self, address):
-        for start, end in self.dataRange:
-            if start <= address and address < end:
-                return True
-        else:
-            return False
+        return address in self.dataSpace
 
     def info(self):
         text = 'File name: <b>' + os.path.basename(self.path) + '</b><br/>'
@@ -1,12 +1,29 @@
-from PyQt5.QtCore import Qt, QRectF, QPointF, QItemSelectionModel, pyqtSignal
-from PyQt5.QtGui import QPainterPath, QPen, QBrush, QPolygonF, QCursor, QPainter
+import itertools
+from collections import OrderedDict
+
+from PyQt5.QtCore import Qt, QRectF, QPointF, QItemSelectionModel, QTimer, pyqtSignal
+from PyQt5.QtGui import QPainterPath, QPen, QBrush, QPolygonF, QCursor, QPainter, QColor, QPixmapCache, \
+    QStandardItem
 from PyQt5.QtWidgets import QAbstractItemView, QListView, QApplication, QGraphicsView, QGraphicsScene, QGraphicsItem, \
-    QGraphicsPathItem
+    QGraphicsPathItem, QStyleOptionGraphicsItem
 from math import radians, pi, cos, sin, pow, ceil
 from miasm.expression.expression import ExprInt
 
 from Analysis import BinaryAnalysis
 from CommonView import LocLine, CommonListView
+from Layout import layoutGraph
+
+# scales of the view from which the blocks are drawn with a summary, from a cached pixmap and as list views
+SUMMARY_SCALE = 0.15
+PIXMAP_SCALE = 0.35
+READABLE_SCALE = 0.6
+# KB of the pixmaps of the blocks kept by QPixmapCache
+PIXMAP_CACHE_LIMIT = 64 * 1024
+# list views of blocks kept by a CFG, the least recently shown ones are deleted past it
+LIVE_BLOCKS = 256
+_pixmapKeys = itertools.count()
+# (width of a character, height of a row, height of the frames) of the block views, see BasicBlock.metrics
+_metrics = None
 
 
 class BasicBlock(CommonListView):
@@ -17,10 +34,6 @@ class BasicBlock(CommonListView):
         self.setHorizontalScrollBarPolicy(Qt.ScrollBarAlwaysOff)
         self.setVerticalScrollBarPolicy(Qt.ScrollBarAlwaysOff)
         self.setEditTriggers(QListView.NoEditTriggers)
-        self.w = None
-        self.h = None
-        self.outBlocks = []
-        self.inBlocks = []
         self.setSelectionMode(QAbstractItemView.ExtendedSelection)
         self.setFocusPolicy(Qt.ClickFocus)
 
@@ -62,11 +75,113 @@ class BasicBlock(CommonListView):
             index = self.selectedIndexes()[0]
             return self.getItemFormIndex(index)
 
+    @staticmethod
+    def metrics():
+        """
+        Measure the rows of the block views once on a probe view, so that the size of a block is known without
+        building its view
+        :return: (width of a character, height of a row, height of the frames)
+        """
+        global _metrics
+        if _metrics is None:
+            probe = BasicBlock()
+            probe.model.appendRow(QStandardItem('x'))
+            probe.model.appendRow(QStandardItem('x'))
+            _metrics = (probe.fontMetrics().averageCharWidth(), probe.sizeHintForRow(1), 2 * probe.frameWidth() + 10)
+        return _metrics
+
+    @staticmethod
+    def blockSize(lengths):
+        """
+        :param lengths: number of characters of every row of the block, as given by textLength
+        :return: (width, height) of the view of the block, the ones set by CommonListView.setSize
+        """
+        charWidth, rowHeight, frame = BasicBlock.metrics()
+        return max(lengths) * charWidth + charWidth * 3, rowHeight * len(lengths) + frame
+
+
+class BlockItem(QGraphicsItem):
+    """
+    Lightweight item of a block in the scene, built from the data of the block: its list view is only built by
+    CFG.blockView when it is needed. The item draws the block when its list view is not shown: a rectangle, with the
+    name and the number of lines of the block when it is readable, or a pixmap of the list view cached in
+    QPixmapCache once the view has been shown, which is kept after the view is released by CFG.releaseBlock.
+    """
+    fill = QColor(255, 255, 255)
+    border = QColor(120, 120, 120)
+
+    def __init__(self, lockey, data, name, lengths):
+        """
+        :param data: what the CFG needs to build the list view of the block, see CFG.createBlockView
+        :param name: name of the block, the text of its first row
+        :param lengths: number of characters of every row of the block, the first one included
+        """
+        super(BlockItem, self).__init__()
+        self.lockey = lockey
+        self.data = data
+        self.w, self.h = BasicBlock.blockSize(lengths)
+        self.summary = '%s\n%d lines' % (name, len(lengths) - 1)
+        # addresses of the instructions of the block, for CFG.selectAddress
+        self.addresses = frozenset()
+        self.outBlocks = []
+        self.inBlocks = []
+        self.view = None
+        self.proxy = None
+        self.pixmapKey = 'nkn-block-%d' % next(_pixmapKeys)
+
+    def setView(self, view):
+        self.view = view
+        view.setFixedSize(self.w, self.h)
+        view.model.dataChanged.connect(self.invalidate)
+        view.model.rowsInserted.connect(self.invalidate)
+        view.selectionModel().selectionChanged.connect(self.invalidate)
+
+    def boundingRect(self):
+        return QRectF(0, 0, self.w, self.h)
+
+    def isLive(self):
+        return self.proxy is not None and self.proxy.isVisible()
+
+    def invalidate(self, *args):
+        QPixmapCache.remove(self.pixmapKey)
+        if not self.isLive():
+            self.update()
+
+    def pixmap(self):
+        """
+        :return: pixmap of the list view, grabbed when the view has been shown and is not cached, None if there is none
+        """
+        pixmap = QPixmapCache.find(self.pixmapKey)
+        if (pixmap is None or pixmap.isNull()) and self.proxy is not None:
+            pixmap = self.view.grab()
+            QPixmapCache.insert(self.pixmapKey, pixmap)
+        if pixmap is None or pixmap.isNull():
+            return None
+        return pixmap
+
+    def paint(self, painter, option, widget=None):
+        if self.isLive():
+            return
+        rect = self.boundingRect()
+        scale = QStyleOptionGraphicsItem.levelOfDetailFromTransform(painter.worldTransform())
+        if scale >= PIXMAP_SCALE:
+            pixmap = self.pixmap()
+            if pixmap is not None:
+                painter.drawPixmap(rect, pixmap, QRectF(pixmap.rect()))
+                return
+        painter.setPen(QPen(self.border))
+        painter.setBrush(QBrush(self.fill))
+        painter.drawRect(rect)
+        if scale >= SUMMARY_SCALE:
+            painter.setPen(QPen(Qt.black))
+            painter.drawText(rect.adjusted(4, 4, -4, -4), Qt.AlignLeft | Qt.AlignTop, self.summary)
+
 
 class BasicEdge(QGraphicsItem):
     def __init__(self, dst):
         super(BasicEdge, self).__init__()
         self.points = []
+        self.path = None
         self.head = None
         self.color = Qt.black
         self.dst = dst
@@ -74,6 +189,7 @@ class BasicEdge(QGraphicsItem):
 
     def setpath(self, l):
         self.points = [QPointF(*p) for p in l]
+        self.path = None
 
     def boundingRect(self):
         br = self.getqgp().boundingRect()
@@ -82,10 +198,12 @@ class BasicEdge(QGraphicsItem):
         return br
 
     def getqgp(self):
-        qpp = QPainterPath(self.points[0])
-        for p in self.points[1:]:
-            qpp.lineTo(p)
-        return QGraphicsPathItem(qpp)
+        if self.path is None:
+            qpp = QPainterPath(self.points[0])
+            for p in self.points[1:]:
+                qpp.lineTo(p)
+            self.path = QGraphicsPathItem(qpp)
+        return self.path
 
     def shape(self):
         s = self.getqgp().shape()
@@ -121,10 +239,9 @@ class BasicEdge(QGraphicsItem):
         scene = self.scene()
         graphicView = scene.parent()
         graphicView.clearAllFocus()
-        dstView = self.dst.view
+        dstView = graphicView.blockView(self.dst)
         dstView.selectionModel().select(dstView.model.index(0, 0), QItemSelectionModel.Select)
-        dstBlock = graphicView.mapItems[self.dst.view]
-        graphicView.centerOn(dstBlock)
+        graphicView.centerOn(self.dst)
         super(BasicEdge, self).mouseDoubleClickEvent(event)
 
 
@@ -141,9 +258,20 @@ class CFG(QGraphicsView):
         self.setTransformationAnchor(QGraphicsView.AnchorUnderMouse)
         self.setDragMode(QGraphicsView.ScrollHandDrag)
         self.setFocusPolicy(Qt.ClickFocus)
+        # lockey -> BlockItem
+        self.blockItems = {}
+        # block view -> BlockItem, for the blocks whose view is built
         self.mapItems = {}
+        # BlockItems whose view is built, least recently shown first, see releaseBlocks
+        self.builtItems = OrderedDict()
         self.lastAddress = None
         self.clickedBlock = None
+        # (clicked view, text, start) highlighted in the block views, applied to the views built later
+        self.lastHighlight = None
+        QPixmapCache.setCacheLimit(max(QPixmapCache.cacheLimit(), PIXMAP_CACHE_LIMIT))
+        self.detailTimer = QTimer(self)
+        self.detailTimer.setSingleShot(True)
+        self.detailTimer.timeout.connect(self.updateDetail)
 
     def wheelEvent(self, event):
         modifiers = QApplication.keyboardModifiers()
@@ -157,17 +285,116 @@ class CFG(QGraphicsView):
         if factor < 0.07 or factor > 100:
             return
         self.scale(scaleFactor, scaleFactor)
+        self.detailTimer.start(0)
+
+    def scrollContentsBy(self, dx, dy):
+        super(CFG, self).scrollContentsBy(dx, dy)
+        self.detailTimer.start(0)
+
+    def resizeEvent(self, event):
+        super(CFG, self).resizeEvent(event)
+        self.detailTimer.start(0)
+
+    def showEvent(self, event):
+        super(CFG, self).showEvent(event)
+        self.detailTimer.start(0)
+
+    def createBlockView(self, item):
+        """
+        :return: list view of the block of the BlockItem item, built from item.data
+        """
+        raise NotImplementedError
+
+    def blockView(self, item):
+        """
+        :return: list view of the block of the BlockItem item, built on the first call
+        """
+        if item.view is None:
+            view = self.createBlockView(item)
+            item.setView(view)
+            self.mapItems[view] = item
+            view.highlightText.connect(self.highlightText)
+            if self.lastHighlight is not None:
+                _, text, start = self.lastHighlight
+                view.highlighRelation(text, start)
+        self.builtItems[item] = None
+        self.builtItems.move_to_end(item)
+        return item.view
+
+    def releaseBlock(self, item):
+        """
+        Delete the list view of item and its proxy, the item draws the block from a pixmap of the view while
+        QPixmapCache keeps it
+        """
+        if item.proxy is not None:
+            item.pixmap()
+            self.scene.removeItem(item.proxy)
+            item.proxy.deleteLater()
+        else:
+            item.view.deleteLater()
+        if self.clickedBlock is item.view:
+            self.clickedBlock = None
+        del self.mapItems[item.view]
+        del self.builtItems[item]
+        item.proxy = item.view = None
+        item.update()
+
+    def releaseBlocks(self):
+        """
+        Release the least recently shown block views which are not visible until LIVE_BLOCKS are left
+        """
+        for item in list(self.builtItems):
+            if len(self.builtItems) <= LIVE_BLOCKS:
+                break
+            if not item.isLive():
+                self.releaseBlock(item)
+
+    def highlightBlocks(self, clickedBlock, text, start):
+        """
+        Highlight text in the built block views other than clickedBlock, the views built later are highlighted by
+        blockView
+        """
+        self.lastHighlight = (clickedBlock, text, start)
+        for block in self.mapItems:
+            if block != clickedBlock:
+                block.highlighRelation(text, start)
+
+    def updateDetail(self):
+        """
+        Embed the list views of the blocks visible at a readable scale in the scene, building them when they are first
+        shown, and hide the others, which are drawn by their BlockItem
+        """
+        scale = self.transform().m11()
+        readable = scale >= READABLE_SCALE
+        self.setRenderHint(QPainter.Antialiasing, readable)
+        visible = set()
+        if readable:
+            rect = self.mapToScene(self.viewport().rect()).boundingRect()
+            visible = set(item for item in self.scene.items(rect) if isinstance(item, BlockItem))
+        for item in self.blockItems.values():
+            if item in visible:
+                if item.proxy is None:
+                    item.proxy = self.scene.addWidget(self.blockView(item))
+                    item.proxy.setPos(item.pos())
+                    item.proxy.setZValue(1)
+                    item.proxy.setFocusPolicy(Qt.ClickFocus)
+                elif not item.proxy.isVisible():
+                    item.proxy.setVisible(True)
+                self.builtItems.move_to_end(item)
+            elif item.isLive():
+                item.proxy.setVisible(False)
+                item.update()
+        self.releaseBlocks()
 
     def mousePressEvent(self, event):
         self.clickedBlock = None
-        x = self.mapToScene(event.pos()).x()
-        y = self.mapToScene(event.pos()).y()
-        for block in self.mapItems:
-            if (block.x() <= x) and (x <= block.x() + block.width()) and (block.y() <= y) and (
-                    y <= block.y() + block.height()):
+        point = self.mapToScene(event.pos())
+        for block, item in self.mapItems.items():
+            if item.isLive() and item.sceneBoundingRect().contains(point):
                 self.clickedBlock = block
                 break
         if self.clickedBlock is not None:
+            self.lastHighlight = None
             for block in self.mapItems:
                 if block != self.clickedBlock:
                     block.clearSelection()
@@ -178,40 +405,54 @@ class CFG(QGraphicsView):
         super(CFG, self).mousePressEvent(event)
 
     def clearAllFocus(self):
+        self.lastHighlight = None
         for block in self.mapItems:
             block.clearSelection()
             block.clearFocus()
             block.clearAllEffect()
 
     def focusLoc(self, loc):
-        for block in self.mapItems:
-            block.clearSelection()
-            block.clearFocus()
-            block.clearAllEffect()
-        for block, view in self.mapItems.items():
-            if block.lockey == loc:
-                block.selectionModel().select(block.model.index(0, 0), QItemSelectionModel.Select)
-                self.centerOn(view)
+        self.clearAllFocus()
+        item = self.blockItems.get(loc)
+        if item is not None:
+            block = self.blockView(item)
+            block.selectionModel().select(block.model.index(0, 0), QItemSelectionModel.Select)
+            self.centerOn(item)
 
-    def addBlock(self, blockView, x, y):
-        item = self.scene.addWidget(blockView)
+    def addBlock(self, item, x, y):
+        self.scene.addItem(item)
         item.setPos(x, y)
-        item.setFocusPolicy(Qt.ClickFocus)
-        blockView.highlightText.connect(self.highlightText)
-        self.mapItems[blockView] = item
+        self.blockItems[item.lockey] = item
+        self.detailTimer.start(0)
+
+    def placeBlocks(self, key, blocks, edges):
+        """
+        Add the block items and edges to the scene at the coordinates given by layoutGraph
+        :param key: key of the layout in BinaryAnalysis.layoutCache, None to not cache it
+        :param blocks: dict BlockItem -> hash of its content
+        :param edges: list of (source BlockItem, destination BlockItem, BasicEdge)
+        """
+        sizes = dict((h, (item.w, item.h)) for item, h in blocks.items())
+        layout = layoutGraph(key, sizes, [(blocks[src], blocks[dst]) for src, dst, _ in edges])
+        for item, h in blocks.items():
+            x, y = layout.positions[h]
+            self.addBlock(item, x - (item.w / 2), y - (item.h / 2))
+        for src, dst, edgeView in edges:
+            edgeView.setpath(layout.paths[(blocks[src], blocks[dst])])
 
     def selectAddress(self, address, focus=True, clearEffect=True):
         if clearEffect:
             self.clearAllFocus()
         self.lastAddress = address
-        for block in self.mapItems:
-            for i in range(block.model.rowCount()):
-                line = block.model.item(i, 0)
-                if not isinstance(line, LocLine):
-                    if line.address == address:
+        for item in self.blockItems.values():
+            if address in item.addresses:
+                block = self.blockView(item)
+                for i in range(block.model.rowCount()):
+                    line = block.model.item(i, 0)
+                    if not isinstance(line, LocLine) and line.address == address:
                         block.selectionModel().select(block.model.index(i, 0), QItemSelectionModel.Select)
                         if focus:
-                            self.centerOn(self.mapItems[block])
+                            self.centerOn(item)
                         return
 
     def mouseDoubleClickEvent(self, event) -> None:
@@ -1,3 +1,5 @@
+import re
+
 from PyQt5.QtCore import QItemSelectionModel, pyqtSignal
 from PyQt5.QtGui import QStandardItem, QStandardItemModel, QTextDocument, QAbstractTextDocumentLayout, QPalette
 from PyQt5.QtWidgets import QListView, QStyledItemDelegate, QStyleOptionViewItem, \
@@ -8,6 +10,11 @@ from miasm.expression.expression import ExprInt, ExprId, ExprMem, ExprLoc
 from Analysis import BinaryAnalysis
 from Utils import *
 
+# words of the components indexed by CommonListView.tokenRows
+TOKEN = re.compile(r'\w+')
+# entries of BinaryAnalysis.renderCache, the least recently used ones are dropped
+RENDER_CACHE_SIZE = 1 << 14
+
 
 class HTMLDelegate(QStyledItemDelegate):
     def __init__(self, parent=None):
@@ -69,6 +76,52 @@ class Component:
                                                               '&nbsp;' * (self.width - len(self.text)))
 
 
+def cachedRender(key, render):
+    """
+    :return: render() kept in BinaryAnalysis.renderCache under key, at most RENDER_CACHE_SIZE renderings are kept
+    """
+    cache = BinaryAnalysis.renderCache
+    if key in cache:
+        cache.move_to_end(key)
+        return cache[key]
+    value = render()
+    cache[key] = value
+    while len(cache) > RENDER_CACHE_SIZE:
+        cache.popitem(last=False)
+    return value
+
+
+def argComponent(line, arg, extra):
+    """
+    Component of the argument arg of the instruction line followed by extra spaces, None for an argument which is not
+    shown. It is kept in BinaryAnalysis.renderCache and shared by the rows showing the same argument.
+    """
+    return cachedRender(('asm', type(line), arg, extra), lambda: renderArg(line, arg, extra))
+
+
+def renderArg(line, arg, extra):
+    argStr = line.arg2str(arg, loc_db=BinaryAnalysis.locDB)
+    width = len(argStr) + extra
+    component = None
+    if isinstance(arg, ExprId):
+        component = Component(argStr, idColor, width)
+    elif isinstance(arg, ExprInt):
+        component = Component(argStr, intColor, width)
+    elif isinstance(arg, ExprMem):
+        component = Component(argStr, memColor, width)
+    elif isinstance(arg, ExprLoc):
+        component = Component(argStr, locColor, width)
+    return component
+
+
+def textLength(components):
+    """
+    :return: number of characters of a row of components, up to the end of the last one as in
+    CommonItem.calculateRange
+    """
+    return sum(component.width for component in components[:-1]) + len(components[-1].text)
+
+
 class CommonItem(QStandardItem):
     def __init__(self):
         super(CommonItem, self).__init__()
@@ -77,7 +130,12 @@ class CommonItem(QStandardItem):
         self.startArgIndex = 0
         self.normal = ''
         self.ref = None
-        self.xrefs = []
+        self.owner = None
+
+    def setText(self, text):
+        super(CommonItem, self).setText(text)
+        if self.owner is not None:
+            self.owner.itemChanged(self)
 
     def highlight(self, texts, start=0):
         tmp = ''
@@ -124,10 +182,7 @@ class CommonItem(QStandardItem):
 class LocLine(CommonItem):
     def __init__(self, lockey, func, pretty=True):
         self.address = BinaryAnalysis.locDB.get_location_offset(lockey)
-        if pretty:
-            name = BinaryAnalysis.locDB.pretty_str(lockey)
-        else:
-            name = str(lockey)
+        name = self.locName(lockey, pretty)
         super(LocLine, self).__init__()
         self.lockey = lockey
         self.func = func
@@ -136,12 +191,19 @@ class LocLine(CommonItem):
         self.normal = self.components[0].normal
         self.setText(self.normal)
 
+    @staticmethod
+    def locName(lockey, pretty=True):
+        if pretty:
+            return BinaryAnalysis.locDB.pretty_str(lockey)
+        return str(lockey)
+
 
 class AsmLineWithOpcode(CommonItem):
-    def __init__(self, line, block=None, func=None):
+    def __init__(self, line, lockey=None, func=None):
         super(AsmLineWithOpcode, self).__init__()
         self.instr = line
-        self.block = block
+        # LocKey of the block of the line
+        self.lockey = lockey
         self.func = func
         self.address = line.offset
         self.startArgIndex = 3
@@ -155,18 +217,9 @@ class AsmLineWithOpcode(CommonItem):
                 self.components.append(Component(',', opColor, 2))
                 self.args.append(',')
             self.args.append(arg)
-            argStr = line.arg2str(arg, loc_db=BinaryAnalysis.locDB)
-            width = len(argStr)
-            if i == len(line.args) - 1:
-                width += 15
-            if isinstance(arg, ExprId):
-                self.components.append(Component(argStr, idColor, width))
-            elif isinstance(arg, ExprInt):
-                self.components.append(Component(argStr, intColor, width))
-            elif isinstance(arg, ExprMem):
-                self.components.append(Component(argStr, memColor, width))
-            elif isinstance(arg, ExprLoc):
-                self.components.append(Component(argStr, locColor, width))
+            component = argComponent(line, arg, 15 if i == len(line.args) - 1 else 0)
+            if component is not None:
+                self.components.append(component)
         self.comment = self.getComment()
         self.components.append(Component(self.comment, commentColor, len(self.comment)))
         self.calculateRange()
@@ -174,17 +227,18 @@ class AsmLineWithOpcode(CommonItem):
             self.ref = func.callRefs[self.address]
 
     def clone(self):
-        return AsmLineWithOpcode(self.instr, self.func.cfg.loc_db, self.block, self.func)
+        return AsmLineWithOpcode(self.instr, self.lockey, self.func)
 
     def getComment(self):
         for arg in self.instr.args:
             if isinstance(arg, ExprInt):
                 num = int(arg.arg)
-                if num in BinaryAnalysis.strings:
-                    if len(BinaryAnalysis.strings[num]) > 15:
-                        text = BinaryAnalysis.strings[num][:15].replace('\n', '') + '...'
+                string = BinaryAnalysis.strings.get(num)
+                if string is not None:
+                    if len(string) > 15:
+                        text = string[:15].replace('\n', '') + '...'
                     else:
-                        text = BinaryAnalysis.strings[num].replace('\n', '')
+                        text = string.replace('\n', '')
                     return text
                 else:
                     lockey = BinaryAnalysis.locDB.get_offset_location(arg.arg)
@@ -198,32 +252,16 @@ class AsmLineWithOpcode(CommonItem):
 
 
 class AsmLineNoOpcode(CommonItem):
-    def __init__(self, line, block=None, func=None):
+    def __init__(self, line, lockey=None, func=None):
         super(AsmLineNoOpcode, self).__init__()
         self.instr = line
-        self.block = block
+        # LocKey of the block of the line
+        self.lockey = lockey
         self.func = func
         self.address = line.offset
         self.startArgIndex = 2
-        self.components += [Component('0x%x' % line.offset, addressColor, 15), Component(line.name, nameColor, 7)]
-        self.args = [line.offset, line.name]
-        for i, arg in enumerate(line.args):
-            if i >= 1:
-                self.components.append(Component(',', opColor, 2))
-                self.args.append(',')
-            self.args.append(arg)
-            argStr = line.arg2str(arg, loc_db=BinaryAnalysis.locDB)
-            width = len(argStr)
-            if i == len(line.args) - 1:
-                width += 10
-            if isinstance(arg, ExprId):
-                self.components.append(Component(argStr, idColor, width))
-            elif isinstance(arg, ExprInt):
-                self.components.append(Component(argStr, intColor, width))
-            elif isinstance(arg, ExprMem):
-                self.components.append(Component(argStr, memColor, width))
-            elif isinstance(arg, ExprLoc):
-                self.components.append(Component(argStr, locColor, width))
+        self.args, components = self.lineComponents(line)
+        self.components += components
         # self.comment = self.getComment()
         # self.components.append(Component(self.comment, commentColor, len(self.comment)))
         self.calculateRange()
@@ -231,17 +269,35 @@ class AsmLineNoOpcode(CommonItem):
             self.ref = func.callRefs[self.address]
 
     def clone(self):
-        return AsmLineNoOpcode(self.instr, self.block, self.func)
+        return AsmLineNoOpcode(self.instr, self.lockey, self.func)
+
+    @staticmethod
+    def lineComponents(line):
+        """
+        :return: (list of parts, list of Component) of the row of the instruction line
+        """
+        components = [Component('0x%x' % line.offset, addressColor, 15), Component(line.name, nameColor, 7)]
+        args = [line.offset, line.name]
+        for i, arg in enumerate(line.args):
+            if i >= 1:
+                components.append(Component(',', opColor, 2))
+                args.append(',')
+            args.append(arg)
+            component = argComponent(line, arg, 10 if i == len(line.args) - 1 else 0)
+            if component is not None:
+                components.append(component)
+        return args, components
 
     def getComment(self):
         for arg in self.instr.args:
             if isinstance(arg, ExprInt):
                 num = int(arg.arg)
-                if num in BinaryAnalysis.strings:
-                    if len(BinaryAnalysis.strings[num]) > 15:
-                        text = BinaryAnalysis.strings[num][:15].replace('\n', '') + '...'
+                string = BinaryAnalysis.strings.get(num)
+                if string is not None:
+                    if len(string) > 15:
+                        text = string[:15].replace('\n', '') + '...'
                     else:
-                        text = BinaryAnalysis.strings[num].replace('\n', '')
+                        text = string.replace('\n', '')
                     return text
 
                 else:
@@ -270,6 +326,13 @@ class CommonListView(QListView):
         self.lastClickIndex = -1
         self.setEditTriggers(QListView.NoEditTriggers)
         self.setStyleSheet("QListView::item{margin-bottom: 5px; padding:0px}")
+        # word of a component -> items containing it, built by tokenRows
+        self.tokenIndex = None
+        # cacheVersion of a model keeping only some items when tokenIndex was built
+        self.tokenVersion = None
+        self.model.rowsInserted.connect(self.resetTokenIndex)
+        self.model.rowsRemoved.connect(self.resetTokenIndex)
+        self.model.modelReset.connect(self.resetTokenIndex)
 
     def getItem(self, row):
         return self.model.item(row, 0)
@@ -277,6 +340,11 @@ class CommonListView(QListView):
     def getItemFormIndex(self, index):
         return self.model.item(index.row(), 0)
 
+    def iterItems(self):
+        if hasattr(self.model, 'cachedItems'):
+            return self.model.cachedItems()
+        return [self.getItem(i) for i in range(self.model.rowCount())]
+
     def setSize(self):
         width_view = 0
         for i in range(self.model.rowCount()):
@@ -287,6 +355,37 @@ class CommonListView(QListView):
         self.setFixedWidth(width_view + self.fontMetrics().averageCharWidth() * 3)
         self.setFixedHeight(self.sizeHintForRow(1) * self.model.rowCount() + 2 * self.frameWidth() + 10)
 
+    def resetTokenIndex(self, *args):
+        self.tokenIndex = None
+
+    def tokenRows(self, texts):
+        """
+        :return: items having all the words of one of texts in their components, None when a text has no word. Only
+        the cached items of a model building its items on demand are indexed
+        """
+        version = getattr(self.model, 'cacheVersion', None)
+        if self.tokenIndex is None or version != self.tokenVersion:
+            self.tokenVersion = version
+            self.tokenIndex = {}
+            for item in self.iterItems():
+                for component in getattr(item, 'components', ()):
+                    for word in TOKEN.findall(component.text):
+                        items = self.tokenIndex.setdefault(word, [])
+                        if not items or items[-1] is not item:
+                            items.append(item)
+        result = []
+        seen = set()
+        for text in texts:
+            words = TOKEN.findall(text)
+            if not words:
+                return None
+            for item in self.tokenIndex.get(words[0], ()):
+                if id(item) not in seen and all(any(word in component.text for component in item.components)
+                                                for word in words[1:]):
+                    seen.add(id(item))
+                    result.append(item)
+        return result
+
     def highlighRelation(self, text, start, func=None):
         texts = [text]
         for regs in relate_registers:
@@ -311,8 +410,11 @@ class CommonListView(QListView):
                     if item.address > func.maxBound:
                         break
         else:
-            for i in range(self.model.rowCount()):
-                item = self.getItem(i)
+            # only the rows having the words of texts can be highlighted
+            items = self.tokenRows(texts)
+            if items is None:
+                items = self.iterItems()
+            for item in items:
                 if item.isSelectable():
                     if isinstance(item, LocLine):
                         change = item.highlight(texts, 0)
@@ -439,42 +541,65 @@ class IRLine(CommonItem):
         self.initModel()
 
     def initModel(self):
+        self.args, components = self.lineComponents(self.dst, self.src, self.pretty)
+        self.components += components
+        self.calculateRange()
+
+    @staticmethod
+    def lineComponents(dst, src, pretty):
+        """
+        :return: (list of parts, list of Component) of the row of the assignment dst = src
+        """
+        dstArgs, dstComponents = IRLine.exprComponents(dst, pretty)
+        srcArgs, srcComponents = IRLine.exprComponents(src, pretty)
+        return dstArgs + ['='] + srcArgs, dstComponents + [IRLine.argComponent('=', pretty)] + srcComponents
+
+    @staticmethod
+    def exprComponents(expr, pretty):
+        """
+        Parts of expr and their components, kept in BinaryAnalysis.renderCache and shared by the rows showing expr
+        :return: (list of parts, list of Component)
+        """
+        args, components = cachedRender(('ir', expr, pretty), lambda: IRLine.renderExpr(expr, pretty))
+        return list(args), list(components)
+
+    @staticmethod
+    def renderExpr(expr, pretty):
         from IRAnalysis import parseExpr
-        parseDst = parseExpr(self.dst, [])
-        parseSrc = parseExpr(self.src, [])
-        self.args = parseDst + ['='] + parseSrc
-        for i in range(len(self.args)):
-            arg = self.args[i]
-            if isinstance(arg, str):
-                if arg in self.opList:
-                    argStr = ' ' + arg + ' '
-                else:
-                    argStr = arg
-                color = opColor
-            elif isinstance(arg, ExprLoc):
-                if self.pretty:
-                    offset = BinaryAnalysis.locDB.get_location_offset(arg.loc_key)
-                    argStr = BinaryAnalysis.locDB.pretty_str(arg.loc_key)
-                    for lockey in BinaryAnalysis.locDB.loc_keys:
-                        if BinaryAnalysis.locDB.get_location_offset(lockey) == offset:
-                            name = list(BinaryAnalysis.locDB.get_location_names(lockey))
-                            if len(name) > 0:
-                                argStr = name[0].decode()
-                                break
-                else:
-                    argStr = str(arg.loc_key)
-                color = locColor
-            elif isinstance(arg, ExprInt):
-                argStr = str(arg)
-                color = intColor
-            elif isinstance(arg, ExprMem):
-                argStr = str(arg)
-                color = memColor
-            elif isinstance(arg, ExprId):
-                argStr = str(arg)
-                color = idColor
+        args = parseExpr(expr, [])
+        return args, [IRLine.argComponent(arg, pretty) for arg in args]
+
+    @staticmethod
+    def argComponent(arg, pretty):
+        if isinstance(arg, str):
+            if arg in IRLine.opList:
+                argStr = ' ' + arg + ' '
             else:
-                argStr = str(arg)
-                color = idColor
-            self.components.append(Component(argStr, color, len(argStr)))
-        self.calculateRange()
+                argStr = arg
+            color = opColor
+        elif isinstance(arg, ExprLoc):
+            if pretty:
+                offset = BinaryAnalysis.locDB.get_location_offset(arg.loc_key)
+                argStr = BinaryAnalysis.locDB.pretty_str(arg.loc_key)
+                for lockey in BinaryAnalysis.locDB.loc_keys:
+                    if BinaryAnalysis.locDB.get_location_offset(lockey) == offset:
+                        name = list(BinaryAnalysis.locDB.get_location_names(lockey))
+                        if len(name) > 0:
+                            argStr = name[0].decode()
+                            break
+            else:
+                argStr = str(arg.loc_key)
+            color = locColor
+        elif isinstance(arg, ExprInt):
+            argStr = str(arg)
+            color = intColor
+        elif isinstance(arg, ExprMem):
+            argStr = str(arg)
+            color = memColor
+        elif isinstance(arg, ExprId):
+            argStr = str(arg)
+            color = idColor
+        else:
+            argStr = str(arg)
+            color = idColor
+        return Component(argStr, color, len(argStr))
@@ -0,0 +1,90 @@
+from bisect import bisect_left, bisect_right
+
+
+class CoverageMap:
+    """
+    Set of covered addresses stored as sorted, disjoint runs [start, end).
+    Touching or overlapping runs are merged on insert, so lookups are a bisect over the run starts.
+    """
+
+    def __init__(self):
+        self.starts = []
+        self.ends = []
+
+    def add(self, start, end):
+        """
+        Mark [start, end) as covered
+        """
+        if start >= end:
+            return
+        if not self.starts or start > self.ends[-1]:
+            self.starts.append(start)
+            self.ends.append(end)
+            return
+        first = bisect_left(self.ends, start)
+        last = bisect_right(self.starts, end)
+        if first == last:
+            self.starts.insert(first, start)
+            self.ends.insert(first, end)
+        else:
+            start = min(start, self.starts[first])
+            end = max(end, self.ends[last - 1])
+            self.starts[first:last] = [start]
+            self.ends[first:last] = [end]
+
+    def remove(self, start, end):
+        """
+        Mark [start, end) as not covered
+        """
+        if start >= end:
+            return
+        first = bisect_right(self.ends, start)
+        last = bisect_left(self.starts, end)
+        if first >= last:
+            return
+        starts = []
+        ends = []
+        if self.starts[first] < start:
+            starts.append(self.starts[first])
+            ends.append(start)
+        if self.ends[last - 1] > end:
+            starts.append(end)
+            ends.append(self.ends[last - 1])
+        self.starts[first:last] = starts
+        self.ends[first:last] = ends
+
+    def __contains__(self, address):
+        i = bisect_right(self.starts, address) - 1
+        return i >= 0 and address < self.ends[i]
+
+    def runAt(self, address):
+        """
+        :return: covered run (start, end) containing address or None
+        """
+        i = bisect_right(self.starts, address) - 1
+        if i >= 0 and address < self.ends[i]:
+            return self.starts[i], self.ends[i]
+        return None
+
+    def gaps(self, start, end):
+        """
+        Iterate over the runs of [start, end) which are not covered
+        :return: generator of (start, end)
+        """
+        i = bisect_right(self.ends, start)
+        current = start
+        while current < end and i < len(self.starts):
+            if self.starts[i] >= end:
+                break
+            if self.starts[i] > current:
+                yield current, self.starts[i]
+            current = max(current, self.ends[i])
+            i += 1
+        if current < end:
+            yield current, end
+
+    def __iter__(self):
+        return zip(self.starts, self.ends)
+
+    def __len__(self):
+        return len(self.starts)
@@ -0,0 +1,73 @@
+import hashlib
+import logging
+import os
+import pickle
+
+ANALYSIS_VERSION = 10
+DB_DIR = os.path.join(os.path.expanduser('~'), '.nkn', 'db')
+
+
+def hashFile(path, chunkSize=1 << 20):
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        chunk = f.read(chunkSize)
+        while chunk:
+            sha.update(chunk)
+            chunk = f.read(chunkSize)
+    return sha.hexdigest()
+
+
+class AnalysisDB:
+    """
+    Project database of one binary, keyed by the sha256 of its content.
+    A stored state is only returned if both the content hash and ANALYSIS_VERSION match,
+    so editing the binary or changing the analysis invalidates it automatically.
+    """
+
+    def __init__(self, binary, mode='', directory=DB_DIR):
+        """
+        :param mode: name of the kind of analysis, the analyses of the different modes are stored apart
+        """
+        self.binary = binary
+        self.hash = hashFile(binary)
+        self.path = os.path.join(directory, self.hash + ('.' + mode if mode else '') + '.db')
+
+    def load(self):
+        """
+        Load the analysis state saved for this binary
+        :return: state dict or None if there is no valid database
+        """
+        if not os.path.exists(self.path):
+            return None
+        try:
+            with open(self.path, 'rb') as f:
+                header = pickle.load(f)
+                if header.get('version') != ANALYSIS_VERSION or header.get('hash') != self.hash:
+                    return None
+                return pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError) as e:
+            # a database which can't be read is analysed again, but it must not happen silently
+            logging.warning('cannot load the project database %s, the binary is analysed again: %r', self.path, e)
+            return None
+
+    def save(self, state):
+        """
+        Save the analysis state. The file is written next to the database and renamed,
+        so an interrupted save never leaves a corrupted database behind
+        :param state: dict of picklable analysis results
+        """
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmpPath = self.path + '.tmp'
+        try:
+            with open(tmpPath, 'wb') as f:
+                pickle.dump({'version': ANALYSIS_VERSION, 'hash': self.hash}, f, pickle.HIGHEST_PROTOCOL)
+                pickle.dump(state, f, pickle.HIGHEST_PROTOCOL)
+            os.replace(tmpPath, self.path)
+        except BaseException:
+            if os.path.exists(tmpPath):
+                os.remove(tmpPath)
+            raise
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
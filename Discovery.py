@@ -0,0 +1,143 @@
+from array import array
+from bisect import bisect_right
+
+from miasm.core.asmblock import AsmConstraint
+
+CALLTYPES = {('PE', 64): 'ms', ('ELF', 64): 'amd64'}
+
+
+def scanCFG(cfg, locDB):
+    """
+    Collect what the function discovery needs from the CFG disassembled from a function start
+    :return: (blocks, calls, jumps, constants) where blocks are the (start, end) of the blocks, calls and jumps the
+        (at, target) of the direct calls and jumps and constants the values used as immediates or memory addresses
+    """
+    blocks = []
+    calls = []
+    jumps = []
+    constants = set()
+    for block in cfg.blocks:
+        if not block.lines:
+            continue
+        lastLine = block.lines[-1]
+        blocks.append((block.lines[0].offset, lastLine.offset + lastLine.l))
+        for line in block.lines:
+            if line.is_subcall():
+                for dst in line.getdstflow(locDB):
+                    target = locDB.get_location_offset(dst.loc_key) if dst.is_loc() else None
+                    if dst.is_int():
+                        target = int(dst)
+                    if target is not None:
+                        calls.append((line.offset, target))
+                continue
+            if line.breakflow():
+                continue
+            for arg in line.args:
+                if arg.is_int():
+                    constants.add(int(arg))
+                elif arg.is_loc():
+                    offset = locDB.get_location_offset(arg.loc_key)
+                    if offset is not None:
+                        constants.add(offset)
+                elif arg.is_mem():
+                    ptr = arg.ptr
+                    if ptr.is_int():
+                        constants.add(int(ptr))
+                    elif ptr.is_op('+') and len(ptr.args) == 2 and ptr.args[0].is_id() and \
+                            'IP' in str(ptr.args[0]) and ptr.args[1].is_int():
+                        # RIP relative, from the end of the instruction
+                        constants.add((line.offset + line.l + int(ptr.args[1])) & ((1 << ptr.size) - 1))
+        if lastLine.breakflow() and not lastLine.is_subcall():
+            for cst in block.bto:
+                if cst.c_t == AsmConstraint.c_to:
+                    target = locDB.get_location_offset(cst.loc_key)
+                    if target is not None:
+                        jumps.append((lastLine.offset, target))
+    return blocks, calls, jumps, sorted(constants)
+
+
+def functionSeeds(entryPoint, binaryInfo):
+    """
+    :return: dict address -> name of the function starts known without disassembling: the entry point, the
+        exported functions and the functions of the symbol table
+    """
+    seeds = {}
+    for export in binaryInfo.exports:
+        seeds[export.address] = export.name
+    for address, name in binaryInfo.functionSymbols.items():
+        seeds.setdefault(address, name)
+    if entryPoint is not None:
+        seeds.setdefault(entryPoint, 'entry0')
+    return seeds
+
+
+def addressedStarts(scans, codeRanges):
+    """
+    Function starts only referenced by address: the main given to __libc_start_main, callbacks, functions stored in
+    tables built by code
+    :param scans: dict function address -> scanCFG result
+    :return: sorted constants of the scans which are in codeRanges and in none of their blocks
+    """
+    blocks = sorted(block for scan in scans.values() for block in scan[0])
+    starts = array('Q', [start for start, _ in blocks])
+    maxEnds = array('Q')
+    maxEnd = 0
+    for _, end in blocks:
+        maxEnd = max(maxEnd, end)
+        maxEnds.append(maxEnd)
+    found = set()
+    for scan in scans.values():
+        for constant in scan[3]:
+            if constant in scans or constant in found or not inRanges(constant, codeRanges):
+                continue
+            # the blocks starting before the constant all end before it
+            i = bisect_right(starts, constant) - 1
+            if i < 0 or maxEnds[i] <= constant:
+                found.add(constant)
+    return sorted(found)
+
+
+def inRanges(address, ranges):
+    for start, end in ranges:
+        if start <= address < end:
+            return True
+    return False
+
+
+def describeFunctions(scans, names, calltype, isData):
+    """
+    Describe the discovered functions like radare's aflj does
+    :param scans: dict function address -> scanCFG result
+    :param names: dict function address -> name, 'fcn.<address>' for the others
+    :param isData: function telling if a constant is the address of data
+    :return: list of function dicts sorted by address, see RadareParser.Function
+    """
+    # the jumps to a block are references to the functions the block belongs to
+    blockFuncs = {}
+    for address, (blocks, _, _, _) in scans.items():
+        for start, _ in blocks:
+            blockFuncs.setdefault(start, []).append(address)
+    codeXRefs = dict((address, set()) for address in scans)
+    for blocks, calls, jumps, _ in scans.values():
+        for at, target in jumps:
+            for address in blockFuncs.get(target, ()):
+                codeXRefs[address].add((target, at))
+    funcs = []
+    for address in sorted(scans):
+        blocks, calls, jumps, constants = scans[address]
+        minBound = min(start for start, _ in blocks) if blocks else address
+        maxBound = max(end for _, end in blocks) if blocks else address
+        funcs.append({
+            'offset': address,
+            'name': names.get(address, 'fcn.%08x' % address),
+            'size': maxBound - minBound,
+            'realsz': sum(end - start for start, end in blocks),
+            'calltype': calltype,
+            'minbound': minBound,
+            'maxbound': maxBound,
+            'nargs': 0,
+            'callrefs': [{'addr': target, 'type': 'CALL', 'at': at} for at, target in calls],
+            'datarefs': [constant for constant in constants if isData(constant)],
+            'codexrefs': [{'addr': at, 'type': 'CODE', 'at': target} for target, at in sorted(codeXRefs[address])],
+        })
+    return funcs
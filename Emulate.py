@@ -21,7 +21,7 @@ class ListInstructions(CommonListView):
         self.infoHook = ''
         for item in items:
             if isinstance(item, AsmLineWithOpcode):
-                newItem = AsmLineWithOpcode(item.instr, item.block, item.func)
+                newItem = AsmLineWithOpcode(item.instr, item.lockey, item.func)
                 for arg in item.instr.args:
                     if isinstance(arg, ExprMem):
                         self.allMem.append((arg, item.instr.arg2str(arg, loc_db=BinaryAnalysis.locDB)))
@@ -1,24 +1,90 @@
 import string
 
-from PyQt5.QtCore import Qt, QItemSelectionModel
-from PyQt5.QtGui import QStandardItemModel, QStandardItem
+from PyQt5.QtCore import Qt, QItemSelectionModel, QAbstractTableModel, QModelIndex
 from PyQt5.QtWidgets import QTableView, QWidget, QHBoxLayout, QScrollBar, QHeaderView, \
     QAbstractItemView, QApplication, QMenu, QFileDialog
 
-from Analysis import BinaryAnalysis
+WINDOW_ROWS = 1 << 14
+
+
+class HexModel(QAbstractTableModel):
+    """
+    Table model over a RawData, cells are formatted from the bytes of the visible rows only.
+    The model only exposes WINDOW_ROWS rows starting at row base, HexView moves the window with its scroll bar,
+    so Qt never allocates anything per row of the whole file.
+    """
+
+    def __init__(self, data, column, text=False, parent=None):
+        super(HexModel, self).__init__(parent)
+        self.rawData = data
+        self.column = column
+        self.text = text
+        self.base = 0
+
+    def totalRows(self):
+        return (len(self.rawData) + self.column - 1) // self.column
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return min(WINDOW_ROWS, self.totalRows() - self.base)
+
+    def columnCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return self.column
+
+    def offset(self, index):
+        return (self.base + index.row()) * self.column + index.column()
+
+    def indexAtOffset(self, offset):
+        row = offset // self.column - self.base
+        if 0 <= row < self.rowCount():
+            return self.index(row, offset % self.column)
+        return QModelIndex()
+
+    def setBase(self, base):
+        self.beginResetModel()
+        self.base = base
+        self.endResetModel()
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or role != Qt.DisplayRole:
+            return None
+        offset = self.offset(index)
+        if offset >= len(self.rawData):
+            return None
+        byte = self.rawData[offset]
+        if not self.text:
+            return '%02x' % byte
+        if chr(byte) in string.printable:
+            return chr(byte).strip()
+        return '.'
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role != Qt.DisplayRole:
+            return None
+        if orientation == Qt.Horizontal:
+            return '%X' % section
+        return '%x' % (self.base + section)
+
+    def bytesChanged(self, offset, length):
+        first = max(offset // self.column - self.base, 0)
+        last = min((offset + length - 1) // self.column - self.base, self.rowCount() - 1)
+        if first > last:
+            return
+        self.dataChanged.emit(self.index(first, 0), self.index(last, self.column - 1), [Qt.DisplayRole])
+
 
 class Hex(QTableView):
-    def __init__(self, data, scroll, parent):
+    def __init__(self, data, parent):
         super(Hex, self).__init__(parent)
         self.data = data
         self.column = 16
         self.menu = QMenu(self)
         self.dumpAction = self.menu.addAction("Dump")
-        self.model = QStandardItemModel(self)
-        self.setVerticalScrollBar(scroll)
-        self.verticalScrollBar().hide()
-        self.horizontalScrollBar().hide()
-        self.initModel()
+        self.model = HexModel(data, self.column, parent=self)
+        self.setModel(self.model)
         self.setShowGrid(False)
         self.horizontalHeader().setSectionResizeMode(QHeaderView.Fixed)
         self.horizontalHeader().setDefaultSectionSize(30)
@@ -29,23 +95,6 @@ class Hex(QTableView):
         self.setFixedWidth(30 * self.column + self.horizontalHeader().sectionSizeHint(0) + 45)
         self.setSelectionMode(QAbstractItemView.ExtendedSelection)
 
-    def initModel(self):
-        header = ['%X' % i for i in range(16)]
-        self.model.setHorizontalHeaderLabels(header)
-        i = 0
-        while i < len(self.data):
-            row = []
-            for c in range(self.column):
-                row.append(QStandardItem('%02x' % self.data[i]))
-                i += 1
-                if i == len(self.data):
-                    break
-            self.model.appendRow(row)
-        totalRow = self.model.rowCount()
-        vHeader = ['%x' % (i) for i in range(totalRow)]
-        self.model.setVerticalHeaderLabels(vHeader)
-        self.setModel(self.model)
-
     def mousePressEvent(self, event):
         if event.button() == Qt.LeftButton:
             modifiers = QApplication.keyboardModifiers()
@@ -77,23 +126,22 @@ class Hex(QTableView):
             if action == self.dumpAction:
                 data = []
                 for index in self.selectedIndexes():
-                    row = index.row()
-                    column = index.column()
-                    cell = self.model.index(row, column)
-                    data.append(int(cell.data(), 16))
+                    offset = self.model.offset(index)
+                    if offset < len(self.data):
+                        data.append(self.data[offset])
                 fileName, _ = QFileDialog.getSaveFileName(self, "Save File")
-                with open(fileName, 'wb') as f:
-                    f.write(bytearray(data))
+                if fileName:
+                    with open(fileName, 'wb') as f:
+                        f.write(bytearray(data))
 
 
 class Text(QTableView):
-    def __init__(self, data, scroll, parent):
+    def __init__(self, data, parent):
         super(Text, self).__init__(parent)
         self.data = data
         self.column = 16
-        self.model = QStandardItemModel(self)
-        self.setVerticalScrollBar(scroll)
-        self.initModel()
+        self.model = HexModel(data, self.column, text=True, parent=self)
+        self.setModel(self.model)
         self.setShowGrid(False)
         self.horizontalHeader().setSectionResizeMode(QHeaderView.Fixed)
         self.horizontalHeader().setDefaultSectionSize(16)
@@ -103,24 +151,6 @@ class Text(QTableView):
         self.setVerticalScrollBarPolicy(Qt.ScrollBarAlwaysOff)
         self.setHorizontalScrollBarPolicy(Qt.ScrollBarAlwaysOff)
 
-    def initModel(self):
-        header = ['%X' % i for i in range(16)]
-        self.model.setHorizontalHeaderLabels(header)
-        i = 0
-        while i < len(self.data):
-            row = []
-            for c in range(self.column):
-                if chr(self.data[i]) in string.printable:
-                    s = chr(self.data[i]).strip()
-                    row.append(QStandardItem(s))
-                else:
-                    row.append(QStandardItem('.'))
-                i += 1
-                if i == len(self.data):
-                    break
-            self.model.appendRow(row)
-        self.setModel(self.model)
-
     def mousePressEvent(self, event):
         if event.button() == Qt.LeftButton:
             modifiers = QApplication.keyboardModifiers()
@@ -152,37 +182,61 @@ class HexView(QWidget):
         super(HexView, self).__init__()
         self.layout = QHBoxLayout(self)
         self.scrollBar = QScrollBar(self)
-        self.hex = Hex(data, self.scrollBar, self)
-        self.text = Text(data, self.scrollBar, self)
+        self.hex = Hex(data, self)
+        self.text = Text(data, self)
         self.layout.addWidget(self.hex)
         self.layout.addWidget(self.scrollBar)
         self.layout.addWidget(self.text)
+        self.syncing = False
+        self.scrollBar.setRange(0, max(0, self.hex.model.totalRows() - 1))
+        self.scrollBar.valueChanged.connect(self.scrollToRow)
+        self.hex.verticalScrollBar().valueChanged.connect(self.syncScrollBar)
+        self.text.verticalScrollBar().valueChanged.connect(self.syncScrollBar)
+
+    def pageRows(self):
+        return max(1, self.hex.viewport().height() // self.hex.verticalHeader().defaultSectionSize())
+
+    def resizeEvent(self, event):
+        super(HexView, self).resizeEvent(event)
+        self.scrollBar.setPageStep(self.pageRows())
+        self.scrollBar.setMaximum(max(0, self.hex.model.totalRows() - self.pageRows()))
+
+    def scrollToRow(self, row):
+        """
+        Show row at the top of both tables, moving the window of the models if row is outside of it
+        """
+        if self.syncing:
+            return
+        self.syncing = True
+        model = self.hex.model
+        if row < model.base or row + self.pageRows() > model.base + model.rowCount():
+            base = max(0, min(row - WINDOW_ROWS // 2, model.totalRows() - WINDOW_ROWS))
+            self.hex.model.setBase(base)
+            self.text.model.setBase(base)
+        self.hex.verticalScrollBar().setValue(row - model.base)
+        self.text.verticalScrollBar().setValue(row - model.base)
+        self.syncing = False
+
+    def syncScrollBar(self, value):
+        if not self.syncing:
+            self.scrollBar.setValue(self.hex.model.base + value)
 
     def toOffset(self, offset, length=1):
         self.hex.clearSelection()
         self.hex.clearFocus()
         self.text.clearSelection()
-        self.hex.clearFocus()
-        fIndex = None
+        self.text.clearFocus()
+        row = offset // self.hex.column
+        self.scrollBar.setValue(max(0, row - self.pageRows() // 2))
         for i in range(offset, offset + length):
-            row = i / self.hex.column
-            col = i % self.hex.column
-            cell = self.hex.model.index(row, col)
-            if fIndex is None:
-                fIndex = cell
-            self.hex.selectionModel().select(cell, QItemSelectionModel.Select)
-            self.text.selectionModel().select(cell, QItemSelectionModel.Select)
-        self.hex.scrollTo(fIndex, QAbstractItemView.PositionAtCenter)
+            hexCell = self.hex.model.indexAtOffset(i)
+            if hexCell.isValid():
+                self.hex.selectionModel().select(hexCell, QItemSelectionModel.Select)
+                self.text.selectionModel().select(self.text.model.indexAtOffset(i), QItemSelectionModel.Select)
 
     def changeData(self, offset, data):
-        for i in range(offset, offset + len(data)):
-            row = i / self.hex.column
-            col = i % self.hex.column
-            hexCell = self.hex.model.item(row, col)
-            hexCell.setText('%x' % data[i - offset])
-            textCell = self.text.model.item(row, col)
-            if (32 <= data[i - offset]) and (data[i - offset] <= 127):
-                textCell.setText(chr(data[i - offset]))
-            else:
-                textCell.setText('.')
-            BinaryAnalysis.rawData[i] = data[i - offset]
+        """
+        Refresh the cells of bytes which were already written in the RawData, by BinaryAnalysis.patch
+        """
+        self.hex.model.bytesChanged(offset, len(data))
+        self.text.model.bytesChanged(offset, len(data))
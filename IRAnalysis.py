@@ -1,14 +1,18 @@
+import hashlib
+
 from future.utils import viewitems
 from future.utils import viewvalues
 from miasm.analysis.data_flow import load_from_int
+from miasm.analysis.depgraph import DependencyGraph
 from miasm.analysis.simplifier import IRCFGSimplifierCommon, IRCFGSimplifierSSA
 from miasm.analysis.ssa import SSADiGraph
 from miasm.expression.expression import ExprId, ExprInt, ExprMem, ExprLoc, ExprOp, ExprSlice, ExprCond, LocKey
 from miasm.ir.ir import IRBlock, AssignBlock
-from miasm.analysis.data_flow import DiGraphDefUse, ReachingDefinitions
+from miasm.analysis.data_flow import AssignblkNode, DiGraphDefUse, ReachingDefinitions
 from miasm.core.locationdb import LocationDB
 from miasm.ir.symbexec import SymbolicExecutionEngine
 
+import Utils
 from Analysis import BinaryAnalysis
 
 
@@ -117,18 +121,133 @@ class CustomIRCFGSimplifierSSA(IRCFGSimplifierSSA):
         return ircfg
 
 
+def blockHash(block):
+    """
+    :return: digest of the content of an asm block: its location, the offset and bytes of its lines and its successors
+    """
+    sha = hashlib.sha1(str(block.loc_key).encode())
+    for line in block.lines:
+        sha.update(b'%x:' % line.offset)
+        sha.update(line.b)
+    for constraint in block.bto:
+        sha.update(('%s %s' % (constraint.loc_key, constraint.c_t)).encode())
+    return sha.digest()
+
+
+def liftCFG(ira, cfg, blockCache):
+    """
+    Lift cfg with ira, the IR blocks of an asm block are reused if it was already lifted with the same IRA type
+    :param blockCache: dict (IRA type name, block hash) -> IR blocks
+    :return: IRCFG
+    """
+    ircfg = ira.new_ircfg()
+    name = type(ira).__name__
+    for block in cfg.blocks:
+        key = (name, blockHash(block))
+        if key in blockCache:
+            for irBlock in blockCache[key]:
+                ircfg.add_irblock(irBlock)
+        else:
+            blockCache[key] = ira.add_asmblock_to_ircfg(block, ircfg)
+    return ircfg
+
+
+@Utils.analysisLocked
+def getIRAnalysis(func):
+    """
+    IRAnalysis of func shared by all views and actions.
+    It is kept in BinaryAnalysis.irCache with the hashes of the blocks of the function and rebuilt when they changed,
+    reusing the IR of the blocks which did not change.
+    """
+    hashes = sorted(blockHash(block) for block in func.cfg.blocks)
+    entry = BinaryAnalysis.irCache.get(func.address)
+    if entry is not None and entry[0] == hashes:
+        return entry[1]
+    blockCache = {}
+    if entry is not None:
+        valid = set(hashes)
+        blockCache = {key: irBlocks for key, irBlocks in entry[1].blockCache.items() if key[1] in valid}
+    ira = IRAnalysis(func.address, func.cfg, blockCache)
+    BinaryAnalysis.irCache[func.address] = (hashes, ira)
+    return ira
+
+
+def dependencyReport(func, address, arg):
+    """
+    Find the values the register arg can have at address, with a DependencyGraph of the raw IR of func
+    :return: text of the solutions, the values of the registers they depend on and the path of blocks
+    """
+    ira = getIRAnalysis(func)
+    ircfg = ira.getRawIRCFG()
+    indexReg = eval('BinaryAnalysis.machine.mn.regs.regs' + str(arg.size).zfill(2) + '_expr').index(arg)
+    arg = eval('BinaryAnalysis.machine.mn.regs.regs' + str(BinaryAnalysis.disasmEngine.attrib).zfill(2) + '_expr')[
+        indexReg]
+    elements = set()
+    elements.add(arg)
+    depgraph = DependencyGraph(ircfg, implicit=False, apply_simp=True, follow_call=False, follow_mem=True)
+    currentLockey = next(iter(ircfg.getby_offset(address)))
+    assignblkIndex = 0
+    currentBlock = ircfg.get_block(currentLockey)
+    for assignblkIndex, assignblk in enumerate(currentBlock):
+        if assignblk.instr.offset == address:
+            break
+    outputLog = ''
+    for solNum, sol in enumerate(depgraph.get(currentBlock.loc_key, elements, assignblkIndex, set())):
+        Utils.checkCancelled()
+        Utils.reportProgress('dependency solutions', solNum + 1)
+        results = sol.emul(ira.getRawIRA(), ctx={})
+        outputLog += 'Solution %d:\n' % solNum
+        for k, v in viewitems(results):
+            outputLog += str(k) + ' = ' + str(v) + '\n'
+        path = ' -> '.join(BinaryAnalysis.locDB.pretty_str(h) for h in sol.history[::-1])
+        outputLog += path + '\n\n'
+    return outputLog
+
+
+def taintedAddresses(func, lockey, address):
+    """
+    Follow the raw def-use graph of func from the value written by the instruction at address of the block lockey
+    :return: addresses of the instructions using the value, directly or not, the instruction at address first
+    """
+    ira = getIRAnalysis(func)
+    ircfg = ira.getRawIRCFG()
+    index = 0
+    dstArg = None
+    for index, assignblk in enumerate(ircfg.get_block(lockey)):
+        if assignblk.instr.offset == address:
+            for dst in assignblk:
+                dstArg = dst
+            break
+    defUse = ira.getRawDefUse()
+    queue = [AssignblkNode(lockey, index, dstArg)]
+    addresses = []
+    for node in queue:
+        Utils.checkCancelled()
+        addresses.append(ircfg.blocks[node.label][node.index].instr.offset)
+        queue.extend(defUse.successors(node))
+    return addresses
+
+
+def recoverFunction(func):
+    """
+    :return: (LocationDB, IRCFG) of the deobfuscated IR of func, see IRAnalysis.recoverAlgorithm
+    """
+    return getIRAnalysis(func).recoverAlgorithm()
+
+
 class IRAnalysis:
-    def __init__(self, address, cfg):
+    def __init__(self, address, cfg, blockCache=None):
         self.rawIRA = BinaryAnalysis.iraType(cfg.loc_db)
         self.normalIRA = BinaryAnalysis.iraType(cfg.loc_db)
         self.ssaIRA = IRADelModCallStack(cfg.loc_db)
         self.maxIRA1 = IRADelModCallStack(cfg.loc_db)
         self.maxIRA2 = IRAOutRegs(cfg.loc_db)
-        self.rawIRCFG = self.rawIRA.new_ircfg_from_asmcfg(cfg)
+        self.blockCache = {} if blockCache is None else blockCache
+        self.rawIRCFG = None
         self.normalIRCFG = None
         self.ssaIRCFG = None
         self.maxIRCFG = None
-        self.rawDefUse = DiGraphDefUse(ReachingDefinitions(self.rawIRCFG))
+        self.rawDefUse = None
         self.normalDefUse = None
         self.ssaDefUse = None
         self.maxDefUse = None
@@ -137,35 +256,35 @@ class IRAnalysis:
         self.cfg = cfg
 
     def getRawIRCFG(self):
+        if self.rawIRCFG is None:
+            self.rawIRCFG = liftCFG(self.rawIRA, self.cfg, self.blockCache)
         return self.rawIRCFG
 
     def getNormalIRCFG(self):
         if self.normalIRCFG is not None:
             return self.normalIRCFG
         else:
-            self.normalIRCFG = self.normalIRA.new_ircfg_from_asmcfg(self.cfg)
+            self.normalIRCFG = liftCFG(self.normalIRA, self.cfg, self.blockCache)
             simplifier = IRCFGSimplifierCommon(self.normalIRA)
             simplifier.simplify(self.normalIRCFG, self.head)
-            self.normalDefUse = DiGraphDefUse(ReachingDefinitions(self.normalIRCFG))
             return self.normalIRCFG
 
     def getSSAIRCFG(self):
         if self.ssaIRCFG is not None:
             return self.ssaIRCFG
         else:
-            self.ssaIRCFG = self.ssaIRA.new_ircfg_from_asmcfg(self.cfg)
+            self.ssaIRCFG = liftCFG(self.ssaIRA, self.cfg, self.blockCache)
             simplifier = IRCFGSimplifierCommon(self.ssaIRA)
             simplifier.simplify(self.ssaIRCFG, self.head)
             ssa = SSADiGraph(self.ssaIRCFG)
             ssa.transform(self.head)
-            self.ssaDefUse = DiGraphDefUse(ReachingDefinitions(self.ssaIRCFG))
             return self.ssaIRCFG
 
     def getMaxIRCFG(self):
         if self.maxIRCFG is not None:
             return self.maxIRCFG
         else:
-            self.maxIRCFG = self.maxIRA1.new_ircfg_from_asmcfg(self.cfg)
+            self.maxIRCFG = liftCFG(self.maxIRA1, self.cfg, self.blockCache)
             simplifier = IRCFGSimplifierCommon(self.maxIRA1)
             simplifier.simplify(self.maxIRCFG, self.head)
             for loc in self.maxIRCFG.leaves():
@@ -182,25 +301,26 @@ class IRAnalysis:
                 self.maxIRCFG.blocks[loc] = newIrBlock
             simplifier = CustomIRCFGSimplifierSSA(self.maxIRA2)
             simplifier.simplify(self.maxIRCFG, self.head)
-            self.maxDefUse = DiGraphDefUse(ReachingDefinitions(self.maxIRCFG))
             return self.maxIRCFG
 
     def getRawDefUse(self):
+        if self.rawDefUse is None:
+            self.rawDefUse = DiGraphDefUse(ReachingDefinitions(self.getRawIRCFG()))
         return self.rawDefUse
 
     def getNormalDefUse(self):
         if self.normalDefUse is None:
-            self.getNormalIRCFG()
+            self.normalDefUse = DiGraphDefUse(ReachingDefinitions(self.getNormalIRCFG()))
         return self.normalDefUse
 
     def getSSADefUse(self):
-        if self.ssaIRCFG is None:
-            self.getSSAIRCFG()
+        if self.ssaDefUse is None:
+            self.ssaDefUse = DiGraphDefUse(ReachingDefinitions(self.getSSAIRCFG()))
         return self.ssaDefUse
 
     def getMaxDefUse(self):
         if self.maxDefUse is None:
-            self.getMaxIRCFG()
+            self.maxDefUse = DiGraphDefUse(ReachingDefinitions(self.getMaxIRCFG()))
         return self.maxDefUse
 
     def getRawIRA(self):
@@ -233,6 +353,8 @@ class IRAnalysis:
         todo = [(self.address, head, {}, None)]
         numLockey += 1
         while todo:
+            Utils.checkCancelled()
+            Utils.reportProgress('recovered blocks', len(newIRCFG.blocks))
             nextTarget, lockey, state, preBlock = todo.pop()
             nextTarget, state= self.symbolicExecution(self.normalIRA, self.normalIRCFG, nextTarget, state)
             if isinstance(nextTarget, ExprCond):
@@ -1,16 +1,15 @@
+import hashlib
 from functools import partial
 
 from PyQt5.QtCore import Qt, QItemSelectionModel
 from PyQt5.QtGui import QStandardItem
 from PyQt5.QtWidgets import QWidget, QVBoxLayout, QComboBox, QAction, QMenu
-from grandalf.graphs import Vertex, Edge, Graph
-from grandalf.layouts import SugiyamaLayout
-from grandalf.routing import route_with_lines
 from miasm.analysis.data_flow import AssignblkNode
 from miasm.expression.expression import ExprLoc, Expr
 
-from CFG import CFG, BasicBlock, BasicEdge
-from CommonView import CommonListView, IRLine, LocLine, QAbstractItemView
+from CFG import CFG, BasicBlock, BasicEdge, BlockItem
+from CommonView import CommonListView, IRLine, LocLine, QAbstractItemView, textLength
+from Scheduler import PRIORITY_VIEW, getScheduler
 
 
 class IRLinearView(CommonListView):
@@ -121,10 +120,10 @@ class IRLinearView(CommonListView):
 
 
 class IRWidget(QWidget):
-    def __init__(self, ira, viewType):
+    def __init__(self, func, viewType):
         super(IRWidget, self).__init__()
         layout = QVBoxLayout(self)
-        self.ira = ira
+        self.func = func
         self.viewType = viewType
         self.optimizeCB = QComboBox(self)
         self.optimizeCB.addItem('Raw')
@@ -132,46 +131,64 @@ class IRWidget(QWidget):
         self.optimizeCB.addItem("SSA Form")
         self.optimizeCB.addItem("Maxium Simplify")
         self.optimizeCB.currentIndexChanged.connect(self.changeOptimizeMode)
-        self.currentIRCFG = self.ira.getRawIRCFG()
-        self.currentIRA = self.ira.getRawIRA()
-        self.currentDefUse = self.ira.getRawDefUse()
-        if viewType == 0:
-            self.mainWidget = IRLinearView(self.currentIRA, self.currentIRCFG, self.currentDefUse)
-        else:
-            self.mainWidget = IRCFGView(self.currentIRA, self.currentIRCFG, self.currentDefUse)
+        self.currentIRCFG = None
+        self.currentIRA = None
+        self.currentDefUse = None
+        self.currentMode = None
+        self.mainWidget = None
+        self.task = None
         layout.addWidget(self.optimizeCB, 1)
-        layout.addWidget(self.mainWidget, 9)
-
-    def changeOptimizeMode(self, index):
+        self.changeOptimizeMode(0)
+
+    @staticmethod
+    def computeIR(func, index):
+        """
+        :return: (IRA, IRCFG, DiGraphDefUse) of func for the optimize mode index
+        """
+        from IRAnalysis import getIRAnalysis
+        ira = getIRAnalysis(func)
         if index == 0:
-            self.currentIRA = self.ira.getRawIRA()
-            self.currentIRCFG = self.ira.getRawIRCFG()
-            self.currentDefUse = self.ira.getRawDefUse()
+            return ira.getRawIRA(), ira.getRawIRCFG(), ira.getRawDefUse()
         elif index == 1:
-            self.currentIRA = self.ira.getNormalIRA()
-            self.currentIRCFG = self.ira.getNormalIRCFG()
-            self.currentDefUse = self.ira.getNormalDefUse()
+            return ira.getNormalIRA(), ira.getNormalIRCFG(), ira.getNormalDefUse()
         elif index == 2:
-            self.currentIRA = self.ira.getSSAIRA()
-            self.currentIRCFG = self.ira.getSSAIRCFG()
-            self.currentDefUse = self.ira.getSSADefUse()
-        else:
-            self.currentIRA = self.ira.getMaxIRA()
-            self.currentIRCFG = self.ira.getMaxIRCFG()
-            self.currentDefUse = self.ira.getMaxDefUse()
+            return ira.getSSAIRA(), ira.getSSAIRCFG(), ira.getSSADefUse()
+        return ira.getMaxIRA(), ira.getMaxIRCFG(), ira.getMaxDefUse()
+
+    def changeOptimizeMode(self, index):
+        """
+        Compute the IR of the mode in the background, the current IR stays shown until it is ready
+        """
+        if self.task is not None:
+            self.task.cancel()
+        self.task = getScheduler().submit(self.computeIR, self.func, index, priority=PRIORITY_VIEW,
+                                          name=self.optimizeCB.itemText(index))
+        self.task.finished.connect(partial(self.showIR, index))
+
+    def showIR(self, index, result):
+        self.task = None
+        self.currentMode = index
+        self.currentIRA, self.currentIRCFG, self.currentDefUse = result
         layout = self.layout()
-        layout.removeWidget(self.mainWidget)
+        if self.mainWidget is not None:
+            layout.removeWidget(self.mainWidget)
         if self.viewType == 0:
             self.mainWidget = IRLinearView(self.currentIRA, self.currentIRCFG, self.currentDefUse)
         else:
-            self.mainWidget = IRCFGView(self.currentIRA, self.currentIRCFG, self.currentDefUse)
+            self.mainWidget = IRCFGView(self.currentIRA, self.currentIRCFG, self.currentDefUse, self.layoutKey())
         layout.addWidget(self.mainWidget, 9)
 
+    def layoutKey(self):
+        """
+        :return: key of the layout of the IRCFG shown in BinaryAnalysis.layoutCache
+        """
+        return 'ir', self.func.address, self.currentMode
+
     def keyPressEvent(self, event) -> None:
         pass
 
     def keyReleaseEvent(self, event) -> None:
-        if event.key() == Qt.Key_Space:
+        if event.key() == Qt.Key_Space and self.mainWidget is not None:
             layout = self.layout()
             layout.removeWidget(self.mainWidget)
             self.changeViewType()
@@ -179,7 +196,7 @@ class IRWidget(QWidget):
 
     def changeViewType(self):
         if self.viewType == 0:
-            self.mainWidget = IRCFGView(self.currentIRA, self.currentIRCFG, self.currentDefUse)
+            self.mainWidget = IRCFGView(self.currentIRA, self.currentIRCFG, self.currentDefUse, self.layoutKey())
             self.viewType = 1
         else:
             self.mainWidget = IRLinearView(self.currentIRA, self.currentIRCFG, self.currentDefUse)
@@ -199,61 +216,75 @@ class IRBlockView(BasicBlock):
             for dst, src in assignblk.items():
                 self.model.appendRow(IRLine(dst, src, block, index, self.pretty))
             index += 1
-        self.setSize()
-        self.w = self.width()
-        self.h = self.height()
+
+
+def irBlockItems(ircfg, names, pretty):
+    """
+    BlockItems of the blocks of ircfg and the edges between them, for CFG.placeBlocks
+    :param names: function giving the name of the block of a lockey
+    :return: (dict BlockItem -> hash of its block, list of (source BlockItem, destination BlockItem, BasicEdge))
+    """
+    items = {}
+    hashes = {}
+    for lockey, block in ircfg.blocks.items():
+        name = names(lockey)
+        lengths = [len(name)]
+        for assignblk in block.assignblks:
+            for dst, src in assignblk.items():
+                lengths.append(textLength(IRLine.lineComponents(dst, src, pretty)[1]))
+        items[lockey] = BlockItem(lockey, block, name, lengths)
+        hashes[items[lockey]] = hashlib.sha1(str(block).encode()).digest()
+    edges = []
+    for src in items:
+        for key in ircfg.successors(src):
+            if key in items:
+                srcItem = items[src]
+                dstItem = items[key]
+                edges.append((srcItem, dstItem, BasicEdge(dstItem)))
+                srcItem.outBlocks.append(dstItem)
+                dstItem.inBlocks.append(srcItem)
+    return hashes, edges
+
+
+def colorEdges(ircfg, edges):
+    for srcItem, dstItem, edgeView in edges:
+        if len(srcItem.outBlocks) == 1:
+            color = Qt.darkBlue
+        elif dstItem.lockey == ircfg.successors(srcItem.lockey)[0]:
+            color = Qt.darkRed
+        else:
+            color = Qt.darkGreen
+        edgeView.color = color
 
 
 class IRCFGView(CFG):
-    def __init__(self, ira, ircfg, defUse):
+    def __init__(self, ira, ircfg, defUse, layoutKey=None):
+        """
+        :param layoutKey: key of the layout in BinaryAnalysis.layoutCache, see IRWidget.layoutKey
+        """
         super(IRCFGView, self).__init__()
         self.ira = ira
         self.ircfg = ircfg
         self.defUse = defUse
+        self.layoutKey = layoutKey
         self.forwardTaintAct = QAction("Forward taint", self)
         self.backwardTaintAct = QAction("Backward taint", self)
         self.initView()
 
     def initView(self):
-        vertexs = {}
-        for lockey, block in self.ircfg.blocks.items():
-            vertexs[lockey] = Vertex(block)
-            vertexs[lockey].view = IRBlockView(lockey, block)
-        edges = []
-        for src in vertexs:
-            successLocKeys = self.ircfg.successors(src)
-            for key in successLocKeys:
-                if key in vertexs:
-                    vSrc = vertexs[src]
-                    vDst = vertexs[key]
-                    edge = Edge(vSrc, vDst)
-                    edge.view = BasicEdge(vDst)
-                    edges.append(edge)
-                    vSrc.view.outBlocks.append(vDst.view)
-                    vDst.view.inBlocks.append(vSrc.view)
-        self.graph = Graph(vertexs.values(), edges)
-        sugLayout = SugiyamaLayout(self.graph.C[0])
-        sugLayout.route_edge = route_with_lines
-        sugLayout.init_all()
-        sugLayout.draw()
-        for v in vertexs.values():
-            self.addBlock(v.view, v.view.xy[0] - (v.view.w / 2), v.view.xy[1] - (v.view.h / 2))
-        for e in edges:
-            srcView = e.v[0].view
-            srcBlock = e.v[0].data
-            dstBlock = e.v[1].data
-            if len(srcView.outBlocks) == 1:
-                color = Qt.darkBlue
-            elif dstBlock.loc_key == self.ircfg.successors(srcBlock.loc_key)[0]:
-                color = Qt.darkRed
-            else:
-                color = Qt.darkGreen
-            edge_view = e.view
-            edge_view.color = color
-            self.scene.addItem(edge_view)
+        hashes, edges = irBlockItems(self.ircfg, LocLine.locName, True)
+        self.placeBlocks(self.layoutKey, hashes, edges)
+        colorEdges(self.ircfg, edges)
+        for _, _, edgeView in edges:
+            self.scene.addItem(edgeView)
+
+    def createBlockView(self, item):
+        return IRBlockView(item.lockey, item.data)
 
     def mouseDoubleClickEvent(self, event) -> None:
         block = self.clickedBlock
+        if block is None:
+            return
         line = block.getLineSelected()
         index = block.lastClickIndex
         arg = line.args[index]
@@ -261,13 +292,13 @@ class IRCFGView(CFG):
             self.focusLoc(arg.loc_key)
 
     def highlightText(self, clickedBlock, text, index):
-        for block in self.mapItems:
-            if block != clickedBlock:
-                block.highlighRelation(text, 0)
+        self.highlightBlocks(clickedBlock, text, 0)
 
     def contextMenuEvent(self, event) -> None:
-        menu = QMenu(self)
         block = self.clickedBlock
+        if block is None:
+            return
+        menu = QMenu(self)
         item = block.getLineSelected()
         block.getClickedIndex(item, False)
         if isinstance(item, IRLine):
@@ -316,68 +347,39 @@ class IRCFGView(CFG):
 
     def selectLine(self, lockey, index, var):
         expr = self.ircfg.blocks[lockey][index][var]
-        i = 0
-        for block in self.mapItems:
-            while i < block.model.rowCount():
-                item = block.model.item(i, 0)
-                if isinstance(item, LocLine):
-                    if item.lockey == lockey:
-                        i += 1
-                        item = block.model.item(i, 0)
-                        while item.src != expr:
-                            i += 1
-                            item = block.model.item(i, 0)
-                        block.selectionModel().select(block.model.index(i, 0), QItemSelectionModel.Select)
-                        return
-                i += 1
+        block = self.blockView(self.blockItems[lockey])
+        i = 1
+        while block.model.item(i, 0).src != expr:
+            i += 1
+        block.selectionModel().select(block.model.index(i, 0), QItemSelectionModel.Select)
 
 
 class IRCFGRecover(CFG):
-    def __init__(self, ircfg):
+    def __init__(self, ircfg, locDB):
+        """
+        :param locDB: LocationDB naming the blocks of ircfg
+        """
         super(IRCFGRecover, self).__init__()
         self.ircfg = ircfg
+        self.locDB = locDB
         self.initView()
 
     def initView(self):
-        vertexs = {}
-        for lockey, block in self.ircfg.blocks.items():
-            vertexs[lockey] = Vertex(block)
-            vertexs[lockey].view = IRBlockView(lockey, block, False)
-        edges = []
-        for src in vertexs:
-            successLocKeys = self.ircfg.successors(src)
-            for key in successLocKeys:
-                if key in vertexs:
-                    vSrc = vertexs[src]
-                    vDst = vertexs[key]
-                    edge = Edge(vSrc, vDst)
-                    edge.view = BasicEdge(vDst)
-                    edges.append(edge)
-                    vSrc.view.outBlocks.append(vDst.view)
-                    vDst.view.inBlocks.append(vSrc.view)
-        self.graph = Graph(vertexs.values(), edges)
-        sugLayout = SugiyamaLayout(self.graph.C[0])
-        sugLayout.route_edge = route_with_lines
-        sugLayout.init_all()
-        sugLayout.draw()
-        for v in vertexs.values():
-            self.addBlock(v.view, v.view.xy[0] - (v.view.w / 2), v.view.xy[1] - (v.view.h / 2))
-        for e in edges:
-            srcView = e.v[0].view
-            srcBlock = e.v[0].data
-            dstBlock = e.v[1].data
-            if len(srcView.outBlocks) == 1:
-                color = Qt.darkBlue
-            elif dstBlock.loc_key == self.ircfg.successors(srcBlock.loc_key)[0]:
-                color = Qt.darkRed
-            else:
-                color = Qt.darkGreen
-            edge_view = e.view
-            edge_view.color = color
-            self.scene.addItem(edge_view)
+        hashes, edges = irBlockItems(self.ircfg, self.locDB.pretty_str, False)
+        self.placeBlocks(None, hashes, edges)
+        colorEdges(self.ircfg, edges)
+        for _, _, edgeView in edges:
+            self.scene.addItem(edgeView)
+
+    def createBlockView(self, item):
+        view = IRBlockView(item.lockey, item.data, False)
+        view.model.item(0, 0).setText(self.locDB.pretty_str(item.lockey))
+        return view
 
     def mouseDoubleClickEvent(self, event) -> None:
         block = self.clickedBlock
+        if block is None:
+            return
         line = block.getLineSelected()
         index = block.lastClickIndex
         arg = line.args[index]
@@ -385,6 +387,4 @@ class IRCFGRecover(CFG):
             self.focusLoc(arg.loc_key)
 
     def highlightText(self, clickedBlock, text, index):
-        for block in self.mapItems:
-            if block != clickedBlock:
-                block.highlighRelation(text, 0)
+        self.highlightBlocks(clickedBlock, text, 0)
@@ -1,4 +1,4 @@
-from PyQt5.QtCore import pyqtSignal
+from PyQt5.QtCore import pyqtSignal, Qt, QAbstractTableModel, QModelIndex
 from PyQt5.QtGui import QStandardItem, QStandardItemModel
 from PyQt5.QtWidgets import QTableView, QHeaderView
 
@@ -7,23 +7,59 @@ class InfoView(QTableView):
 
     def __init__(self, header, data):
         super(InfoView, self).__init__()
-        self.model = QStandardItemModel(self)
-        for i in range(len(data)):
-            rows = []
-            for j in range(len(header)):
-                item = QStandardItem(str(data[i][j].encode())[2:-1])
-                rows.append(item)
-            self.model.appendRow(rows)
+        self.initModel(header, data)
         self.setModel(self.model)
         self.setShowGrid(False)
         self.setEditTriggers(QTableView.NoEditTriggers)
         self.setSelectionBehavior(QTableView.SelectRows)
-        self.model.setHorizontalHeaderLabels(header)
         self.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeToContents)
         self.horizontalHeader().setStretchLastSection(True)
         self.verticalHeader().hide()
         self.setStyleSheet("QHeaderView::section:horizontal {margin-right: 80px;}")
 
+    def initModel(self, header, data):
+        self.model = QStandardItemModel(self)
+        for i in range(len(data)):
+            rows = []
+            for j in range(len(header)):
+                item = QStandardItem(str(data[i][j].encode())[2:-1])
+                rows.append(item)
+            self.model.appendRow(rows)
+        self.model.setHorizontalHeaderLabels(header)
+
+
+class StringModel(QAbstractTableModel):
+    """
+    Table model over a StringIndex, the text of a string is only decoded when its row is shown
+    """
+
+    def __init__(self, header, strings, parent=None):
+        super(StringModel, self).__init__(parent)
+        self.header = header
+        self.strings = strings
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.strings)
+
+    def columnCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.header)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or role != Qt.DisplayRole:
+            return None
+        if index.column() == 0:
+            return hex(self.strings.addresses[index.row()])
+        return str(self.strings.text(index.row()).encode())[2:-1]
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            return self.header[section]
+        return None
+
 
 class StringView(InfoView):
     clicked = pyqtSignal(int)
@@ -31,10 +67,12 @@ class StringView(InfoView):
     def __init__(self, strings):
         super(StringView, self).__init__(['Address', 'String'], strings)
 
+    def initModel(self, header, strings):
+        self.model = StringModel(header, strings, self)
+
     def mouseDoubleClickEvent(self, event) -> None:
         index = self.currentIndex()
-        cell = self.model.item(index.row(), 0)
-        address = int(cell.text(), 16)
+        address = self.model.strings.addresses[index.row()]
         self.clicked.emit(address)
         super(StringView, self).mouseDoubleClickEvent(event)
 
@@ -0,0 +1,437 @@
+from array import array
+from bisect import bisect_left, bisect_right
+from itertools import compress
+
+from miasm.core.asmblock import AsmBlock, AsmBlockBad, AsmCFG, AsmConstraint
+from miasm.expression.expression import ExprId, ExprInt, ExprLoc, ExprMem, LocKey
+
+OP_OTHER = 0
+OP_ID = 1
+OP_INT = 2
+OP_MEM = 3
+OP_LOC = 4
+MASK64 = (1 << 64) - 1
+# kinds of the constraint table
+CONSTRAINTS = (AsmConstraint.c_to, AsmConstraint.c_next)
+# blockErrors of the blocks which were disassembled, the others have the errno of their AsmBlockBad
+NO_ERROR = -128
+
+
+def needsLabel(block, func):
+    """
+    :return: 1 if the block is shown after a label line in the listings, 0 if it simply follows its only predecessor
+    """
+    pres = func.cfg.predecessors(block.loc_key)
+    if len(pres) == 1:
+        preBlock = func.cfg.loc_key_to_block(pres[0])
+        return int(preBlock.lines[-1].name != 'CALL')
+    return 1
+
+
+def operandOf(arg):
+    """
+    :return: (kind, value) of an instruction argument in the operand table, value is the constant, the key of the
+        location or the address of the memory for constant pointers, 0 otherwise
+    """
+    if isinstance(arg, ExprInt):
+        return OP_INT, int(arg.arg) & MASK64
+    if isinstance(arg, ExprLoc):
+        return OP_LOC, arg.loc_key.key
+    if isinstance(arg, ExprMem):
+        if isinstance(arg.ptr, ExprInt):
+            return OP_MEM, int(arg.ptr.arg) & MASK64
+        return OP_MEM, 0
+    if isinstance(arg, ExprId):
+        return OP_ID, 0
+    return OP_OTHER, 0
+
+
+def shift(column, start, delta):
+    """
+    Add delta to the values of column from start
+    """
+    if delta:
+        column[start:] = array(column.typecode, (value + delta for value in column[start:]))
+
+
+class InstructionStore:
+    """
+    Disassembled code of the binary stored as parallel arrays, it owns the blocks of all the functions.
+    The blocks are sorted by address. Blocks of different functions may start at the same address, one of them is
+    listed. The instructions of block b are the rows [blockFirst[b], blockFirst[b + 1]) of the columns address,
+    length, mnemonic id and function id. The arguments of row r are the entries [operandFirst[r], operandFirst[r + 1])
+    of the operand table (kind, value), the constraints of block b the entries
+    [constraintFirst[b], constraintFirst[b + 1]) of the constraint table (loc key, kind).
+    The instruction and AsmBlock objects are rebuilt from them when they are asked for, see instruction and
+    functionCFG.
+    """
+
+    def __init__(self):
+        self.addresses = array('Q')
+        self.lengths = array('B')
+        self.mnemonics = array('H')
+        self.functions = array('I')
+        self.operandFirst = array('I', [0])
+        self.operandKinds = array('B')
+        self.operandValues = array('Q')
+        self.blockAddresses = array('Q')
+        self.blockEnds = array('Q')
+        # maximum of the ends of the blocks up to b, blocks of different functions may overlap
+        self.blockMaxEnds = array('Q')
+        self.blockFirst = array('I', [0])
+        self.blockFuncs = array('I')
+        self.blockLabels = array('B')
+        self.blockListed = array('B')
+        self.blockLockeys = array('Q')
+        self.blockErrors = array('b')
+        self.constraintFirst = array('I', [0])
+        self.constraintLockeys = array('Q')
+        self.constraintKinds = array('B')
+        self.names = []
+        self.nameIds = {}
+        self.funcs = []
+        self.funcIds = {}
+        # number of blocks of each function id
+        self.funcBlocks = array('I')
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # the function ids are keyed by id(), rebuilt when loaded
+        del state['funcIds']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.funcIds = dict((id(func), i) for i, func in enumerate(self.funcs))
+
+    @staticmethod
+    def fromBlocks(entries, locDB):
+        """
+        :param entries: list of (block, func) sorted by address, the first block with lines at an address is listed
+        :return: InstructionStore of the blocks
+        """
+        store = InstructionStore()
+        store.replaceBlocks(set(), entries, locDB)
+        return store
+
+    # ============================== building ==============================
+
+    def nameId(self, name):
+        nameId = self.nameIds.get(name)
+        if nameId is None:
+            nameId = self.nameIds[name] = len(self.names)
+            self.names.append(name)
+        return nameId
+
+    def funcId(self, func):
+        funcId = self.funcIds.get(id(func))
+        if funcId is None:
+            funcId = self.funcIds[id(func)] = len(self.funcs)
+            self.funcs.append(func)
+            self.funcBlocks.append(0)
+        return funcId
+
+    def blockRecord(self, block, func, locDB):
+        """
+        :return: (address, end, funcId, label, listed, lockey, error, constraints, rows) of block where constraints
+            are (loc key, kind) and rows are (address, length, nameId, operands), the block is not listed yet
+        """
+        rows = [(line.offset, line.l, self.nameId(line.name), [operandOf(arg) for arg in line.args])
+                for line in block.lines]
+        constraints = sorted((cst.loc_key.key, CONSTRAINTS.index(cst.c_t)) for cst in block.bto)
+        error = NO_ERROR
+        if isinstance(block, AsmBlockBad):
+            error = AsmBlockBad.ERROR_UNKNOWN if block.errno is None else block.errno
+        if block.lines:
+            lastLine = block.lines[-1]
+            address, end, label = block.lines[0].offset, lastLine.offset + lastLine.l, needsLabel(block, func)
+        else:
+            address = end = locDB.get_location_offset(block.loc_key) or 0
+            label = 0
+        return address, end, self.funcId(func), label, 0, block.loc_key.key, error, constraints, rows
+
+    def storedRecord(self, b):
+        """
+        :return: record of the stored block b, like blockRecord
+        """
+        rows = [(self.addresses[r], self.lengths[r], self.mnemonics[r], self.operands(r)) for r in self.rowsOfBlock(b)]
+        return (self.blockAddresses[b], self.blockEnds[b], self.blockFuncs[b], self.blockLabels[b],
+                self.blockListed[b], self.blockLockeys[b], self.blockErrors[b], self.constraints(b), rows)
+
+    def splice(self, first, last, records):
+        """
+        Replace the blocks [first, last) by the blocks of records, which must keep the blocks sorted
+        """
+        firstRow, lastRow = self.blockFirst[first], self.blockFirst[last]
+        firstOperand, lastOperand = self.operandFirst[firstRow], self.operandFirst[lastRow]
+        firstConstraint, lastConstraint = self.constraintFirst[first], self.constraintFirst[last]
+        addresses, lengths, mnemonics, functions = array('Q'), array('B'), array('H'), array('I')
+        operandFirst, operandKinds, operandValues = array('I'), array('B'), array('Q')
+        constraintFirst, constraintLockeys, constraintKinds = array('I'), array('Q'), array('B')
+        blockFirst = array('I')
+        row, operand, constraint = firstRow, firstOperand, firstConstraint
+        for b in range(first, last):
+            self.funcBlocks[self.blockFuncs[b]] -= 1
+        for address, end, funcId, label, listed, lockey, error, constraints, rows in records:
+            self.funcBlocks[funcId] += 1
+            blockFirst.append(row)
+            constraintFirst.append(constraint)
+            for dstLockey, kind in constraints:
+                constraintLockeys.append(dstLockey)
+                constraintKinds.append(kind)
+            constraint += len(constraints)
+            for rowAddress, length, nameId, operands in rows:
+                addresses.append(rowAddress)
+                lengths.append(length)
+                mnemonics.append(nameId)
+                functions.append(funcId)
+                operandFirst.append(operand)
+                for kind, value in operands:
+                    operandKinds.append(kind)
+                    operandValues.append(value)
+                operand += len(operands)
+                row += 1
+        self.addresses[firstRow:lastRow] = addresses
+        self.lengths[firstRow:lastRow] = lengths
+        self.mnemonics[firstRow:lastRow] = mnemonics
+        self.functions[firstRow:lastRow] = functions
+        self.operandKinds[firstOperand:lastOperand] = operandKinds
+        self.operandValues[firstOperand:lastOperand] = operandValues
+        self.operandFirst[firstRow:lastRow] = operandFirst
+        shift(self.operandFirst, firstRow + len(operandFirst), operand - lastOperand)
+        self.constraintLockeys[firstConstraint:lastConstraint] = constraintLockeys
+        self.constraintKinds[firstConstraint:lastConstraint] = constraintKinds
+        self.constraintFirst[first:last] = constraintFirst
+        shift(self.constraintFirst, first + len(constraintFirst), constraint - lastConstraint)
+        self.blockAddresses[first:last] = array('Q', [record[0] for record in records])
+        self.blockEnds[first:last] = array('Q', [record[1] for record in records])
+        self.blockFuncs[first:last] = array('I', [record[2] for record in records])
+        self.blockLabels[first:last] = array('B', [record[3] for record in records])
+        self.blockListed[first:last] = array('B', [record[4] for record in records])
+        self.blockLockeys[first:last] = array('Q', [record[5] for record in records])
+        self.blockErrors[first:last] = array('b', [record[6] for record in records])
+        self.blockFirst[first:last] = blockFirst
+        shift(self.blockFirst, first + len(blockFirst), row - lastRow)
+        maxEnd = self.blockMaxEnds[first - 1] if first > 0 else 0
+        maxEnds = array('Q')
+        for end in self.blockEnds[first:]:
+            maxEnd = max(maxEnd, end)
+            maxEnds.append(maxEnd)
+        self.blockMaxEnds[first:] = maxEnds
+
+    def replaceBlocks(self, removed, added, locDB):
+        """
+        Remove blocks and add new ones. The listed blocks which stay keep their address, an address whose listed
+        block was removed lists the first block with lines found there, the ones which stay first
+        :param removed: set of (address, func) of the blocks to remove
+        :param added: list of (block, func)
+        """
+        addedRecords = [self.blockRecord(block, func, locDB) for block, func in added]
+        bounds = [address for address, _ in removed] + [record[0] for record in addedRecords]
+        if not bounds:
+            return
+        first = bisect_left(self.blockAddresses, min(bounds))
+        last = bisect_right(self.blockAddresses, max(bounds))
+        records = [self.storedRecord(b) for b in range(first, last)
+                   if (self.blockAddresses[b], self.funcs[self.blockFuncs[b]]) not in removed]
+        listed = set(record[0] for record in records if record[4])
+        # stable, the blocks which stay come first at the same address
+        records = sorted(records + addedRecords, key=lambda record: record[0])
+        for i, record in enumerate(records):
+            if record[8] and record[0] not in listed:
+                records[i] = record[:4] + (1,) + record[5:]
+                listed.add(record[0])
+        self.splice(first, last, records)
+
+    def updateLabels(self, func):
+        """
+        Compute again the label flags of the blocks of func after its CFG changed
+        """
+        for b in self.blocksOfFunction(func):
+            if self.blockFirst[b] < self.blockFirst[b + 1]:
+                self.blockLabels[b] = needsLabel(self.block(b), func)
+
+    # ============================== queries ==============================
+
+    def __len__(self):
+        return len(self.addresses)
+
+    def blockCount(self):
+        return len(self.blockAddresses)
+
+    def nbytes(self):
+        """
+        :return: size in bytes of the columns
+        """
+        columns = (self.addresses, self.lengths, self.mnemonics, self.functions, self.operandFirst, self.operandKinds,
+                   self.operandValues, self.blockAddresses, self.blockEnds, self.blockMaxEnds, self.blockFirst,
+                   self.blockFuncs, self.blockLabels, self.blockListed, self.blockLockeys, self.blockErrors,
+                   self.constraintFirst, self.constraintLockeys, self.constraintKinds, self.funcBlocks)
+        return sum(column.itemsize * len(column) for column in columns)
+
+    def functionBlockCount(self, func):
+        """
+        :return: number of blocks of func, 0 if it is not disassembled
+        """
+        funcId = self.funcIds.get(id(func))
+        return 0 if funcId is None else self.funcBlocks[funcId]
+
+    def hasFunction(self, func):
+        return self.functionBlockCount(func) > 0
+
+    def blocksOfFunction(self, func):
+        """
+        :return: blocks of func by address
+        """
+        funcId = self.funcIds.get(id(func))
+        if funcId is None:
+            return []
+        return list(compress(range(len(self.blockFuncs)), map(funcId.__eq__, self.blockFuncs)))
+
+    def listedBlocks(self, start=0, end=MASK64):
+        """
+        :return: listed blocks starting in [start, end)
+        """
+        blocks = self.blocksInRange(start, end)
+        return list(compress(blocks, self.blockListed[blocks.start:blocks.stop]))
+
+    def findBlock(self, address, func):
+        """
+        :return: block of func starting at address or -1
+        """
+        funcId = self.funcIds.get(id(func))
+        b = bisect_left(self.blockAddresses, address)
+        while b < len(self.blockAddresses) and self.blockAddresses[b] == address:
+            if self.blockFuncs[b] == funcId:
+                return b
+            b += 1
+        return -1
+
+    def blocksInRange(self, start, end):
+        """
+        :return: range of the blocks starting in [start, end)
+        """
+        return range(bisect_left(self.blockAddresses, start), bisect_left(self.blockAddresses, end))
+
+    def blocksOverlapping(self, start, end):
+        """
+        :return: blocks whose bytes intersect [start, end)
+        """
+        blocks = []
+        b = bisect_right(self.blockMaxEnds, start)
+        while b < len(self.blockAddresses) and self.blockAddresses[b] < end:
+            if self.blockEnds[b] > start:
+                blocks.append(b)
+            b += 1
+        return blocks
+
+    def blockOfRow(self, r):
+        # empty blocks share their first row with the next block, the last one holds the row
+        return bisect_right(self.blockFirst, r) - 1
+
+    def blockFunction(self, b):
+        return self.funcs[self.blockFuncs[b]]
+
+    def blockLockey(self, b):
+        return LocKey(self.blockLockeys[b])
+
+    def rowsOfBlock(self, b):
+        return range(self.blockFirst[b], self.blockFirst[b + 1])
+
+    def rowsInRange(self, start, end, listed=False):
+        """
+        :param listed: only the rows of the listed blocks
+        :return: rows of the instructions starting in [start, end)
+        """
+        addresses = self.addresses
+        return [r for b in self.blocksOverlapping(start, end) if self.blockListed[b] or not listed
+                for r in self.rowsOfBlock(b) if start <= addresses[r] < end]
+
+    def select(self, func=None, mnemonic=None, start=None, end=None):
+        """
+        Rows matching all the given conditions, e.g. select(func, 'CALL') for the calls of a function
+        :param func: Function the instructions belong to
+        :param mnemonic: name of the instructions
+        :param start: the instructions start in [start, end)
+        :return: list of rows
+        """
+        rows = None
+        if start is not None or end is not None:
+            rows = self.rowsInRange(start or 0, end if end is not None else MASK64)
+        for column, value in ((self.functions, None if func is None else self.funcIds.get(id(func), -1)),
+                              (self.mnemonics, None if mnemonic is None else self.nameIds.get(mnemonic, -1))):
+            if value is None:
+                continue
+            if rows is None:
+                rows = list(compress(range(len(column)), map(value.__eq__, column)))
+            else:
+                rows = [r for r in rows if column[r] == value]
+        if rows is None:
+            rows = list(range(len(self.addresses)))
+        return rows
+
+    def mnemonic(self, r):
+        return self.names[self.mnemonics[r]]
+
+    def operands(self, r):
+        """
+        :return: list of (kind, value) of the arguments of row r
+        """
+        first, last = self.operandFirst[r], self.operandFirst[r + 1]
+        return list(zip(self.operandKinds[first:last], self.operandValues[first:last]))
+
+    def constraints(self, b):
+        """
+        :return: list of (loc key, kind) of the constraints of block b
+        """
+        first, last = self.constraintFirst[b], self.constraintFirst[b + 1]
+        return list(zip(self.constraintLockeys[first:last], self.constraintKinds[first:last]))
+
+    def successors(self, b):
+        """
+        :return: LocKeys the block b flows to
+        """
+        return [LocKey(lockey) for lockey, _ in self.constraints(b)]
+
+    def block(self, b):
+        """
+        :return: AsmBlock of block b, from the CFG of its function
+        """
+        return self.blockFunction(b).cfg.loc_key_to_block(self.blockLockey(b))
+
+    def instruction(self, r, disasmEngine):
+        """
+        Decode the instruction of row r again through the instruction cache, its arguments which were locations
+        (destinations and the pointers named by detect_func_name) are given back from the operand table
+        :param disasmEngine: disasmEngine of the binary
+        :return: instruction
+        """
+        address = self.addresses[r]
+        if disasmEngine.instr_cache is not None:
+            instr = disasmEngine.instr_cache.dis(disasmEngine.bin_stream, disasmEngine.attrib, address)
+        else:
+            instr = disasmEngine.arch.dis(disasmEngine.bin_stream, disasmEngine.attrib, address)
+        for i, (kind, value) in enumerate(self.operands(r)):
+            if kind == OP_LOC:
+                instr.args[i] = ExprLoc(LocKey(value), instr.args[i].size)
+        return instr
+
+    def functionCFG(self, func, disasmEngine):
+        """
+        Rebuild the AsmCFG of func from its blocks
+        :param disasmEngine: disasmEngine of the binary
+        :return: AsmCFG
+        """
+        cfg = AsmCFG(disasmEngine.loc_db)
+        for b in self.blocksOfFunction(func):
+            lockey = self.blockLockey(b)
+            if self.blockErrors[b] != NO_ERROR:
+                block = AsmBlockBad(lockey, errno=self.blockErrors[b])
+            else:
+                block = AsmBlock(lockey)
+                for r in self.rowsOfBlock(b):
+                    block.addline(self.instruction(r, disasmEngine))
+            for dstLockey, kind in self.constraints(b):
+                block.add_cst(LocKey(dstLockey), CONSTRAINTS[kind])
+            cfg.add_block(block)
+        return cfg
@@ -0,0 +1,356 @@
+import hashlib
+from collections import deque
+
+from grandalf.graphs import Vertex, Edge, Graph
+from grandalf.layouts import SugiyamaLayout
+from grandalf.routing import route_with_lines
+from grandalf.utils.geometry import intersectR
+
+from Analysis import BinaryAnalysis
+
+# graphs with more blocks are laid out by fastLayout instead of SugiyamaLayout
+FAST_LAYOUT_BLOCKS = 400
+# a cached layout is completed by relayout when at most this part of the blocks, and this many blocks, are new
+INCREMENTAL_RATIO = 0.5
+INCREMENTAL_BLOCKS = 500
+# size of the cells of the scene in which relayout looks for the blocks a new block may overlap
+BUCKET_SIZE = 256
+# spaces between the blocks, the ones of SugiyamaLayout
+X_SPACE = 20
+Y_SPACE = 20
+
+
+class NodeView:
+    """
+    Size and center of a block, in the attributes used by grandalf
+    """
+
+    def __init__(self, w, h):
+        self.w = w
+        self.h = h
+        self.xy = None
+
+
+class EdgeView:
+    """
+    Points of an edge, set by grandalf
+    """
+
+    def __init__(self):
+        self.points = None
+
+    def setpath(self, points):
+        self.points = points
+
+
+class GraphLayout:
+    """
+    Coordinates of the blocks of a graph, the blocks are identified by the hash of their content
+    """
+
+    def __init__(self, graphHash, sizes, positions, paths):
+        self.graphHash = graphHash
+        # hash -> (w, h)
+        self.sizes = sizes
+        # hash -> (x, y) of the center of the block
+        self.positions = positions
+        # (source hash, destination hash) -> points of the edge
+        self.paths = paths
+
+
+def graphHash(sizes, edges):
+    """
+    :return: digest of the blocks, their sizes and the edges of a graph
+    """
+    sha = hashlib.sha1()
+    for h in sorted(sizes):
+        sha.update(h)
+        sha.update(b'%d,%d' % tuple(int(round(v)) for v in sizes[h]))
+    for src, dst in sorted(edges):
+        sha.update(src + dst)
+    return sha.digest()
+
+
+def layoutGraph(key, sizes, edges):
+    """
+    Lay out a graph. The layout is kept in BinaryAnalysis.layoutCache[key] and given back while the graph does not
+    change; when only some blocks changed, as after a patch, the others keep their place and only the new ones are
+    placed by relayout.
+    :param key: key of the graph in the cache, None to not cache its layout
+    :param sizes: dict hash of the content of a block -> (width, height)
+    :param edges: list of (source hash, destination hash)
+    :return: GraphLayout
+    """
+    digest = graphHash(sizes, edges)
+    cached = BinaryAnalysis.layoutCache.get(key) if key is not None else None
+    if cached is not None and cached.graphHash == digest:
+        return cached
+    if cached is not None and incremental(cached, sizes):
+        layout = relayout(cached, sizes, edges)
+    elif len(sizes) > FAST_LAYOUT_BLOCKS:
+        layout = fastLayout(sizes, edges)
+    else:
+        layout = sugiyamaLayout(sizes, edges)
+    layout.graphHash = digest
+    if key is not None:
+        BinaryAnalysis.layoutCache[key] = layout
+    return layout
+
+
+def incremental(cached, sizes):
+    """
+    :return: whether the layout of the graph of sizes is completed from cached by relayout, only few blocks are new
+    """
+    new = sum(1 for h, size in sizes.items() if h not in cached.positions or cached.sizes.get(h) != size)
+    return new <= min(len(sizes) * INCREMENTAL_RATIO, INCREMENTAL_BLOCKS)
+
+
+def routeLine(src, dst):
+    """
+    :return: points of a straight edge between the borders of the NodeView src and dst, a loop on the right side of
+    src when it is dst
+    """
+    x, y = src.xy
+    if src is dst:
+        right = x + src.w / 2
+        return [(right, y - src.h / 4), (right + X_SPACE, y - src.h / 4), (right + X_SPACE, y + src.h / 4),
+                (right, y + src.h / 4)]
+    try:
+        return [intersectR(src, topt=dst.xy), intersectR(dst, topt=src.xy)]
+    except ValueError:
+        # the blocks overlap
+        return [src.xy, dst.xy]
+
+
+def sugiyamaLayout(sizes, edges):
+    """
+    Lay out each connected component with grandalf, side by side
+    """
+    vertexs = {}
+    for h, (w, hh) in sizes.items():
+        vertexs[h] = Vertex(h)
+        vertexs[h].view = NodeView(w, hh)
+    graphEdges = []
+    for src, dst in edges:
+        if src == dst:
+            continue
+        edge = Edge(vertexs[src], vertexs[dst])
+        edge.view = EdgeView()
+        graphEdges.append(edge)
+    graph = Graph(vertexs.values(), graphEdges)
+    positions = {}
+    paths = {}
+    left = 0
+    for component in graph.C:
+        sugLayout = SugiyamaLayout(component)
+        sugLayout.route_edge = route_with_lines
+        sugLayout.init_all()
+        sugLayout.draw()
+        minX = min(v.view.xy[0] - v.view.w / 2 for v in component.sV)
+        maxX = max(v.view.xy[0] + v.view.w / 2 for v in component.sV)
+        dx = left - minX
+        for v in component.sV:
+            positions[v.data] = (v.view.xy[0] + dx, v.view.xy[1])
+        for e in component.sE:
+            paths[(e.v[0].data, e.v[1].data)] = [(x + dx, y) for x, y in e.view.points]
+        left += maxX - minX + X_SPACE
+    # the loops are routed by routeLines
+    return GraphLayout(None, dict(sizes), positions, routeLines(sizes, positions, edges, paths))
+
+
+def fastLayout(sizes, edges):
+    """
+    Layered layout in linear time for the big graphs: the back edges of a depth first search are ignored, the blocks
+    are ranked by longest path and ordered by one barycenter sweep down then up, the edges are straight lines
+    """
+    successors = dict((h, []) for h in sizes)
+    predecessors = dict((h, []) for h in sizes)
+    for src, dst in edges:
+        successors[src].append(dst)
+        predecessors[dst].append(src)
+    # depth first search from the roots, then from the blocks only reachable through a cycle
+    order = {}
+    onStack = set()
+    forward = dict((h, []) for h in sizes)
+    roots = [h for h in sizes if not predecessors[h]] + list(sizes)
+    for root in roots:
+        if root in order:
+            continue
+        order[root] = len(order)
+        onStack.add(root)
+        stack = [(root, iter(successors[root]))]
+        while stack:
+            node, children = stack[-1]
+            child = next(children, None)
+            if child is None:
+                stack.pop()
+                onStack.discard(node)
+            elif child in onStack:
+                continue
+            else:
+                forward[node].append(child)
+                if child not in order:
+                    order[child] = len(order)
+                    onStack.add(child)
+                    stack.append((child, iter(successors[child])))
+    # longest path ranking of the acyclic forward edges
+    inDegree = dict((h, 0) for h in sizes)
+    for h in sizes:
+        for child in forward[h]:
+            inDegree[child] += 1
+    rank = dict((h, 0) for h in sizes)
+    ready = [h for h in sizes if inDegree[h] == 0]
+    while ready:
+        node = ready.pop()
+        for child in forward[node]:
+            rank[child] = max(rank[child], rank[node] + 1)
+            inDegree[child] -= 1
+            if inDegree[child] == 0:
+                ready.append(child)
+    layers = [[] for _ in range(max(rank.values()) + 1 if rank else 0)]
+    for h in sorted(sizes, key=order.get):
+        layers[rank[h]].append(h)
+    index = {}
+    for layer in layers:
+        for i, h in enumerate(layer):
+            index[h] = i
+
+    def barycenter(h, neighbors):
+        placed = [index[n] for n in neighbors[h] if rank[n] != rank[h]]
+        return sum(placed) / len(placed) if placed else index[h]
+
+    for neighbors, sweep in ((predecessors, layers[1:]), (successors, layers[-2::-1])):
+        for layer in sweep:
+            layer.sort(key=lambda h: barycenter(h, neighbors))
+            for i, h in enumerate(layer):
+                index[h] = i
+    positions = {}
+    y = 0
+    for layer in layers:
+        height = max(sizes[h][1] for h in layer)
+        width = sum(sizes[h][0] for h in layer) + X_SPACE * (len(layer) - 1)
+        x = -width / 2
+        for h in layer:
+            positions[h] = (x + sizes[h][0] / 2, y + height / 2)
+            x += sizes[h][0] + X_SPACE
+        y += height + Y_SPACE
+    return GraphLayout(None, dict(sizes), positions, routeLines(sizes, positions, edges))
+
+
+def routeLines(sizes, positions, edges, paths=None):
+    """
+    :param paths: paths of a previous layout, the edges between blocks which did not move keep theirs
+    :return: dict (source hash, destination hash) -> points of straight edges
+    """
+    views = {}
+    for h, (w, hh) in sizes.items():
+        views[h] = NodeView(w, hh)
+        views[h].xy = positions[h]
+    routes = {}
+    for src, dst in edges:
+        if paths is not None and (src, dst) in paths:
+            routes[(src, dst)] = paths[(src, dst)]
+        else:
+            routes[(src, dst)] = routeLine(views[src], views[dst])
+    return routes
+
+
+class Grid:
+    """
+    Placed blocks indexed by the cells of BUCKET_SIZE pixels their rectangle covers, spaces between blocks included
+    """
+
+    def __init__(self):
+        self.cells = {}
+
+    @staticmethod
+    def span(x, y, w, h):
+        columns = range(int((x - (w + X_SPACE) / 2) // BUCKET_SIZE), int((x + (w + X_SPACE) / 2) // BUCKET_SIZE) + 1)
+        rows = range(int((y - (h + Y_SPACE) / 2) // BUCKET_SIZE), int((y + (h + Y_SPACE) / 2) // BUCKET_SIZE) + 1)
+        return [(column, row) for column in columns for row in rows]
+
+    def add(self, block, x, y, w, h):
+        for cell in self.span(x, y, w, h):
+            self.cells.setdefault(cell, []).append(block)
+
+    def near(self, x, y, w, h):
+        """
+        :return: placed blocks which may overlap a block of size (w, h) centered at (x, y)
+        """
+        found = set()
+        for cell in self.span(x, y, w, h):
+            found.update(self.cells.get(cell, ()))
+        return found
+
+
+def moveRight(sizes, positions, grid, h, x, y):
+    """
+    :return: first x from which the block h centered at (x, y) overlaps none of the placed blocks of grid, the blocks
+    of a layered layout being side by side the search stays in the layer of y
+    """
+    w, hh = sizes[h]
+    while True:
+        others = [n for n in grid.near(x, y, w, hh)
+                  if abs(x - positions[n][0]) * 2 < w + sizes[n][0] + X_SPACE
+                  and abs(y - positions[n][1]) * 2 < hh + sizes[n][1] + Y_SPACE]
+        if not others:
+            return x
+        x = max(positions[n][0] + sizes[n][0] / 2 for n in others) + X_SPACE + w / 2
+
+
+def relayout(cached, sizes, edges):
+    """
+    Complete the layout of a graph whose blocks partly changed: the blocks which did not change keep their place, the
+    new ones are put under their placed predecessors, or above their placed successors, then moved right until they
+    overlap no block. The placed blocks are looked up in a Grid, so that each new block only meets its neighbours
+    """
+    kept = set(h for h in sizes if h in cached.positions and cached.sizes.get(h) == sizes[h])
+    positions = dict((h, cached.positions[h]) for h in kept)
+    predecessors = dict((h, []) for h in sizes)
+    successors = dict((h, []) for h in sizes)
+    for src, dst in edges:
+        successors[src].append(dst)
+        predecessors[dst].append(src)
+    grid = Grid()
+    bottom = None
+    for h, (x, y) in positions.items():
+        grid.add(h, x, y, *sizes[h])
+        bottom = y + sizes[h][1] / 2 if bottom is None else max(bottom, y + sizes[h][1] / 2)
+    todo = [h for h in sizes if h not in positions]
+    # the blocks next to placed blocks first, in the order of the graph
+    queued = set(h for h in todo if any(n in positions for n in predecessors[h] + successors[h]))
+    ready = deque(h for h in todo if h in queued)
+    nextTodo = 0
+    while len(positions) < len(sizes):
+        if ready:
+            h = ready.popleft()
+        else:
+            while todo[nextTodo] in positions:
+                nextTodo += 1
+            h = todo[nextTodo]
+        if h in positions:
+            continue
+        w, hh = sizes[h]
+        above = [n for n in predecessors[h] if n in positions]
+        below = [n for n in successors[h] if n in positions]
+        if above:
+            x = sum(positions[n][0] for n in above) / len(above)
+            y = max(positions[n][1] + sizes[n][1] / 2 for n in above) + Y_SPACE + hh / 2
+        elif below:
+            x = sum(positions[n][0] for n in below) / len(below)
+            y = min(positions[n][1] - sizes[n][1] / 2 for n in below) - Y_SPACE - hh / 2
+        elif bottom is not None:
+            x = 0
+            y = bottom + Y_SPACE + hh / 2
+        else:
+            x, y = 0, 0
+        x = moveRight(sizes, positions, grid, h, x, y)
+        positions[h] = (x, y)
+        grid.add(h, x, y, w, hh)
+        bottom = y + hh / 2 if bottom is None else max(bottom, y + hh / 2)
+        for n in predecessors[h] + successors[h]:
+            if n not in positions and n not in queued:
+                queued.add(n)
+                ready.append(n)
+    paths = dict((edge, points) for edge, points in cached.paths.items() if edge[0] in kept and edge[1] in kept)
+    return GraphLayout(None, dict(sizes), positions, routeLines(sizes, positions, edges, paths))
@@ -0,0 +1,366 @@
+from array import array
+from bisect import bisect_right, bisect_left
+from collections import OrderedDict
+
+from PyQt5.QtCore import QAbstractListModel, QModelIndex, Qt
+
+from Analysis import BinaryAnalysis
+from CommonView import LocLine, AsmLineWithOpcode, DataLine
+from Utils import sizeByType
+
+SEG_BLOCK = 0
+SEG_BYTES = 1
+SEG_DATA = 2
+
+CACHE_SIZE = 4096
+PREFETCH = 32
+
+
+class LinearModel(QAbstractListModel):
+    """
+    List model of the linear disassembly.
+    The binary is described by segments: one per basic block, one per typed data and one per run of raw bytes.
+    Rows are only turned into items when the view asks for them and the last CACHE_SIZE items are kept.
+    """
+
+    def __init__(self, parent=None):
+        super(LinearModel, self).__init__(parent)
+        self.segRow = array('Q')
+        self.segAddr = array('Q')
+        self.segKind = array('B')
+        self.segLoc = array('B')
+        self.segSize = array('Q')
+        self.segRef = []
+        self.totalRows = 0
+        self.cache = OrderedDict()
+        self.cacheRows = {}
+        # changes whenever items enter or leave the cache, see CommonListView.tokenRows
+        self.cacheVersion = 0
+        self.buildIndex()
+
+    # ============================== index ==============================
+
+    def appendSegment(self, kind, address, rows, size=0, ref=None, hasLoc=0):
+        self.segRow.append(self.totalRows)
+        self.segAddr.append(address)
+        self.segKind.append(kind)
+        self.segLoc.append(hasLoc)
+        self.segSize.append(size)
+        self.segRef.append(ref)
+        self.totalRows += rows
+
+    def buildIndex(self):
+        self.typedAddresses = BinaryAnalysis.typedAddresses()
+        code = BinaryAnalysis.code
+        for segment in self.buildSegments(code.listedBlocks(), BinaryAnalysis.data):
+            self.appendSegment(*segment)
+
+    def buildSegments(self, blocks, data):
+        """
+        Merge blocks and data ranges, both sorted by address, in segments
+        :param blocks: listed blocks of BinaryAnalysis.code
+        :return: list of (kind, address, rows, size, ref, hasLoc), ref is the function of a block
+        """
+        code = BinaryAnalysis.code
+        segments = []
+        codePoint = 0
+        dataPoint = 0
+        while codePoint < len(blocks) or dataPoint < len(data):
+            if codePoint < len(blocks) and (
+                    dataPoint == len(data) or code.blockAddresses[blocks[codePoint]] < data[dataPoint][0]):
+                b = blocks[codePoint]
+                hasLoc = code.blockLabels[b]
+                segments.append((SEG_BLOCK, code.blockAddresses[b], hasLoc + len(code.rowsOfBlock(b)), 0,
+                                 code.blockFunction(b), hasLoc))
+                codePoint += 1
+            else:
+                start, end = data[dataPoint]
+                segments.extend(segment + (0,) for segment in self.dataSegments(start, end))
+                dataPoint += 1
+        return segments
+
+    def dataSegments(self, start, end):
+        """
+        Split the data range [start, end] in segments, typed data take their size and hide what they cover
+        :return: list of (kind, address, rows, size, ref)
+        """
+        segments = []
+        i = start
+        typed = self.typedAddresses
+        pos = bisect_left(typed, i)
+        while i <= end:
+            while pos < len(typed) and typed[pos] < i:
+                pos += 1
+            if pos < len(typed) and typed[pos] <= end:
+                address = typed[pos]
+                if address > i:
+                    segments.append((SEG_BYTES, i, address - i, address - i, None))
+                typeData = BinaryAnalysis.getDataType(address)
+                if typeData == 'string':
+                    size = BinaryAnalysis.strings.size(address)
+                else:
+                    size = sizeByType[typeData]
+                segments.append((SEG_DATA, address, 1, size, typeData))
+                i = address + size
+                pos += 1
+            else:
+                segments.append((SEG_BYTES, i, end + 1 - i, end + 1 - i, None))
+                break
+        return segments
+
+    def segmentAtRow(self, row):
+        return bisect_right(self.segRow, row) - 1
+
+    def segmentRows(self, seg):
+        if seg + 1 < len(self.segRow):
+            return self.segRow[seg + 1] - self.segRow[seg]
+        return self.totalRows - self.segRow[seg]
+
+    def rowOfAddress(self, address):
+        """
+        :return: row of the instruction or data at address, -1 if there is none
+        """
+        code = BinaryAnalysis.code
+        for r in code.rowsInRange(address, address + 1, listed=True):
+            b = code.blockOfRow(r)
+            seg = self.segmentOfBlock(code.blockAddresses[b], code.blockFunction(b))
+            if seg >= 0:
+                return self.segRow[seg] + self.segLoc[seg] + r - code.blockFirst[b]
+        seg = bisect_right(self.segAddr, address) - 1
+        if seg < 0:
+            return -1
+        kind = self.segKind[seg]
+        if kind == SEG_BYTES:
+            if address < self.segAddr[seg] + self.segSize[seg]:
+                return self.segRow[seg] + address - self.segAddr[seg]
+        elif kind == SEG_DATA and address == self.segAddr[seg]:
+            return self.segRow[seg]
+        return -1
+
+    def spliceSegments(self, first, last, segments):
+        """
+        Replace segments [first, last) by new segments in the index and move the rows of the following segments
+        :return: number of rows added, negative when rows were removed
+        """
+        firstRow = self.segRow[first] if first < len(self.segRow) else self.totalRows
+        lastRow = self.segRow[last] if last < len(self.segRow) else self.totalRows
+        row = firstRow
+        newRow = array('Q')
+        for kind, address, rows, size, ref, hasLoc in segments:
+            newRow.append(row)
+            row += rows
+        delta = (row - firstRow) - (lastRow - firstRow)
+        self.segRow[first:last] = newRow
+        self.segAddr[first:last] = array('Q', [segment[1] for segment in segments])
+        self.segKind[first:last] = array('B', [segment[0] for segment in segments])
+        self.segLoc[first:last] = array('B', [segment[5] for segment in segments])
+        self.segSize[first:last] = array('Q', [segment[3] for segment in segments])
+        self.segRef[first:last] = [segment[4] for segment in segments]
+        for seg in range(first + len(segments), len(self.segRow)):
+            self.segRow[seg] += delta
+        self.totalRows += delta
+        self.clearCache()
+        return delta
+
+    def replaceSegments(self, first, last, segments):
+        """
+        Replace segments [first, last) by new segments and notify the views: the old rows are removed, then the new
+        ones are inserted, the model always matching the rows the views were told about
+        """
+        firstRow = self.segRow[first] if first < len(self.segRow) else self.totalRows
+        lastRow = self.segRow[last] if last < len(self.segRow) else self.totalRows
+        if lastRow > firstRow:
+            self.beginRemoveRows(QModelIndex(), firstRow, lastRow - 1)
+            self.spliceSegments(first, last, [])
+            self.endRemoveRows()
+        else:
+            self.spliceSegments(first, last, [])
+        rows = sum(segment[2] for segment in segments)
+        if rows > 0:
+            self.beginInsertRows(QModelIndex(), firstRow, firstRow + rows - 1)
+            self.spliceSegments(first, first, segments)
+            self.endInsertRows()
+        else:
+            self.spliceSegments(first, first, segments)
+
+    def segmentOfBlock(self, address, func):
+        """
+        :return: segment of the block of func starting at address or -1
+        """
+        seg = bisect_left(self.segAddr, address)
+        while seg < len(self.segAddr) and self.segAddr[seg] == address:
+            if self.segKind[seg] == SEG_BLOCK and self.segRef[seg] is func:
+                return seg
+            seg += 1
+        return -1
+
+    def refreshBlock(self, b):
+        """
+        Rebuild the rows of the listed block b of BinaryAnalysis.code whose lines or label were changed
+        """
+        code = BinaryAnalysis.code
+        func = code.blockFunction(b)
+        seg = self.segmentOfBlock(code.blockAddresses[b], func)
+        if seg < 0:
+            return
+        hasLoc = code.blockLabels[b]
+        self.replaceSegments(seg, seg + 1, [(SEG_BLOCK, self.segAddr[seg], hasLoc + len(code.rowsOfBlock(b)), 0,
+                                             func, hasLoc)])
+
+    def refreshData(self, address):
+        """
+        Rebuild the rows of the data range containing address after BinaryAnalysis.dataType changed
+        """
+        for start, end in BinaryAnalysis.data:
+            if start <= address <= end:
+                break
+        else:
+            return
+        self.typedAddresses = BinaryAnalysis.typedAddresses()
+        first = bisect_left(self.segAddr, start)
+        last = first
+        while last < len(self.segAddr) and self.segKind[last] != SEG_BLOCK and self.segAddr[last] <= end:
+            last += 1
+        self.replaceSegments(first, last, [segment + (0,) for segment in self.dataSegments(start, end)])
+
+    def refreshRange(self, start, end):
+        """
+        Rebuild the rows of the addresses [start, end) after BinaryAnalysis.patch changed their blocks and data
+        """
+        self.typedAddresses = BinaryAnalysis.typedAddresses()
+        first = bisect_left(self.segAddr, start)
+        last = bisect_left(self.segAddr, end)
+        code = BinaryAnalysis.code
+        blocks = code.listedBlocks(start, end)
+        data = [entry for entry in BinaryAnalysis.data if start <= entry[0] < end]
+        self.replaceSegments(first, last, self.buildSegments(blocks, data))
+        # the label line of a block outside of the range depends on its predecessors, which may have changed
+        for func in set(code.blockFunction(b) for b in blocks):
+            for b in code.blocksOfFunction(func):
+                address = code.blockAddresses[b]
+                if not code.blockListed[b] or start <= address < end:
+                    continue
+                seg = self.segmentOfBlock(address, func)
+                if seg >= 0 and self.segLoc[seg] != code.blockLabels[b]:
+                    self.refreshBlock(b)
+
+    # ============================== items ==============================
+
+    def createItem(self, row):
+        seg = self.segmentAtRow(row)
+        offset = row - self.segRow[seg]
+        kind = self.segKind[seg]
+        if kind == SEG_BLOCK:
+            # the instruction is rebuilt from BinaryAnalysis.code, the CFG of the function is not needed
+            func = self.segRef[seg]
+            code = BinaryAnalysis.code
+            b = code.findBlock(self.segAddr[seg], func)
+            lockey = code.blockLockey(b)
+            if self.segLoc[seg]:
+                if offset == 0:
+                    return LocLine(lockey, func)
+                offset -= 1
+            return AsmLineWithOpcode(code.instruction(code.blockFirst[b] + offset, BinaryAnalysis.disasmEngine),
+                                     lockey, func)
+        if kind == SEG_BYTES:
+            address = self.segAddr[seg] + offset
+            return DataLine(address, BinaryAnalysis.container.bin_stream.getbytes(address, 1), 'byte')
+        address = self.segAddr[seg]
+        typeData = self.segRef[seg]
+        if typeData == 'string':
+            item = DataLine(address, BinaryAnalysis.strings[address].replace('\n', ''), typeData)
+        else:
+            item = DataLine(address, BinaryAnalysis.container.bin_stream.getbytes(address, self.segSize[seg]),
+                            typeData)
+        return item
+
+    def cacheItem(self, row, item):
+        item.owner = self
+        self.cache[row] = item
+        self.cacheRows[id(item)] = row
+        self.cacheVersion += 1
+        while len(self.cache) > CACHE_SIZE:
+            _, old = self.cache.popitem(last=False)
+            old.owner = None
+            del self.cacheRows[id(old)]
+
+    def item(self, row, column=0):
+        if row < 0 or row >= self.totalRows:
+            return None
+        item = self.cache.get(row)
+        if item is not None:
+            self.cache.move_to_end(row)
+            return item
+        item = self.createItem(row)
+        self.cacheItem(row, item)
+        for nextRow in range(row + 1, min(row + PREFETCH, self.totalRows)):
+            if nextRow not in self.cache:
+                self.cacheItem(nextRow, self.createItem(nextRow))
+        return item
+
+    def cachedItems(self):
+        return list(self.cache.values())
+
+    def clearCache(self):
+        for item in self.cache.values():
+            item.owner = None
+        self.cache.clear()
+        self.cacheRows.clear()
+        self.cacheVersion += 1
+
+    def rowOfItem(self, item):
+        row = self.cacheRows.get(id(item))
+        if row is not None:
+            return row
+        row = self.rowOfAddress(item.address)
+        if isinstance(item, LocLine) and row > 0:
+            row -= 1
+        return row
+
+    def indexFromItem(self, item):
+        row = self.rowOfItem(item)
+        if row < 0:
+            return QModelIndex()
+        return self.index(row, 0)
+
+    def itemChanged(self, item):
+        row = self.cacheRows.get(id(item))
+        if row is not None:
+            index = self.index(row, 0)
+            self.dataChanged.emit(index, index, [Qt.DisplayRole])
+
+    # ============================== Qt ==============================
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return self.totalRows
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or role != Qt.DisplayRole:
+            return None
+        return self.item(index.row()).text()
+
+
+class LinearAddressMap:
+    """
+    Read only mapping address -> item of a LinearModel, used where the views expect addressMap
+    """
+
+    def __init__(self, model):
+        self.model = model
+
+    def __contains__(self, address):
+        return self.model.rowOfAddress(address) != -1
+
+    def __getitem__(self, address):
+        row = self.model.rowOfAddress(address)
+        if row == -1:
+            raise KeyError(address)
+        return self.model.item(row)
+
+    def get(self, address, default=None):
+        row = self.model.rowOfAddress(address)
+        if row == -1:
+            return default
+        return self.model.item(row)
@@ -1,22 +1,26 @@
 import os
 import sys
 
-from PyQt5.QtCore import Qt
+from PyQt5.QtCore import Qt, QTimer
 from PyQt5.QtGui import QIcon
 from PyQt5.QtWidgets import QMainWindow, QDesktopWidget, QWidget, QApplication, QStyleFactory, QVBoxLayout, QSplitter, \
     QTabWidget, QTextEdit, QAction, QFileDialog, QMessageBox, QSizePolicy
 
+import Utils
 from Analysis import BinaryAnalysis
 from AsmCFG import AsmCFGView
 from AsmLinear import AsmLinear
 from HexView import HexView
 from InfoView import StringView, ImportView, ExportView
 from ListFunctions import ListFuncs
+from Scheduler import PRIORITY_ACTION, getScheduler, whenAnalysisFree
 
 STYLE = 'windowsvista'
 ICON = 'imgs/nkn.png'
 APPNAME = 'NKN'
 FUNCTIONICON = 'imgs/function.png'
+# milliseconds between two loads of the functions disassembled in the background
+BACKGROUND_INTERVAL = 50
 
 
 class Window(QMainWindow):
@@ -32,11 +36,16 @@ class Window(QMainWindow):
         self.statusBar = self.statusBar()
         self.mainMenu = self.menuBar()
         QApplication.setStyle(QStyleFactory.create(STYLE))
-        self.iraChache = {}
         self.mainTab = None
         self.stringView = None
         self.asmLinear = None
         self.hexView = None
+        self.backgroundTimer = QTimer(self)
+        self.backgroundTimer.timeout.connect(self.loadBackground)
+        self.scheduler = getScheduler()
+        self.scheduler.progress.connect(self.showProgress)
+        self.scheduler.done.connect(self.taskDone)
+        self.openTask = None
         self.initMenu()
         self.initToolBar()
         self.showMaximized()
@@ -59,7 +68,8 @@ class Window(QMainWindow):
                 ('String', 'Ctrl+L', 'String View', self.openStringView),
             ],
             'Tool': [
-                ('Basic Deobfuscate', 'Ctrl+R', "Basic Deobfuscate", self.recoverAlgorithm)
+                ('Basic Deobfuscate', 'Ctrl+R', "Basic Deobfuscate", self.recoverAlgorithm),
+                ('Cancel Tasks', 'Esc', "Cancel the running analysis", self.cancelTasks),
             ]
         }
         for name in names:
@@ -120,11 +130,13 @@ class Window(QMainWindow):
         Quit App
         :return:
         """
+        self.scheduler.shutdown(wait=False)
+        BinaryAnalysis.stopBackground()
         sys.exit()
 
     def openFile(self):
         """"
-        Open File, Load Function to ListFunction and Info
+        Open File and analyse it in a task, its views are shown by showAnalysis
         :return:
         """
         try:
@@ -138,66 +150,118 @@ class Window(QMainWindow):
         if file:
             dir = os.path.dirname(file)
             open('cache', 'w').write(dir)
-            self.centralWidget = QWidget(self)
-            self.setCentralWidget(self.centralWidget)
-            QVBoxLayout(self.centralWidget)
-            allLayout = self.centralWidget.layout()
-            BinaryAnalysis.init(file)
-
-            self.outputLog = QTextEdit()
-
-            self.binInfo = QTextEdit()
-            self.binInfo.setReadOnly(True)
-            self.binInfo.setText(BinaryAnalysis.binaryInfo.info())
-
-            self.listFunctions = ListFuncs(BinaryAnalysis.funcs)
-            self.listFunctions.gotoFunc.connect(self.gotoAddress)
-
-            leftTopBottomSplitter = QSplitter(Qt.Vertical)
-            leftTopBottomSplitter.setSizePolicy(QSizePolicy.Minimum, QSizePolicy.Minimum)
-            leftTopBottomSplitter.addWidget(self.binInfo)
-            leftTopBottomSplitter.addWidget(self.listFunctions)
-            leftTopBottomSplitter.setStretchFactor(0, 1)
-            leftTopBottomSplitter.setStretchFactor(1, 9)
-
-            leftRightSplitter = QSplitter()
-
-            self.mainTab = QTabWidget()
-            self.mainTab.setTabsClosable(True)
-            self.mainTab.tabCloseRequested.connect(self.closeTab)
-            self.mainTab.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Expanding)
+            self.closeAnalysis()
+            self.openTask = self.scheduler.submit(BinaryAnalysis.init, file, lazy=True, priority=PRIORITY_ACTION,
+                                                  name='Open %s' % os.path.basename(file))
+            self.openTask.finished.connect(self.showAnalysis)
+            self.openTask.failed.connect(self.openFailed)
+            self.openTask.cancelled.connect(self.openFailed)
+
+    def closeAnalysis(self):
+        """
+        Remove the views of the opened file and stop its tasks, before another file is analysed
+        :return:
+        """
+        self.scheduler.cancelAll()
+        self.backgroundTimer.stop()
+        self.setCentralWidget(QWidget(self))
+        self.mainTab = None
+        self.stringView = None
+        self.asmLinear = None
+        self.hexView = None
 
-            self.asmLinear = AsmLinear()
-            self.mainTab.addTab(self.asmLinear, "Disassembly")
-            self.asmLinear.focusAddress(BinaryAnalysis.binaryInfo.entryPoint)
-            self.bindAsmLinear()
+    def openFailed(self, error=None):
+        if self.sender() is not self.openTask:
+            return
+        self.openTask = None
+        BinaryAnalysis.clear()
+        if error is not None:
+            QMessageBox.warning(self, 'Open File', error)
 
-            self.hexView = HexView(BinaryAnalysis.rawData)
-            self.mainTab.addTab(self.hexView, "Hex View")
-
-            self.stringView = StringView(BinaryAnalysis.binaryInfo.strings)
-            self.stringView.clicked.connect(self.gotoAddress)
-            self.mainTab.addTab(self.stringView, "String List")
-
-            self.importView = ImportView(BinaryAnalysis.binaryInfo.imports)
-            self.importView.clicked.connect(self.gotoLibFunc)
-            self.mainTab.addTab(self.importView, "Imports")
-
-            self.exportView = ExportView(BinaryAnalysis.binaryInfo.exports)
-            self.exportView.clicked.connect(self.gotoLibFunc)
-            self.mainTab.addTab(self.exportView, "Exports")
-
-            leftRightSplitter.addWidget(leftTopBottomSplitter)
-            leftRightSplitter.addWidget(self.mainTab)
-            leftRightSplitter.setStretchFactor(0, 2)
-            leftRightSplitter.setStretchFactor(1, 8)
-            topBottomSplitter = QSplitter(Qt.Vertical)
-            topBottomSplitter.addWidget(leftRightSplitter)
-            topBottomSplitter.addWidget(self.outputLog)
-            topBottomSplitter.setStretchFactor(0, 8)
-            topBottomSplitter.setStretchFactor(1, 2)
-            allLayout.addWidget(topBottomSplitter)
-            self.asmLinear.setFocus()
+    def showAnalysis(self):
+        """
+        Show the views of the file analysed by the open task
+        :return:
+        """
+        if self.sender() is not self.openTask:
+            return
+        self.openTask = None
+        self.centralWidget = QWidget(self)
+        self.setCentralWidget(self.centralWidget)
+        QVBoxLayout(self.centralWidget)
+        allLayout = self.centralWidget.layout()
+
+        self.outputLog = QTextEdit()
+
+        self.binInfo = QTextEdit()
+        self.binInfo.setReadOnly(True)
+        self.binInfo.setText(BinaryAnalysis.binaryInfo.info())
+
+        self.listFunctions = ListFuncs(BinaryAnalysis.funcs)
+        self.listFunctions.gotoFunc.connect(self.gotoAddress)
+
+        leftTopBottomSplitter = QSplitter(Qt.Vertical)
+        leftTopBottomSplitter.setSizePolicy(QSizePolicy.Minimum, QSizePolicy.Minimum)
+        leftTopBottomSplitter.addWidget(self.binInfo)
+        leftTopBottomSplitter.addWidget(self.listFunctions)
+        leftTopBottomSplitter.setStretchFactor(0, 1)
+        leftTopBottomSplitter.setStretchFactor(1, 9)
+
+        leftRightSplitter = QSplitter()
+
+        self.mainTab = QTabWidget()
+        self.mainTab.setTabsClosable(True)
+        self.mainTab.tabCloseRequested.connect(self.closeTab)
+        self.mainTab.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Expanding)
+
+        self.asmLinear = AsmLinear()
+        self.mainTab.addTab(self.asmLinear, "Disassembly")
+        self.asmLinear.focusAddress(BinaryAnalysis.binaryInfo.entryPoint)
+        self.bindAsmLinear()
+        BinaryAnalysis.startBackground()
+        self.backgroundTimer.start(BACKGROUND_INTERVAL)
+
+        self.hexView = HexView(BinaryAnalysis.rawData)
+        self.mainTab.addTab(self.hexView, "Hex View")
+
+        self.stringView = StringView(BinaryAnalysis.allStrings)
+        self.stringView.clicked.connect(self.gotoAddress)
+        self.mainTab.addTab(self.stringView, "String List")
+
+        self.importView = ImportView(BinaryAnalysis.binaryInfo.imports)
+        self.importView.clicked.connect(self.gotoLibFunc)
+        self.mainTab.addTab(self.importView, "Imports")
+
+        self.exportView = ExportView(BinaryAnalysis.binaryInfo.exports)
+        self.exportView.clicked.connect(self.gotoLibFunc)
+        self.mainTab.addTab(self.exportView, "Exports")
+
+        leftRightSplitter.addWidget(leftTopBottomSplitter)
+        leftRightSplitter.addWidget(self.mainTab)
+        leftRightSplitter.setStretchFactor(0, 2)
+        leftRightSplitter.setStretchFactor(1, 8)
+        topBottomSplitter = QSplitter(Qt.Vertical)
+        topBottomSplitter.addWidget(leftRightSplitter)
+        topBottomSplitter.addWidget(self.outputLog)
+        topBottomSplitter.setStretchFactor(0, 8)
+        topBottomSplitter.setStretchFactor(1, 2)
+        allLayout.addWidget(topBottomSplitter)
+        self.asmLinear.setFocus()
+
+    def loadBackground(self):
+        """
+        Load the functions disassembled in the background in lazy mode, unless a task is queued or running
+        """
+        if self.scheduler.busy():
+            return
+        with Utils.tryAnalysisLock() as locked:
+            if not locked:
+                return
+            changed = BinaryAnalysis.collectBackground()
+        if self.mainTab.indexOf(self.asmLinear) != -1:
+            self.asmLinear.refreshLoaded(changed)
+        if BinaryAnalysis.pending is None:
+            self.backgroundTimer.stop()
 
     def gotoLibFunc(self, name):
         for func in BinaryAnalysis.funcs:
@@ -220,40 +284,16 @@ class Window(QMainWindow):
         self.hexView.changeData(offset, data)
 
     def addIRLinearView(self, func):
-        from IRAnalysis import IRAnalysis
         from IRView import IRWidget
-        if func in self.iraChache:
-            if not func.changed:
-                ira = self.iraChache[func]
-            else:
-                func.changed = False
-                ira = IRAnalysis(func.address, func.cfg)
-                self.iraChache[func] = ira
-        else:
-            ira = IRAnalysis(func.address, func.cfg)
-            self.iraChache[func] = ira
-        irLinearView = IRWidget(ira, 0)
+        irLinearView = IRWidget(func, 0)
         self.addNewTab(irLinearView, "IR Linear %s" % func.name)
 
     def addIRCFGView(self, func):
-        from IRAnalysis import IRAnalysis
         from IRView import IRWidget
-        if func in self.iraChache:
-            if not func.changed:
-                ira = self.iraChache[func]
-            else:
-                func.changed = False
-                func.ircfg = None
-                func.defUse = None
-                func.ira = None
-                ira = IRAnalysis(func.address, func.cfg)
-                self.iraChache[func] = ira
-        else:
-            ira = IRAnalysis(func.address, func.cfg)
-            self.iraChache[func] = ira
-        irLinearView = IRWidget(ira, 2)
+        irLinearView = IRWidget(func, 2)
         self.addNewTab(irLinearView, "IR CFG %s" % func.name)
 
+    @whenAnalysisFree
     def addAsmCFGView(self, line):
         for i in range(self.mainTab.count()):
             widget = self.mainTab.widget(i)
@@ -265,11 +305,6 @@ class Window(QMainWindow):
                     else:
                         self.mainTab.removeTab(i)
                         line.func.changed = False
-                        line.func.ircfg = None
-                        line.func.ira = None
-                        line.func.defUse = None
-                        if line.func in self.iraChache:
-                            del self.iraChache[line.func]
                         break
         asmCFGView = AsmCFGView(line.func)
         asmCFGView.gotoAsmLinear.connect(self.gotoAsmLinear)
@@ -286,12 +321,14 @@ class Window(QMainWindow):
         asmCFGView.selectAddress(line.address, True, False)
         self.addNewTab(asmCFGView, "AsmCFG")
 
+    @whenAnalysisFree
     def gotoAsmLinear(self, address):
         index = self.mainTab.indexOf(self.asmLinear)
         if index == -1:
             self.asmLinear = AsmLinear()
             self.bindAsmLinear()
             self.addNewTab(self.asmLinear, "Disassmbly")
+        self.asmLinear.loadRange(address, address + 1)
         if address in self.asmLinear.addressMap:
             self.focusWidgetInTab(self.asmLinear)
             self.asmLinear.focusAddress(address)
@@ -311,8 +348,11 @@ class Window(QMainWindow):
         self.mainTab.setCurrentIndex(index + 1)
         widget.setFocus()
 
+    @whenAnalysisFree
     def gotoAddress(self, address):
         from IRView import IRWidget
+        # the function at address is needed by all the views
+        self.asmLinear.loadRange(address, address + 1)
         widget = self.getCurrentWidget()
         if isinstance(widget, AsmCFGView):
             self.replaceAsmCFG(address)
@@ -337,6 +377,7 @@ class Window(QMainWindow):
             self.hexView.toOffset(offset)
             self.hexView.setFocus()
 
+    @whenAnalysisFree
     def replaceAsmCFG(self, address):
         newFunc = None
         index = self.mainTab.currentIndex()
@@ -345,6 +386,7 @@ class Window(QMainWindow):
                 newFunc = func
                 break
         if newFunc is not None:
+            self.asmLinear.loadRange(address, address + 1)
             asmCFGView = AsmCFGView(newFunc)
             self.addNewTab(asmCFGView, "AsmCFG")
             asmCFGView.changeCFG.connect(self.replaceAsmCFG)
@@ -365,28 +407,24 @@ class Window(QMainWindow):
         widget.setFocus()
 
     def saveFile(self):
-        if BinaryAnalysis.path is not None:
+        if self.mainTab is not None:
             button_pressed = QMessageBox.question(self, 'Save File', "Do you want to save?",
                                                   QMessageBox.Yes | QMessageBox.No, QMessageBox.No)
             if button_pressed == QMessageBox.Yes:
-                f = open(BinaryAnalysis.path, 'wb')
-                f.write(bytearray(BinaryAnalysis.rawData))
-                f.close()
+                BinaryAnalysis.rawData.save(BinaryAnalysis.path)
 
     def saveFileAs(self):
-        if BinaryAnalysis.path is not None:
+        if self.mainTab is not None:
             name, _ = QFileDialog.getSaveFileName(self, "Save File as")
             if name:
-                f = open(name, 'wb')
-                f.write(bytearray(BinaryAnalysis.rawData))
-                f.close()
+                BinaryAnalysis.rawData.save(name)
 
     def openAsmLinearView(self):
-        if BinaryAnalysis.path is not None:
+        if self.mainTab is not None:
             self.gotoAsmLinear(BinaryAnalysis.binaryInfo.entryPoint)
 
     def openAsmCFGView(self):
-        if BinaryAnalysis.path is not None:
+        if self.mainTab is not None:
             if self.mainTab.currentWidget() == self.asmLinear:
                 indexes = self.asmLinear.selectedIndexes()
                 if len(indexes) > 0:
@@ -394,7 +432,7 @@ class Window(QMainWindow):
                     self.addAsmCFGView(line)
 
     def openIRLinearView(self):
-        if BinaryAnalysis.path is not None:
+        if self.mainTab is not None:
             if self.mainTab.currentWidget() == self.asmLinear:
                 indexes = self.asmLinear.selectedIndexes()
                 if len(indexes) > 0:
@@ -404,7 +442,7 @@ class Window(QMainWindow):
                 self.addIRLinearView(self.mainTab.currentWidget().func)
 
     def openIRCFGView(self):
-        if BinaryAnalysis.path is not None:
+        if self.mainTab is not None:
             if self.mainTab.currentWidget() == self.asmLinear:
                 indexes = self.asmLinear.selectedIndexes()
                 if len(indexes) > 0:
@@ -424,12 +462,14 @@ class Window(QMainWindow):
         if self.stringView is not None:
             self.focusWidgetInTab(self.stringView)
         else:
-            self.stringView = StringView(BinaryAnalysis.binaryInfo.strings)
+            self.stringView = StringView(BinaryAnalysis.allStrings)
             self.addNewTab(self.stringView, "Strings")
 
     def recoverAlgorithm(self):
-        from IRAnalysis import IRAnalysis
-        from IRView import IRCFGRecover, IRWidget
+        from IRAnalysis import recoverFunction
+        from IRView import IRWidget
+        if self.mainTab is None:
+            return
         widget = self.mainTab.currentWidget()
         func = None
         if isinstance(widget, AsmLinear):
@@ -440,19 +480,38 @@ class Window(QMainWindow):
         elif isinstance(widget, AsmCFGView):
             func = widget.func
         elif isinstance(widget, IRWidget):
-            address = widget.ira.address
-            for f in BinaryAnalysis.funcs:
-                if f.address == address:
-                    func = f
-                    break
+            func = widget.func
         if func is not None:
-            if func in self.iraChache:
-                ira = self.iraChache[func]
-            else:
-                ira = IRAnalysis(func.address, func.cfg)
-            newLocDB, newIRCFG = ira.recoverAlgorithm()
-            recoverIRCFG = IRCFGRecover(newIRCFG)
-            for block in recoverIRCFG.mapItems:
-                line = block.model.item(0, 0)
-                line.setText(newLocDB.pretty_str(line.lockey))
-            self.addNewTab(recoverIRCFG, "Recovered IRCFG")
\ No newline at end of file
+            task = self.scheduler.submit(recoverFunction, func, priority=PRIORITY_ACTION,
+                                         name='Deobfuscate %s' % func.name)
+            task.finished.connect(self.showRecovered)
+            task.failed.connect(self.outputLog.append)
+
+    def showRecovered(self, result):
+        from IRView import IRCFGRecover
+        if self.mainTab is not None:
+            newLocDB, newIRCFG = result
+            recoverIRCFG = IRCFGRecover(newIRCFG, newLocDB)
+            self.addNewTab(recoverIRCFG, "Recovered IRCFG")
+
+    def cancelTasks(self):
+        """
+        Cancel the analysis tasks, the file being opened included
+        """
+        self.scheduler.cancelAll()
+
+    def showProgress(self, task, text, done, total):
+        message = task.name
+        if text:
+            message += ': ' + text
+        if total:
+            message += ' %d/%d' % (done, total)
+        elif done:
+            message += ' %d' % done
+        self.statusBar.showMessage(message)
+
+    def taskDone(self, task):
+        if task.isCancelled():
+            self.statusBar.showMessage('%s: cancelled' % task.name, 2000)
+        elif not self.scheduler.busy():
+            self.statusBar.clearMessage()
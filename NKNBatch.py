@@ -0,0 +1,195 @@
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+
+import Utils
+from Analysis import BinaryAnalysis
+from References import XREF_KINDS
+from Strings import UTF16LE
+
+
+def listBinaries(paths):
+    """
+    :param paths: files and directories, directories are walked recursively
+    :return: list of file paths
+    """
+    binaries = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for name in sorted(files):
+                    binaries.append(os.path.join(root, name))
+        else:
+            binaries.append(path)
+    return binaries
+
+
+def iterRecords(binary, strings=True):
+    """
+    Records of the analysis loaded in BinaryAnalysis
+    :param binary: path written in every record
+    :param strings: include the strings of the binary
+    :return: generator of dict
+    """
+    locDB = BinaryAnalysis.locDB
+    code = BinaryAnalysis.code
+    yield {'type': 'binary', 'binary': binary, 'format': BinaryAnalysis.binaryInfo.type,
+           'arch': BinaryAnalysis.container.arch, 'entry': BinaryAnalysis.container.entry_point,
+           'functions': len(BinaryAnalysis.funcs), 'blocks': len(code.listedBlocks())}
+    # the records are read from the columns of the store, the CFGs of the functions are not rebuilt
+    for func in BinaryAnalysis.funcs:
+        yield {'type': 'function', 'binary': binary, 'address': func.address, 'name': func.name,
+               'size': func.size, 'minBound': func.minBound, 'maxBound': func.maxBound,
+               'blocks': code.functionBlockCount(func), 'calls': len(code.select(func, 'CALL'))}
+    for b in code.listedBlocks():
+        func = code.blockFunction(b)
+        address = code.blockAddresses[b]
+        successors = set(locDB.get_location_offset(locKey) for locKey in code.successors(b))
+        yield {'type': 'block', 'binary': binary, 'function': func.address, 'address': address,
+               'size': code.blockEnds[b] - address, 'instructions': len(code.rowsOfBlock(b)),
+               'successors': sorted(offset for offset in successors if offset is not None)}
+    for address, source, kind in BinaryAnalysis.xrefs:
+        yield {'type': 'xref', 'binary': binary, 'kind': XREF_KINDS[kind], 'from': source, 'to': address}
+    if strings:
+        allStrings = BinaryAnalysis.allStrings
+        for i in range(len(allStrings)):
+            yield {'type': 'string', 'binary': binary, 'address': allStrings.addresses[i],
+                   'encoding': 'utf-16le' if allStrings.encodings[i] == UTF16LE else 'ascii',
+                   'value': allStrings.text(i)}
+
+
+def errorRecord(binary, e):
+    """
+    :return: NDJSON line of the error record of binary
+    """
+    return json.dumps({'type': 'error', 'binary': binary, 'error': '%s: %s' % (type(e).__name__, e)})
+
+
+def analyseBinary(job, output):
+    """
+    Analyse one binary in the current worker and write its records to output as soon as they are produced. When the
+    analysis fails, an error record follows the records already written.
+    :param job: (path, strings, fast, database)
+    :param output: text file
+    :return: True if the binary could be analysed
+    """
+    binary, strings, fast, database = job
+    try:
+        # the binaries are already spread over the workers, disassemble their functions inline
+        BinaryAnalysis.init(binary, sandbox=False, fast=fast, database=database, workers=1)
+        for record in iterRecords(binary, strings):
+            output.write(json.dumps(record) + '\n')
+        return True
+    except Exception as e:
+        output.write(errorRecord(binary, e) + '\n')
+        return False
+    finally:
+        BinaryAnalysis.clear()
+
+
+def analyseToFile(job):
+    """
+    analyseBinary in a worker process. The records go through a temporary file, so a big binary never holds them all
+    in memory.
+    :return: (ok, path of the temporary file)
+    """
+    fd, path = tempfile.mkstemp(prefix='nkn-', suffix='.ndjson')
+    with os.fdopen(fd, 'w') as output:
+        ok = analyseBinary(job, output)
+    return ok, path
+
+
+def copyRecords(path, output):
+    with open(path) as records:
+        shutil.copyfileobj(records, output)
+    os.remove(path)
+    output.flush()
+
+
+def poolBatch(jobs, workers, output):
+    """
+    Run analyseToFile on jobs in a pool of processes and copy the records of every binary to output once it is done
+    :return: (errors, crashed) the number of binaries which could not be analysed and the jobs lost when a worker
+        crashed, which breaks the pool and every job still in it
+    """
+    errors = 0
+    crashed = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = dict((pool.submit(analyseToFile, job), job) for job in jobs)
+        for future in as_completed(futures):
+            try:
+                ok, path = future.result()
+            except BrokenProcessPool:
+                crashed.append(futures[future])
+                continue
+            except Exception as e:
+                output.write(errorRecord(futures[future][0], e) + '\n')
+                output.flush()
+                errors += 1
+                continue
+            if not ok:
+                errors += 1
+            copyRecords(path, output)
+    return errors, crashed
+
+
+def runBatch(binaries, output, workers=None, strings=True, fast=False, database=False):
+    """
+    Analyse binaries in a pool of processes and write their records to output as soon as a binary is done
+    :param binaries: list of paths
+    :param output: text file
+    :param workers: number of processes, Utils.WORKERS by default
+    :param strings: include the strings of the binaries
+    :param fast: find the functions without radare, see BinaryAnalysis.init
+    :param database: restore and save the analyses in the project database
+    :return: number of binaries which could not be analysed
+    """
+    if workers is None:
+        workers = Utils.WORKERS
+    jobs = [(binary, strings, fast, database) for binary in binaries]
+    if workers <= 1:
+        errors = 0
+        for job in jobs:
+            if not analyseBinary(job, output):
+                errors += 1
+            output.flush()
+        return errors
+    errors, crashed = poolBatch(jobs, workers, output)
+    # the crash of a worker fails all the jobs of the pool, run them again alone to find the binaries which crash it
+    for job in crashed:
+        jobErrors, jobCrashed = poolBatch([job], 1, output)
+        if jobCrashed:
+            output.write(errorRecord(job[0], BrokenProcessPool("the worker analysing the binary crashed")) + '\n')
+            output.flush()
+            jobErrors += 1
+        errors += jobErrors
+    return errors
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Analyse binaries without the GUI and export the results as NDJSON")
+    parser.add_argument('binaries', nargs='+', help="binaries or directories of binaries")
+    parser.add_argument('-o', '--output', help="output file, standard output by default")
+    parser.add_argument('-j', '--jobs', type=int, default=Utils.WORKERS, help="number of worker processes")
+    parser.add_argument('--no-strings', action='store_true', help="do not export the strings")
+    parser.add_argument('--fast', action='store_true', help="find the functions without radare")
+    parser.add_argument('--database', action='store_true',
+                        help="restore and save the analyses in the project database, like the GUI")
+    args = parser.parse_args(argv)
+    binaries = listBinaries(args.binaries)
+    if args.output:
+        with open(args.output, 'w') as output:
+            errors = runBatch(binaries, output, args.jobs, not args.no_strings, args.fast, args.database)
+    else:
+        errors = runBatch(binaries, sys.stdout, args.jobs, not args.no_strings, args.fast, args.database)
+    return 1 if errors else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
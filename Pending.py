@@ -0,0 +1,82 @@
+from array import array
+from bisect import bisect_right
+
+
+class PendingFunctions:
+    """
+    Functions which are not disassembled yet in lazy mode, looked up by address range.
+    The functions are sorted by start once, with the maximum of the ends up to each of them like the blocks of the
+    InstructionStore, the loaded ones are only removed from the set of the pending ones.
+    """
+
+    def __init__(self, funcs, results=None):
+        """
+        :param funcs: list of Function
+        :param results: disasmWorker results of funcs if they are already disassembled
+        """
+        order = sorted(range(len(funcs)), key=lambda i: (self.bounds(funcs[i]), i))
+        self.funcs = [funcs[i] for i in order]
+        self.starts = array('Q', [self.bounds(func)[0] for func in self.funcs])
+        self.ends = array('Q', [self.bounds(func)[1] for func in self.funcs])
+        self.maxEnds = array('Q')
+        maxEnd = 0
+        for end in self.ends:
+            maxEnd = max(maxEnd, end)
+            self.maxEnds.append(maxEnd)
+        self.waiting = set(id(func) for func in funcs)
+        self.results = {}
+        if results is not None:
+            for func, result in zip(funcs, results):
+                self.results[id(func)] = result
+
+    @staticmethod
+    def bounds(func):
+        """
+        :return: [start, end) of the bytes of func, including its entry
+        """
+        return min(func.minBound, func.address), max(func.maxBound, func.address + 1)
+
+    def __len__(self):
+        return len(self.waiting)
+
+    def __contains__(self, func):
+        return id(func) in self.waiting
+
+    def overlapping(self, start, end):
+        """
+        :return: pending functions whose bytes intersect [start, end), by start
+        """
+        funcs = []
+        i = bisect_right(self.maxEnds, start)
+        while i < len(self.funcs) and self.starts[i] < end:
+            if self.ends[i] > start and id(self.funcs[i]) in self.waiting:
+                funcs.append(self.funcs[i])
+            i += 1
+        return funcs
+
+    def remaining(self):
+        """
+        :return: pending functions by start
+        """
+        return [func for func in self.funcs if id(func) in self.waiting]
+
+    def setResult(self, func, result):
+        if id(func) in self.waiting:
+            self.results[id(func)] = result
+
+    def hasResult(self, func):
+        return id(func) in self.results
+
+    def result(self, func):
+        """
+        :return: the disasmWorker result of func if it is known, None otherwise
+        """
+        return self.results.get(id(func))
+
+    def pop(self, func):
+        """
+        Mark func as loaded
+        :return: its disasmWorker result if it is known, None otherwise
+        """
+        self.waiting.discard(id(func))
+        return self.results.pop(id(func), None)
@@ -1,5 +1,8 @@
-import ctypes
 import base64
+import ctypes
+import json
+from array import array
+from bisect import bisect_left
 
 
 class Refs:
@@ -32,6 +35,17 @@ class Var:
 
 
 class Function:
+    """
+    Function found by radare, built from its aflj/afij JSON dict.
+    The references are kept in arrays, the dicts callRefs and codeXRefs are only built when they are asked for.
+    The blocks are owned by BinaryAnalysis.code, the AsmCFG cfg is rebuilt from it when it is asked for
+    """
+    __slots__ = ('address', 'name', 'size', 'realSize', 'calltype', 'minBound', 'maxBound', 'numArgs', '_cfg',
+                 'changed', 'callAts', 'callTargets', 'dataRefArray', 'xrefTargets', 'xrefSources', '_callRefs',
+                 '_codeXRefs')
+    # decoded dicts and CFG, not saved
+    cachedSlots = ('_cfg', '_callRefs', '_codeXRefs')
+
     def __init__(self, dict):
         self.address = dict['offset']
         self.name = dict['name'].replace('sym.','').replace('imp.','_')
@@ -40,24 +54,17 @@ class Function:
         self.calltype = dict['calltype']
         self.minBound = dict['minbound']
         self.maxBound = dict['maxbound']
-        self.callRefs = {}
-        if 'callrefs' in dict:
-            for callRef in dict['callrefs']:
-                address = callRef['addr']
-                at = callRef['at']
-                self.callRefs[at] = address
-        self.dataRefs = []
-        if 'datarefs' in dict:
-            self.dataRefs = dict['datarefs']
-        self.codeXRefs = {}
-        if 'codexrefs' in dict:
-            for codeXref in dict['codexrefs']:
-                address = codeXref['addr']
-                at = codeXref['at']
-                if at in self.codeXRefs:
-                    self.codeXRefs[at].append(address)
-                else:
-                    self.codeXRefs[at] = [address]
+        self.callAts = array('Q')
+        self.callTargets = array('Q')
+        for callRef in dict.get('callrefs', ()):
+            self.callAts.append(callRef['at'])
+            self.callTargets.append(callRef['addr'])
+        self.dataRefArray = array('Q', sorted(set(dict.get('datarefs', ()))))
+        self.xrefTargets = array('Q')
+        self.xrefSources = array('Q')
+        for codeXref in dict.get('codexrefs', ()):
+            self.xrefTargets.append(codeXref['at'])
+            self.xrefSources.append(codeXref['addr'])
         # self.numVar = dict['nlocals']
         self.numArgs = dict['nargs']
         # self.bpVars = []
@@ -66,8 +73,86 @@ class Function:
         # self.spVars = []
         # for spvar in dict['spvars']:
         #     self.spVars.append(Var(spvar))
-        self.cfg = None
+        self._cfg = None
         self.changed = False
-        self.ira = None
-        self.ircfg = None
-        self.defUse = None
+        self._callRefs = None
+        self._codeXRefs = None
+
+    def __getstate__(self):
+        return dict((slot, getattr(self, slot)) for slot in self.__slots__ if slot not in self.cachedSlots)
+
+    def __setstate__(self, state):
+        for slot, value in state.items():
+            setattr(self, slot, value)
+        for slot in self.cachedSlots:
+            setattr(self, slot, None)
+
+    @property
+    def cfg(self):
+        """
+        :return: AsmCFG of the function, None while it is not disassembled, see BinaryAnalysis.functionCFG
+        """
+        from Analysis import BinaryAnalysis
+        return BinaryAnalysis.functionCFG(self)
+
+    @cfg.setter
+    def cfg(self, cfg):
+        from Analysis import BinaryAnalysis
+        self._cfg = cfg
+        BinaryAnalysis.keepCFG(self)
+
+    @property
+    def callRefs(self):
+        """
+        :return: dict address of the call -> called address
+        """
+        if self._callRefs is None:
+            self._callRefs = dict(zip(self.callAts, self.callTargets))
+        return self._callRefs
+
+    @property
+    def codeXRefs(self):
+        """
+        :return: dict address -> list of the addresses jumping or calling to it
+        """
+        if self._codeXRefs is None:
+            self._codeXRefs = {}
+            for at, address in zip(self.xrefTargets, self.xrefSources):
+                self._codeXRefs.setdefault(at, []).append(address)
+        return self._codeXRefs
+
+    @property
+    def dataRefs(self):
+        return list(self.dataRefArray)
+
+    def hasDataRef(self, address):
+        i = bisect_left(self.dataRefArray, address)
+        return i < len(self.dataRefArray) and self.dataRefArray[i] == address
+
+    def iterCallRefs(self):
+        """
+        :return: iterator over the (at, address) of the calls, without building callRefs
+        """
+        return zip(self.callAts, self.callTargets)
+
+    def iterCodeXRefs(self):
+        """
+        :return: iterator over the (at, address) of the references to the function, without building codeXRefs
+        """
+        return zip(self.xrefTargets, self.xrefSources)
+
+
+def iterJson(text):
+    """
+    :return: iterator over the JSON values written one after the other in text, e.g. by a command run with @@
+    """
+    decoder = json.JSONDecoder()
+    end = len(text)
+    i = 0
+    while True:
+        while i < end and text[i].isspace():
+            i += 1
+        if i == end:
+            return
+        value, i = decoder.raw_decode(text, i)
+        yield value
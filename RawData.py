@@ -0,0 +1,102 @@
+import mmap
+import os
+
+from Coverage import CoverageMap
+
+
+class RawData:
+    """
+    Content of the binary file, mapped in memory instead of being copied.
+    Edits are kept in an overlay of patched bytes, the file itself is only written by save().
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'rb')
+        size = os.fstat(self.file.fileno()).st_size
+        if size > 0:
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+            self.view = memoryview(self.map)
+        else:
+            self.map = None
+            self.view = memoryview(b'')
+        self.patches = {}
+        self.patched = CoverageMap()
+
+    def __len__(self):
+        return len(self.view)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(len(self))
+            if step != 1:
+                return self.read(start, max(0, stop - start))[::step]
+            return self.read(start, max(0, stop - start))
+        if key < 0:
+            key += len(self)
+        if key < 0 or key >= len(self):
+            raise IndexError(key)
+        if key in self.patches:
+            return self.patches[key]
+        return self.view[key]
+
+    def read(self, offset, size):
+        """
+        :return: bytes of [offset, offset + size) with the patches applied
+        """
+        end = min(offset + size, len(self))
+        if offset >= end:
+            return b''
+        data = self.view[offset:end]
+        if not self.isPatched(offset, end):
+            return data.tobytes()
+        data = bytearray(data)
+        for start, stop in self.patched:
+            if stop <= offset:
+                continue
+            if start >= end:
+                break
+            for i in range(max(start, offset), min(stop, end)):
+                data[i - offset] = self.patches[i]
+        return bytes(data)
+
+    def isPatched(self, start, end):
+        """
+        :return: True if a byte of [start, end) was changed
+        """
+        for gap in self.patched.gaps(start, end):
+            return gap != (start, end)
+        return True
+
+    def write(self, offset, data):
+        """
+        Record data at offset in the patch overlay
+        """
+        if offset < 0 or offset + len(data) > len(self):
+            raise IndexError(offset)
+        for i, byte in enumerate(data):
+            self.patches[offset + i] = byte
+        self.patched.add(offset, offset + len(data))
+
+    def save(self, path):
+        """
+        Write the patched content to path. Saving over the mapped file only writes the patched bytes
+        """
+        if os.path.exists(path) and os.path.samefile(path, self.path):
+            with open(path, 'r+b') as f:
+                for start, end in self.patched:
+                    f.seek(start)
+                    f.write(bytes(self.patches[i] for i in range(start, end)))
+            self.patches.clear()
+            self.patched = CoverageMap()
+            return
+        with open(path, 'wb') as f:
+            chunkSize = 1 << 20
+            for offset in range(0, len(self), chunkSize):
+                f.write(self.read(offset, chunkSize))
+
+    def close(self):
+        self.view.release()
+        if self.map is not None:
+            self.map.close()
+        self.file.close()
@@ -0,0 +1,171 @@
+from array import array
+from bisect import bisect_left, bisect_right
+
+XREF_CODE = 0
+XREF_CALL = 1
+XREF_DATA = 2
+XREF_KINDS = {XREF_CODE: 'code', XREF_CALL: 'call', XREF_DATA: 'data'}
+
+# below this number of pending references they are inserted one by one instead of merged
+INSERT_LIMIT = 64
+
+
+def lexicoPosition(first, second, third, key, right=False):
+    """
+    :param first, second, third: parallel arrays sorted by (first, second, third)
+    :param key: (a, b, c)
+    :return: bisect position of key in the arrays
+    """
+    bisect = bisect_right if right else bisect_left
+    a, b, c = key
+    lo = bisect_left(first, a)
+    hi = bisect_right(first, a, lo)
+    lo = bisect_left(second, b, lo, hi)
+    hi = bisect_right(second, b, lo, hi)
+    return bisect(third, c, lo, hi)
+
+
+class XrefIndex:
+    """
+    Cross references of the binary as (target, source, kind), stored twice as parallel arrays: sorted by
+    (target, source, kind) for the references to an address and by (source, target, kind) for the references
+    from an address.
+    A reference may be recorded several times, e.g. by functions sharing an instruction, and is only forgotten
+    when all of them removed it. Added references are kept apart and merged by the next query.
+    """
+
+    def __init__(self, refs=()):
+        self.targets = array('Q')
+        self.sources = array('Q')
+        self.kinds = array('B')
+        self.fromSources = array('Q')
+        self.fromTargets = array('Q')
+        self.fromKinds = array('B')
+        self.pending = list(refs)
+
+    def __getstate__(self):
+        self.flush()
+        return self.__dict__.copy()
+
+    def __len__(self):
+        self.flush()
+        return len(self.targets)
+
+    def add(self, target, source, kind):
+        self.pending.append((target, source, kind))
+
+    def flush(self):
+        """
+        Merge the added references in the sorted arrays
+        """
+        if not self.pending:
+            return
+        pending = self.pending
+        self.pending = []
+        if len(pending) < INSERT_LIMIT:
+            for target, source, kind in pending:
+                i = lexicoPosition(self.targets, self.sources, self.kinds, (target, source, kind), True)
+                self.targets.insert(i, target)
+                self.sources.insert(i, source)
+                self.kinds.insert(i, kind)
+                i = lexicoPosition(self.fromSources, self.fromTargets, self.fromKinds, (source, target, kind), True)
+                self.fromSources.insert(i, source)
+                self.fromTargets.insert(i, target)
+                self.fromKinds.insert(i, kind)
+            return
+        refs = list(zip(self.targets, self.sources, self.kinds))
+        refs.extend(pending)
+        refs.sort()
+        self.targets = array('Q', [ref[0] for ref in refs])
+        self.sources = array('Q', [ref[1] for ref in refs])
+        self.kinds = array('B', [ref[2] for ref in refs])
+        refs.sort(key=lambda ref: (ref[1], ref[0], ref[2]))
+        self.fromSources = array('Q', [ref[1] for ref in refs])
+        self.fromTargets = array('Q', [ref[0] for ref in refs])
+        self.fromKinds = array('B', [ref[2] for ref in refs])
+
+    def remove(self, target, source, kind):
+        """
+        Forget one record of the reference
+        :return: True if it was recorded
+        """
+        self.flush()
+        i = lexicoPosition(self.targets, self.sources, self.kinds, (target, source, kind))
+        if i == len(self.targets) or (self.targets[i], self.sources[i], self.kinds[i]) != (target, source, kind):
+            return False
+        del self.targets[i]
+        del self.sources[i]
+        del self.kinds[i]
+        i = lexicoPosition(self.fromSources, self.fromTargets, self.fromKinds, (source, target, kind))
+        del self.fromSources[i]
+        del self.fromTargets[i]
+        del self.fromKinds[i]
+        return True
+
+    def refsTo(self, target, kind=None):
+        """
+        :return: sorted list of the distinct (source, kind) referencing target
+        """
+        self.flush()
+        lo = bisect_left(self.targets, target)
+        hi = bisect_right(self.targets, target, lo)
+        refs = []
+        for i in range(lo, hi):
+            ref = (self.sources[i], self.kinds[i])
+            if (kind is None or ref[1] == kind) and (not refs or refs[-1] != ref):
+                refs.append(ref)
+        return refs
+
+    def sourcesTo(self, target, kind=None):
+        """
+        :return: sorted list of the distinct addresses referencing target
+        """
+        sources = []
+        for source, _ in self.refsTo(target, kind):
+            if not sources or sources[-1] != source:
+                sources.append(source)
+        return sources
+
+    def refsFrom(self, source, kind=None):
+        """
+        :return: sorted list of the distinct (target, kind) referenced from source
+        """
+        self.flush()
+        lo = bisect_left(self.fromSources, source)
+        hi = bisect_right(self.fromSources, source, lo)
+        refs = []
+        for i in range(lo, hi):
+            ref = (self.fromTargets[i], self.fromKinds[i])
+            if (kind is None or ref[1] == kind) and (not refs or refs[-1] != ref):
+                refs.append(ref)
+        return refs
+
+    def refsInto(self, start, end, kind=None):
+        """
+        :return: sorted list of the distinct (target, source, kind) whose target is in [start, end)
+        """
+        self.flush()
+        refs = []
+        for i in range(bisect_left(self.targets, start), bisect_left(self.targets, end)):
+            ref = (self.targets[i], self.sources[i], self.kinds[i])
+            if (kind is None or ref[2] == kind) and (not refs or refs[-1] != ref):
+                refs.append(ref)
+        return refs
+
+    def refsFromRange(self, start, end, kind=None):
+        """
+        :return: sorted list of the distinct (source, target, kind) whose source is in [start, end)
+        """
+        self.flush()
+        refs = []
+        for i in range(bisect_left(self.fromSources, start), bisect_left(self.fromSources, end)):
+            ref = (self.fromSources[i], self.fromTargets[i], self.fromKinds[i])
+            if (kind is None or ref[2] == kind) and (not refs or refs[-1] != ref):
+                refs.append(ref)
+        return refs
+
+    def __iter__(self):
+        """
+        :return: iterator over the distinct (target, source, kind) sorted by target
+        """
+        return iter(self.refsInto(0, 1 << 64))
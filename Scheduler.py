@@ -0,0 +1,201 @@
+import heapq
+import itertools
+import threading
+import traceback
+from concurrent.futures import Future
+from functools import partial, wraps
+
+from PyQt5.QtCore import QObject, Qt, QTimer, pyqtSignal, pyqtSlot
+
+import Utils
+
+# lower runs first: the views shown, then the actions asked by the user, then the whole program passes
+PRIORITY_VIEW = 0
+PRIORITY_ACTION = 1
+PRIORITY_BACKGROUND = 2
+# milliseconds before a Qt-side call deferred by whenAnalysisFree tries again to take the analysis lock
+RETRY_DELAY = 50
+
+
+class Task(QObject):
+    """
+    Job of the TaskScheduler. Its signals are emitted in the Qt thread, its future can be waited for from any thread
+    """
+    progress = pyqtSignal(str, int, int)
+    finished = pyqtSignal(object)
+    failed = pyqtSignal(str)
+    cancelled = pyqtSignal()
+
+    def __init__(self, target, args, kwargs, priority, name):
+        super(Task, self).__init__()
+        self.target = target
+        self.args = args
+        self.kwargs = kwargs
+        self.priority = priority
+        self.name = name
+        self.token = Utils.CancelToken()
+        self.future = Future()
+
+    def cancel(self):
+        """
+        Remove the task from the queue, or ask it to stop at its next checkCancelled if it is running
+        """
+        self.token.cancel()
+        self.future.cancel()
+
+    def isCancelled(self):
+        return self.token.isCancelled()
+
+
+class TaskScheduler(QObject):
+    """
+    Run tasks on a pool of worker threads, the task of lowest priority first and in submission order for the same
+    priority. A running task is not preempted, it stops if it is cancelled when it calls Utils.checkCancelled.
+    The tasks share the miasm objects of the loaded binary and run holding Utils.ANALYSIS_LOCK, so they never run in
+    parallel: with the single worker of getScheduler, or with more workers which wait for the lock, the pool only
+    moves the analysis out of the Qt thread and orders it by priority.
+    The Qt thread must not wait for the lock either, its calls into the analysis go through whenAnalysisFree or are
+    submitted as tasks.
+    """
+    progress = pyqtSignal(object, str, int, int)
+    done = pyqtSignal(object)
+    # worker thread -> Qt thread, see deliver
+    delivered = pyqtSignal(object, str, object)
+
+    def __init__(self, workers=1):
+        super(TaskScheduler, self).__init__()
+        self.queue = []
+        self.sequence = itertools.count()
+        self.condition = threading.Condition()
+        self.running = set()
+        self.stopped = False
+        self.delivered.connect(self.deliver, Qt.QueuedConnection)
+        self.threads = [threading.Thread(target=self.work, name='TaskScheduler-%d' % i, daemon=True)
+                        for i in range(workers)]
+        for thread in self.threads:
+            thread.start()
+
+    def submit(self, target, *args, priority=PRIORITY_ACTION, name=None, **kwargs):
+        """
+        Run target(*args, **kwargs) in a worker
+        :param name: text shown with the progress of the task, the name of target by default
+        :return: Task whose finished signal gives the result of target
+        """
+        task = Task(target, args, kwargs, priority, name or target.__name__)
+        with self.condition:
+            if self.stopped:
+                raise RuntimeError('the scheduler is shut down')
+            heapq.heappush(self.queue, (priority, next(self.sequence), task))
+            self.condition.notify()
+        return task
+
+    def busy(self, priority=PRIORITY_BACKGROUND):
+        """
+        :return: True if a task of at most priority is queued or running
+        """
+        with self.condition:
+            return any(task.priority <= priority for task in self.running) or \
+                   any(task.priority <= priority and not task.future.cancelled() for _, _, task in self.queue)
+
+    def cancelAll(self, priority=PRIORITY_BACKGROUND):
+        """
+        Cancel the tasks of at most priority, queued or running
+        """
+        with self.condition:
+            tasks = list(self.running) + [task for _, _, task in self.queue]
+        for task in tasks:
+            if task.priority <= priority:
+                task.cancel()
+
+    def shutdown(self, wait=True):
+        """
+        Cancel all the tasks and stop the workers
+        """
+        self.cancelAll()
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+        if wait:
+            for thread in self.threads:
+                thread.join()
+
+    def work(self):
+        while True:
+            with self.condition:
+                while not self.queue and not self.stopped:
+                    self.condition.wait()
+                if self.stopped:
+                    return
+                _, _, task = heapq.heappop(self.queue)
+                if not task.future.set_running_or_notify_cancel():
+                    self.delivered.emit(task, 'cancelled', None)
+                    continue
+                self.running.add(task)
+            self.delivered.emit(task, 'progress', ('', 0, 0))
+            try:
+                with Utils.runningTask(task.token, lambda text, done, total, task=task: self.delivered.emit(
+                        task, 'progress', (text, done, total))):
+                    with Utils.ANALYSIS_LOCK:
+                        Utils.checkCancelled()
+                        result = task.target(*task.args, **task.kwargs)
+            except Utils.TaskCancelled as e:
+                task.future.set_exception(e)
+                kind, value = 'cancelled', None
+            except Exception as e:
+                task.future.set_exception(e)
+                kind, value = 'failed', ''.join(traceback.format_exception_only(type(e), e)).strip()
+            else:
+                task.future.set_result(result)
+                kind, value = 'finished', result
+            with self.condition:
+                self.running.discard(task)
+            self.delivered.emit(task, kind, value)
+
+    @pyqtSlot(object, str, object)
+    def deliver(self, task, kind, value):
+        """
+        Emit the signals of a task in the Qt thread
+        """
+        if kind == 'progress':
+            task.progress.emit(*value)
+            self.progress.emit(task, *value)
+            return
+        if kind == 'finished' and task.isCancelled():
+            # cancelled while it was finishing, its result is not wanted anymore
+            kind = 'cancelled'
+        if kind == 'finished':
+            task.finished.emit(value)
+        elif kind == 'failed':
+            task.failed.emit(value)
+        else:
+            task.cancelled.emit()
+        self.done.emit(task)
+
+
+def whenAnalysisFree(method):
+    """
+    Decorator of the Qt-side methods using the analysis: the method runs holding Utils.ANALYSIS_LOCK if no task holds
+    it, otherwise it is called again from the event loop after RETRY_DELAY, so that the interface never waits for a
+    task. A deferred call returns None
+    """
+    @wraps(method)
+    def deferred(*args, **kwargs):
+        with Utils.tryAnalysisLock() as locked:
+            if locked:
+                return method(*args, **kwargs)
+        QTimer.singleShot(RETRY_DELAY, partial(deferred, *args, **kwargs))
+        return None
+    return deferred
+
+
+_scheduler = None
+
+
+def getScheduler():
+    """
+    TaskScheduler shared by the views and actions
+    """
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = TaskScheduler()
+    return _scheduler
@@ -0,0 +1,117 @@
+import re
+from array import array
+from bisect import bisect_left
+
+ASCII = 0
+UTF16LE = 1
+MIN_LENGTH = 2
+CHARS = b"a-zA-Z0-9` \n~!@#$%^&*()-_=+|';\":.,?><*-"
+
+patterns = {}
+
+
+def stringPattern(minLength):
+    if minLength not in patterns:
+        # an ASCII character followed by an UTF-16LE character is left to the UTF-16LE string
+        patterns[minLength] = re.compile(b"((?:[%s](?!\x00[%s]\x00)){%d,})|((?:[%s]\x00){%d,})"
+                                         % (CHARS, CHARS, minLength, CHARS, minLength))
+    return patterns[minLength]
+
+
+def extractStrings(data, sections, minLength=MIN_LENGTH):
+    """
+    Find the ASCII and UTF-16LE strings of all sections with one scan of the mapped file
+    :param data: RawData of the binary
+    :param sections: list of (offset, size, address, inData)
+    :param minLength: minimum number of characters
+    :return: StringIndex
+    """
+    pattern = stringPattern(minLength)
+    entries = []
+    for offset, size, address, inData in sections:
+        end = min(offset + size, len(data))
+        for match in pattern.finditer(data.view, offset, end):
+            encoding = ASCII if match.lastindex == 1 else UTF16LE
+            start = match.start()
+            entries.append((address + start - offset, start, match.end() - start, encoding, int(inData)))
+    entries.sort()
+    return StringIndex(data, entries)
+
+
+class StringIndex:
+    """
+    Strings of the binary sorted by address, stored as parallel arrays of (address, offset, length, encoding).
+    The text is only decoded from the file when it is asked for.
+    """
+
+    def __init__(self, data, entries=()):
+        self.data = data
+        self.addresses = array('Q')
+        self.offsets = array('Q')
+        self.lengths = array('I')
+        self.encodings = array('B')
+        self.inData = array('B')
+        for address, offset, length, encoding, inData in entries:
+            self.addresses.append(address)
+            self.offsets.append(offset)
+            self.lengths.append(length)
+            self.encodings.append(encoding)
+            self.inData.append(inData)
+
+    def __len__(self):
+        return len(self.addresses)
+
+    def __iter__(self):
+        return iter(self.addresses)
+
+    def find(self, address):
+        """
+        :return: position of the string starting at address or -1
+        """
+        i = bisect_left(self.addresses, address)
+        if i < len(self.addresses) and self.addresses[i] == address:
+            return i
+        return -1
+
+    def __contains__(self, address):
+        return self.find(address) != -1
+
+    def __getitem__(self, address):
+        i = self.find(address)
+        if i == -1:
+            raise KeyError(address)
+        return self.text(i)
+
+    def get(self, address, default=None):
+        i = self.find(address)
+        if i == -1:
+            return default
+        return self.text(i)
+
+    def size(self, address):
+        """
+        :return: size in bytes of the string starting at address
+        """
+        i = self.find(address)
+        if i == -1:
+            raise KeyError(address)
+        return self.lengths[i]
+
+    def entry(self, i):
+        return self.addresses[i], self.offsets[i], self.lengths[i], self.encodings[i], self.inData[i]
+
+    def text(self, i):
+        raw = self.data.read(self.offsets[i], self.lengths[i])
+        if self.encodings[i] == UTF16LE:
+            return raw.decode('utf-16-le', 'replace')
+        return raw.decode('ascii', 'replace')
+
+    def items(self):
+        for i in range(len(self.addresses)):
+            yield self.addresses[i], self.text(i)
+
+    def dataStrings(self):
+        """
+        :return: StringIndex of the strings found in data sections
+        """
+        return StringIndex(self.data, (self.entry(i) for i in range(len(self)) if self.inData[i]))
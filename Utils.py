@@ -1,5 +1,10 @@
-import threading
+import os
 import struct
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, ProcessPoolExecutor, wait
 
 addressColor = '#000000'
 opcodeColor = '#1B5E20'
@@ -16,55 +21,185 @@ highlightColor = 'yellow'
 selectedColor = '#D70779'
 
 
-def runMultiThread(listObjs, target):
-    lock = threading.Lock()
-    numFuncs = len(listObjs)
-    for i in range(0, numFuncs, 5):
-        obj1 = None
-        obj2 = None
-        obj3 = None
-        obj4 = None
-        obj5 = None
-        t1 = None
-        t2 = None
-        t3 = None
-        t4 = None
-        t5 = None
-        if i < numFuncs:
-            obj1 = listObjs[i]
-        if i + 1 < numFuncs:
-            obj2 = listObjs[i + 1]
-        if i + 2 < numFuncs:
-            obj3 = listObjs[i + 2]
-        if i + 3 < numFuncs:
-            obj4 = listObjs[i + 3]
-        if i + 4 < numFuncs:
-            obj5 = listObjs[i + 4]
-        if obj1:
-            t1 = threading.Thread(target=target, args=(obj1, lock,))
-            t1.start()
-        if obj2:
-            t2 = threading.Thread(target=target, args=(obj2, lock,))
-            t2.start()
-        if obj3:
-            t3 = threading.Thread(target=target, args=(obj3, lock,))
-            t3.start()
-        if obj4:
-            t4 = threading.Thread(target=target, args=(obj4, lock,))
-            t4.start()
-        if obj5:
-            t5 = threading.Thread(target=target, args=(obj5, lock,))
-            t5.start()
-        if t1:
-            t1.join()
-        if t2:
-            t2.join()
-        if t3:
-            t3.join()
-        if t4:
-            t4.join()
-        if t5:
-            t5.join()
+WORKERS = os.cpu_count() or 1
+USE_PROCESSES = True
+
+
+def runPool(listObjs, target, workers=None, processes=False, initializer=None, initargs=()):
+    """
+    Run target on every object of listObjs with a bounded pool of workers.
+    Idle workers pull the next chunk from the shared queue, so long jobs don't hold back the others.
+    :param listObjs: list of picklable objects (if processes is True)
+    :param target: function called as target(obj), module level if processes is True
+    :param workers: number of workers, WORKERS by default. 1 runs inline in the current thread
+    :param processes: use worker processes instead of threads
+    :param initializer: called once in every worker before the first job
+    :return: list of results in the same order as listObjs
+    """
+    if workers is None:
+        workers = WORKERS
+    workers = max(1, min(workers, len(listObjs)))
+    if workers == 1:
+        if initializer is not None:
+            initializer(*initargs)
+        return [target(obj) for obj in listObjs]
+    if processes:
+        chunkSize = max(1, len(listObjs) // (workers * 16))
+        with ProcessPoolExecutor(max_workers=workers, initializer=initializer, initargs=initargs) as pool:
+            return list(pool.map(target, listObjs, chunksize=chunkSize))
+    with ThreadPoolExecutor(max_workers=workers, initializer=initializer, initargs=initargs) as pool:
+        return list(pool.map(target, listObjs))
+
+
+def runWorklist(seeds, target, expand, workers=None, processes=False, initializer=None, initargs=()):
+    """
+    Run target on the seeds and on the objects found by expand, until no new object is found.
+    The new objects are submitted as soon as the result giving them is there, not round by round.
+    :param seeds: list of hashable objects, picklable if processes is True
+    :param target: function called as target(obj), module level if processes is True
+    :param expand: function called as expand(obj, result) in the current thread, returns the new objects
+    :param workers: number of workers, WORKERS by default. 1 runs inline in the current thread
+    :return: dict obj -> result
+    """
+    if workers is None:
+        workers = WORKERS
+    results = {}
+    seen = set(seeds)
+    if workers <= 1:
+        if initializer is not None:
+            initializer(*initargs)
+        todo = list(seeds)
+        while todo:
+            obj = todo.pop()
+            results[obj] = target(obj)
+            for new in expand(obj, results[obj]):
+                if new not in seen:
+                    seen.add(new)
+                    todo.append(new)
+        return results
+    executor = ProcessPoolExecutor if processes else ThreadPoolExecutor
+    with executor(max_workers=workers, initializer=initializer, initargs=initargs) as pool:
+        running = dict((pool.submit(target, obj), obj) for obj in seeds)
+        while running:
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                obj = running.pop(future)
+                results[obj] = future.result()
+                for new in expand(obj, results[obj]):
+                    if new not in seen:
+                        seen.add(new)
+                        running[pool.submit(target, new)] = new
+    return results
+
+
+class TaskCancelled(Exception):
+    """
+    Raised by checkCancelled in a task which was cancelled
+    """
+
+
+class CancelToken:
+    """
+    Cancellation request of a task, set from any thread and polled by the task
+    """
+
+    def __init__(self):
+        self.event = threading.Event()
+
+    def cancel(self):
+        self.event.set()
+
+    def isCancelled(self):
+        return self.event.is_set()
+
+
+# token and progress callback of the task run by the current thread, see runningTask
+_task = threading.local()
+
+
+@contextmanager
+def runningTask(token, progress):
+    """
+    Make checkCancelled and reportProgress of the current thread use token and progress(text, done, total)
+    """
+    _task.token = token
+    _task.progress = progress
+    try:
+        yield
+    finally:
+        _task.token = None
+        _task.progress = None
+
+
+def checkCancelled():
+    """
+    Raise TaskCancelled if the task run by the current thread was cancelled, does nothing outside of a task
+    """
+    token = getattr(_task, 'token', None)
+    if token is not None and token.isCancelled():
+        raise TaskCancelled()
+
+
+def reportProgress(text, done=0, total=0):
+    """
+    Tell the progress of the task run by the current thread, total is 0 when it is not known
+    """
+    progress = getattr(_task, 'progress', None)
+    if progress is not None:
+        progress(text, done, total)
+
+
+# BinaryAnalysis and the miasm objects of the loaded binary are used by one thread at a time: the scheduler holds the
+# lock while a task runs, the Qt thread while it loads or patches code. The Qt thread only takes it with
+# tryAnalysisLock, see Scheduler.whenAnalysisFree, and the tasks never run in parallel
+ANALYSIS_LOCK = threading.RLock()
+
+
+def analysisLocked(function):
+    """
+    Decorator running function with ANALYSIS_LOCK held
+    """
+    @wraps(function)
+    def locked(*args, **kwargs):
+        with ANALYSIS_LOCK:
+            return function(*args, **kwargs)
+    return locked
+
+
+@contextmanager
+def tryAnalysisLock():
+    """
+    Hold ANALYSIS_LOCK in the with block if no other thread holds it
+    :return: True if the lock is held, the block must skip its work otherwise
+    """
+    locked = ANALYSIS_LOCK.acquire(blocking=False)
+    try:
+        yield locked
+    finally:
+        if locked:
+            ANALYSIS_LOCK.release()
+
+
+# dict stage name -> seconds filled by timeStage, None when the stages are not timed
+TIMINGS = None
+
+
+@contextmanager
+def timeStage(name):
+    """
+    Add the time spent in the with block to TIMINGS[name], used by Benchmark.py.
+    The stages are also where a task running the analysis reports its progress and stops if it was cancelled
+    """
+    checkCancelled()
+    reportProgress(name)
+    if TIMINGS is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        TIMINGS[name] = TIMINGS.get(name, 0) + time.perf_counter() - start
 
 
 relate_registers = [['RAX', 'EAX', 'AH', 'AL'], ['RBX', 'EBX', 'BH', 'BL'],
@@ -1,7 +1,9 @@
 import logging
+import mmap
 import warnings
 
-from miasm.core.bin_stream import bin_stream_str, bin_stream_elf, bin_stream_pe
+from miasm.core.bin_stream import bin_stream_str, bin_stream_elf, bin_stream_pe, \
+    bin_stream_mmap
 from miasm.jitter.csts import PAGE_READ
 from miasm.core.locationdb import LocationDB
 
@@ -70,9 +72,28 @@ class Container(object):
         @vm: (optional) VmMngr instance to link with the executable
         @addr: (optional) Base address of the parsed binary. If set,
                force the unknown format
+
+        If @stream is a file read from its start, it is also mapped in memory
+        (copy on write, the file is never modified) and the bin_stream reads
+        from this mapping.
         """
+        if "mapped" not in kwargs:
+            kwargs["mapped"] = cls.map_stream(stream)
         return Container.from_string(stream.read(), *args, **kwargs)
 
+    @staticmethod
+    def map_stream(stream):
+        """Return a private mapping of the file @stream, or None if it cannot
+        be mapped
+        """
+        try:
+            if stream.tell() != 0:
+                return None
+            return mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_COPY)
+        except (AttributeError, IOError, OSError, ValueError):
+            # Not a file, or an empty one
+            return None
+
     def parse(self, data, *args, **kwargs):
         """Launch parsing of @data
         @data: str containing the binary
@@ -129,7 +150,13 @@ class Container(object):
 class ContainerPE(Container):
     "Container abstraction for PE"
 
-    def parse(self, data, vm=None, **kwargs):
+    def parse(self, data, vm=None, mapped=None, **kwargs):
+        """Load a PE from @data
+        @data: bytes containing the PE bytes
+        @vm (optional): VmMngr instance. If set, load the PE in virtual memory
+        @mapped (optional): mapping of the file, read by the bin_stream if
+        @vm is not set
+        """
         from miasm.jitter.loader.pe import vm_load_pe, guess_arch
         from miasm.loader import pe_init
 
@@ -156,7 +183,14 @@ class ContainerPE(Container):
 
         # Build the bin_stream instance and set the entry point
         try:
-            self._bin_stream = bin_stream_pe(self._executable)
+            if mapped is not None and vm is None:
+                self._bin_stream = bin_stream_mmap(
+                    mapped,
+                    self._executable.virt.segments(),
+                    endianness=self._executable._sex
+                )
+            else:
+                self._bin_stream = bin_stream_pe(self._executable)
             ep_detected = self._executable.Opthdr.AddressOfEntryPoint
             self._entry_point = self._executable.rva2virt(ep_detected)
         except Exception as error:
@@ -166,12 +200,15 @@ class ContainerPE(Container):
 class ContainerELF(Container):
     "Container abstraction for ELF"
 
-    def parse(self, data, vm=None, addr=0, apply_reloc=False, **kwargs):
+    def parse(self, data, vm=None, addr=0, apply_reloc=False, mapped=None,
+              **kwargs):
         """Load an ELF from @data
         @data: bytes containing the ELF bytes
         @vm (optional): VmMngr instance. If set, load the ELF in virtual memory
         @addr (optional): base address the ELF in virtual memory
         @apply_reloc (optional): if set, apply relocation during ELF loading
+        @mapped (optional): mapping of the file, read by the bin_stream if
+        @vm is not set
 
         @addr and @apply_reloc are only meaningful in the context of a
         non-empty @vm
@@ -204,7 +241,14 @@ class ContainerELF(Container):
 
         # Build the bin_stream instance and set the entry point
         try:
-            self._bin_stream = bin_stream_elf(self._executable)
+            if mapped is not None and vm is None:
+                self._bin_stream = bin_stream_mmap(
+                    mapped,
+                    self._executable.virt.segments(),
+                    endianness=self._executable.sex
+                )
+            else:
+                self._bin_stream = bin_stream_elf(self._executable)
             self._entry_point = self._executable.Ehdr.entry + addr
         except Exception as error:
             raise ContainerParsingException('Cannot read ELF: %s' % error)
@@ -218,7 +262,7 @@ class ContainerELF(Container):
 class ContainerUnknown(Container):
     "Container abstraction for unknown format"
 
-    def parse(self, data, vm=None, addr=0, **kwargs):
+    def parse(self, data, vm=None, addr=0, mapped=None, **kwargs):
         self._bin_stream = bin_stream_str(data, base_address=addr)
         if vm is not None:
             vm.add_memory_page(
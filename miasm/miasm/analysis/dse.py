@@ -332,10 +332,6 @@ class DSEEngine(object):
         # Handle current address
         self.handle(ExprInt(cur_addr, self.ir_arch.IRDst.size))
 
-        # Avoid memory issue in ExpressionSimplifier
-        if len(self.symb.expr_simp.simplified_exprs) > 100000:
-            self.symb.expr_simp.simplified_exprs.clear()
-
         # Get IR blocks
         if cur_addr in self.addr_to_cacheblocks:
             self.ircfg.blocks.clear()
@@ -454,6 +454,16 @@ class additional_info(object):
         self.v_admode = None
         self.prefixed = b''
 
+    def __deepcopy__(self, memo):
+        # Only the groups are mutable, avoid the generic (and slow) deepcopy
+        info = additional_info.__new__(additional_info)
+        info.__dict__.update(self.__dict__)
+        info.g1 = group()
+        info.g1.value = self.g1.value
+        info.g2 = group()
+        info.g2.value = self.g2.value
+        return info
+
 
 class instruction_x86(instruction):
     __slots__ = []
@@ -543,7 +553,10 @@ class instruction_x86(instruction):
         self.additional_info.v_opmode = c.v_opmode()
         self.additional_info.v_admode = c.v_admode()
         self.additional_info.prefix = c.prefix
-        self.additional_info.prefixed = getattr(c, "prefixed", b"")
+        # keep the mandatory prefix bytes, not the decoding field, so that
+        # instructions stay picklable
+        prefixed = getattr(c, "prefixed", None)
+        self.additional_info.prefixed = prefixed.default if prefixed is not None else b""
 
     def __str__(self):
         return self.to_string()
@@ -553,13 +566,13 @@ class instruction_x86(instruction):
         if self.additional_info.g1.value & 1:
             o = "LOCK %s" % o
         if self.additional_info.g1.value & 2:
-            if getattr(self.additional_info.prefixed, 'default', b"") != b"\xF2":
+            if self.additional_info.prefixed != b"\xF2":
                 o = "REPNE %s" % o
         if self.additional_info.g1.value & 8:
-            if getattr(self.additional_info.prefixed, 'default', b"") != b"\xF3":
+            if self.additional_info.prefixed != b"\xF3":
                 o = "REP %s" % o
         elif self.additional_info.g1.value & 4:
-            if getattr(self.additional_info.prefixed, 'default', b"") != b"\xF3":
+            if self.additional_info.prefixed != b"\xF3":
                 o = "REPE %s" % o
         return o
 
@@ -4624,6 +4637,7 @@ addop("endbr64", [pref_f3, bs8(0x0f), bs8(0x1e), bs8(0xfa)])
 addop("endbr32", [pref_f3, bs8(0x0f), bs8(0x1e), bs8(0xfb)])
 
 mn_x86.bintree = factor_one_bit(mn_x86.bintree)
+mn_x86.dispatch_table = compile_dispatch_table(mn_x86.bintree)
 # mn_x86.bintree = factor_fields_all(mn_x86.bintree)
 """
 mod reg r/m
@@ -0,0 +1,155 @@
+"""Index of the address ranges of a binary, looked up by bisection"""
+
+from bisect import bisect_right
+import heapq
+
+
+class AddressSpace(object):
+
+    """Immutable map of non overlapping address ranges [start, stop[ to
+    values.
+
+    It is built once from ranges which may overlap: on overlaps, the first
+    range given wins, like in a linear scan of the ranges. Lookups are then a
+    bisection in the sorted starts instead of a scan.
+    """
+
+    __slots__ = ("starts", "stops", "values")
+
+    def __init__(self, ranges=()):
+        """
+        @ranges: iterable of (start, stop, value), by decreasing priority.
+        Empty ranges are ignored
+        """
+        self.starts = []
+        self.stops = []
+        self.values = []
+        for start, stop, value in self._flatten(ranges):
+            self.starts.append(start)
+            self.stops.append(stop)
+            self.values.append(value)
+
+    @staticmethod
+    def _flatten(ranges):
+        """Yield the sorted non overlapping (start, stop, value) covered by
+        @ranges, see __init__"""
+        ranges = [
+            (start, stop, priority, value)
+            for priority, (start, stop, value) in enumerate(ranges)
+            if start < stop
+        ]
+        ranges.sort(key=lambda item: item[0])
+        bounds = sorted(set(
+            bound for start, stop, _, _ in ranges for bound in (start, stop)
+        ))
+        # Ranges containing the current bound, by priority. The priorities
+        # are unique, values are never compared
+        active = []
+        index = 0
+        current = None
+        for low, high in zip(bounds, bounds[1:]):
+            while index < len(ranges) and ranges[index][0] <= low:
+                start, stop, priority, value = ranges[index]
+                heapq.heappush(active, (priority, stop, value))
+                index += 1
+            while active and active[0][1] <= low:
+                heapq.heappop(active)
+            if not active:
+                continue
+            priority, _, value = active[0]
+            if current is not None:
+                if current[1] == low and current[3] == priority:
+                    current[1] = high
+                    continue
+                yield tuple(current[:3])
+            current = [low, high, value, priority]
+        if current is not None:
+            yield tuple(current[:3])
+
+    @classmethod
+    def from_segments(cls, segments, file_len=None):
+        """Build the AddressSpace of a file mapped in memory
+        @segments: iterable of (address, size, file_offset, file_size),
+        by decreasing priority: @size bytes mapped at @address, the
+        @file_size first ones are read from the file at @file_offset, the
+        others are zeros
+        @file_len: (optional) length of the file, bytes past its end are zeros
+
+        Each address is mapped to (address, file_offset) of its range, or to
+        (address, None) in ranges of zeros.
+        """
+        ranges = []
+        for address, size, file_offset, file_size in segments:
+            file_size = min(file_size, size)
+            if file_len is not None:
+                file_size = min(file_size, file_len - file_offset)
+            file_size = max(0, file_size)
+            ranges.append(
+                (address, address + file_size, (address, file_offset))
+            )
+            ranges.append(
+                (address + file_size, address + size,
+                 (address + file_size, None))
+            )
+        return cls(ranges)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __iter__(self):
+        return iter(zip(self.starts, self.stops, self.values))
+
+    def __repr__(self):
+        return "<%s %s>" % (
+            self.__class__.__name__,
+            " ".join("[0x%x 0x%x[" % (start, stop)
+                     for start, stop, _ in self)
+        )
+
+    def find(self, address):
+        """Return the position of the range containing @address, or -1"""
+        index = bisect_right(self.starts, address) - 1
+        if index >= 0 and address < self.stops[index]:
+            return index
+        return -1
+
+    def __contains__(self, address):
+        return self.find(address) != -1
+
+    def get(self, address, default=None):
+        """Return the value of the range containing @address, or @default"""
+        index = bisect_right(self.starts, address) - 1
+        if index >= 0 and address < self.stops[index]:
+            return self.values[index]
+        return default
+
+    def range(self, address):
+        """Return the (start, stop, value) containing @address, or None"""
+        index = self.find(address)
+        if index == -1:
+            return None
+        return self.starts[index], self.stops[index], self.values[index]
+
+    def cover(self, start, stop):
+        """Return the list of (start, stop, value) pieces of [@start, @stop[,
+        or None if some addresses of it are not mapped"""
+        pieces = []
+        index = bisect_right(self.starts, start) - 1
+        while start < stop:
+            if index < 0 or index >= len(self.starts):
+                return None
+            if not self.starts[index] <= start < self.stops[index]:
+                return None
+            end = min(stop, self.stops[index])
+            pieces.append((start, end, self.values[index]))
+            start = end
+            index += 1
+        return pieces
+
+    @property
+    def min_addr(self):
+        return self.starts[0] if self.starts else None
+
+    @property
+    def max_addr(self):
+        return self.stops[-1] if self.stops else None
@@ -5,6 +5,7 @@ from builtins import range
 import logging
 import warnings
 from collections import namedtuple
+from timeit import default_timer
 from builtins import int as int_types
 
 from future.utils import viewitems, viewvalues
@@ -13,7 +14,7 @@ from miasm.expression.expression import ExprId, ExprInt, get_expr_locs
 from miasm.expression.expression import LocKey
 from miasm.expression.simplifications import expr_simp
 from miasm.expression.modint import moduint, modint
-from miasm.core.utils import Disasm_Exception, pck
+from miasm.core.utils import BoundedDict, Disasm_Exception, pck
 from miasm.core.graph import DiGraph, DiGraphSimplifier, MatchGraphJoker
 from miasm.core.interval import interval
 from miasm.core.locationdb import LocationDB
@@ -1333,6 +1334,102 @@ def asm_resolve_final(mnemo, asmcfg, loc_db, dst_interval=None):
     return patches
 
 
+class DecodedInstrCache(object):
+
+    """Cache of the instructions decoded from a bytes source, keyed by offset
+    and mode (attrib).
+
+    It can be shared by every disassembler reading the same source, for
+    instance disasmEngine instances and a jitter. Returned instructions are
+    copies, callers may modify them. Writes to the bytes source must be
+    reported with invalidate().
+    """
+
+    def __init__(self, arch, max_size=1 << 18):
+        """
+        @arch: architecture (cls_mn) used to decode the instructions
+        @max_size: (optional) maximum number of cached instructions
+        """
+        self.arch = arch
+        self.max_size = max_size
+        self.reset_stats()
+        self.clear()
+
+    def clear(self):
+        """Forget every decoded instruction"""
+        # (offset, mode) -> decoded instruction, failures are not kept
+        self._instrs = BoundedDict(self.max_size)
+        self._modes = set()
+
+    def reset_stats(self):
+        """Reset the hits, misses and timing counters"""
+        self.hits = 0
+        self.misses = 0
+        self.decode_time = 0.
+        self.total_time = 0.
+
+    def stats(self):
+        """Return the counters of the cache as a dict:
+         - hits, misses, size: lookups and number of cached entries
+         - decode_time, total_time: seconds spent decoding the misses, and
+           serving all the requests
+         - decode_rate: instructions decoded per second on misses
+         - instrs_per_sec: instructions served per second
+        """
+        served = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self._instrs),
+            'decode_time': self.decode_time,
+            'total_time': self.total_time,
+            'decode_rate': self.misses / self.decode_time if self.decode_time else 0.,
+            'instrs_per_sec': served / self.total_time if self.total_time else 0.,
+        }
+
+    def dis(self, bin_stream, mode, offset):
+        """Return the instruction at @offset of @bin_stream in @mode, as
+        arch.dis would
+        @bin_stream: bin_stream instance
+        @mode: architecture attribute
+        @offset: offset of the instruction
+        """
+        start = default_timer()
+        key = (offset, mode)
+        instr = self._instrs.get(key)
+        if instr is None:
+            self.misses += 1
+            try:
+                instr = self.arch.dis(bin_stream, mode, offset)
+            finally:
+                self.decode_time += default_timer() - start
+            self._instrs[key] = instr
+            self._modes.add(mode)
+        else:
+            self.hits += 1
+        instr = instr.copy()
+        self.total_time += default_timer() - start
+        return instr
+
+    def invalidate(self, start, stop):
+        """Forget the instructions overlapping the bytes [@start, @stop[
+        @start: first offset written
+        @stop: offset following the last written one
+        """
+        instrs = self._instrs
+        first = start - self.arch.max_instruction_len + 1
+        if (stop - first) * len(self._modes) < len(instrs):
+            keys = [(offset, mode)
+                    for offset in range(first, stop)
+                    for mode in self._modes
+                    if (offset, mode) in instrs]
+        else:
+            keys = [key for key in instrs if first <= key[0] < stop]
+        for key in keys:
+            if key[0] + instrs.data[key].l > start:
+                del instrs[key]
+
+
 class disasmEngine(object):
 
     """Disassembly engine, taking care of disassembler options and mutli-block
@@ -1359,6 +1456,9 @@ class disasmEngine(object):
     + callback(arch, attrib, pool_bin, cur_bloc, offsets_to_dis,
                loc_db)
      - dis_block_callback: callback after each new disassembled block
+
+    + DecodedInstrCache instance
+     - instr_cache: decode the instructions through this cache
     """
 
     def __init__(self, arch, attrib, bin_stream, **kwargs):
@@ -1383,6 +1483,7 @@ class disasmEngine(object):
         self.dis_block_callback = None
         self.dont_dis_nulstart_bloc = False
         self.dont_dis_retcall_funcs = set()
+        self.instr_cache = None
 
         # Override options if needed
         self.__dict__.update(kwargs)
@@ -1463,7 +1564,10 @@ class disasmEngine(object):
             off_i = offset
             error = None
             try:
-                instr = self.arch.dis(self.bin_stream, self.attrib, offset)
+                if self.instr_cache is not None:
+                    instr = self.instr_cache.dis(self.bin_stream, self.attrib, offset)
+                else:
+                    instr = self.arch.dis(self.bin_stream, self.attrib, offset)
             except Disasm_Exception as e:
                 log_asmblock.warning(e)
                 instr = None
@@ -1570,16 +1674,20 @@ class disasmEngine(object):
         warnings.warn('DEPRECATION WARNING: use "dis_block" instead of "dis_bloc"')
         return self.dis_block(offset)
 
-    def dis_multiblock(self, offset, blocks=None):
+    def dis_multiblock(self, offset, blocks=None, job_done=None):
         """Disassemble every block reachable from @offset regarding
         specific disasmEngine conditions
         Return an AsmCFG instance containing disassembled blocks
         @offset: starting offset
         @blocks: (optional) AsmCFG instance of already disassembled blocks to
                 merge with
+        @job_done: (optional) set of already disassembled offsets, the
+                disassembly stops when it reaches one of them. It is updated
+                with the newly disassembled offsets
         """
         log_asmblock.info("dis bloc all")
-        job_done = set()
+        if job_done is None:
+            job_done = set()
         if blocks is None:
             blocks = AsmCFG(self.loc_db)
         todo = [offset]
@@ -16,12 +16,15 @@
 # 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
 #
 
+from bisect import bisect_right
 from builtins import str
 from future.utils import PY3
 
 from miasm.core.utils import BIG_ENDIAN, LITTLE_ENDIAN
 from miasm.core.utils import upck8le, upck16le, upck32le, upck64le
 from miasm.core.utils import upck8be, upck16be, upck32be, upck64be
+from miasm.core.utils import encode_hex
+from miasm.core.address_space import AddressSpace
 
 
 class bin_stream(object):
@@ -271,6 +274,127 @@ class bin_stream_container(bin_stream):
         self.offset = val
 
 
+    def setbytes(self, start, data):
+        """Write @data at address @start"""
+        self.bin.virt.set(start, data)
+
+
+class bin_stream_mmap(bin_stream):
+
+    """bin_stream over the bytes of a file, usually a mmap, mapped at virtual
+    addresses by a table of segments.
+
+    Addresses are translated by a bisection in the AddressSpace of the
+    segments and the bytes are read through a memoryview, without going
+    through the executable's virtual view.
+    """
+
+    def __init__(self, data, segments, offset=0, endianness=LITTLE_ENDIAN):
+        """
+        @data: buffer of the file (mmap, bytes, bytearray). It must be
+        writable for setbytes
+        @segments: list of (address, size, file_offset, file_size): @size
+        bytes mapped at @address, the @file_size first ones are read from
+        @data at @file_offset, the others are zeros. On overlaps, the first
+        segment wins
+        """
+        bin_stream.__init__(self)
+        self.endianness = endianness
+        self.bin = data
+        self.view = memoryview(data)
+        self.offset = offset
+        self.space = AddressSpace.from_segments(segments, len(self.view))
+        self.l = self.space.max_addr or 0
+
+    def _getview(self, start, l):
+        """Return the bytes [@start, @start + @l[ as a memoryview or bytes"""
+        space = self.space
+        index = bisect_right(space.starts, start) - 1
+        if index >= 0 and start + l <= space.stops[index]:
+            # Fast path: inside one segment
+            seg_start, file_offset = space.values[index]
+            if file_offset is None:
+                return b"\x00" * l
+            file_offset += start - seg_start
+            return self.view[file_offset:file_offset + l]
+        # Read across segments, which must be contiguous
+        pieces = space.cover(start, start + l)
+        if pieces is None:
+            raise IOError("cannot get bytes")
+        out = []
+        for piece_start, piece_stop, (seg_start, file_offset) in pieces:
+            if file_offset is None:
+                out.append(b"\x00" * (piece_stop - piece_start))
+            else:
+                file_offset += piece_start - seg_start
+                out.append(
+                    self.view[
+                        file_offset:file_offset + piece_stop - piece_start
+                    ].tobytes()
+                )
+        return b"".join(out)
+
+    def _getbytes(self, start, l=1):
+        data = self._getview(start, l)
+        if isinstance(data, memoryview):
+            return data.tobytes()
+        return data
+
+    def getbytes(self, start, l=1):
+        # The bytes only change with setbytes, the atomic mode cache is
+        # useless
+        return self._getbytes(start, l)
+
+    def getbits(self, start, n):
+        """Return the bits from the bit stream
+        @start: the offset in bits
+        @n: number of bits to read
+        """
+        if n == 0:
+            return 0
+        byte_start = start // 8
+        byte_stop = (start + n + 7) // 8
+        data = self._getview(byte_start, byte_stop - byte_start)
+        if PY3:
+            value = int.from_bytes(data, "big")
+        else:
+            value = int(encode_hex(bytes(data)), 16)
+        return (value >> (byte_stop * 8 - start - n)) & ((1 << n) - 1)
+
+    def setbytes(self, start, data):
+        """Write @data at address @start, in the buffer only"""
+        pieces = self.space.cover(start, start + len(data))
+        if pieces is None or any(
+                file_offset is None for _, _, (_, file_offset) in pieces):
+            raise IOError("cannot set bytes")
+        pos = 0
+        for piece_start, piece_stop, (seg_start, file_offset) in pieces:
+            file_offset += piece_start - seg_start
+            length = piece_stop - piece_start
+            self.view[file_offset:file_offset + length] = data[pos:pos + length]
+            pos += length
+
+    def is_addr_in(self, ad):
+        return ad in self.space
+
+    def getlen(self):
+        return self.l
+
+    def readbs(self, l=1):
+        if self.offset + l > self.l:
+            raise IOError("not enough bytes")
+        if self.offset < 0:
+            raise IOError("Negative offset")
+        self.offset += l
+        return self._getbytes(self.offset - l, l)
+
+    def __bytes__(self):
+        return self._getbytes(self.offset, self.l - self.offset)
+
+    def setoffset(self, val):
+        self.offset = val
+
+
 class bin_stream_pe(bin_stream_container):
     def __init__(self, binary, *args, **kwargs):
         super(bin_stream_pe, self).__init__(binary, *args, **kwargs)
@@ -1,8 +1,10 @@
 #-*- coding:utf-8 -*-
 
 from builtins import range
+import copy
 import re
 import struct
+import types
 import logging
 from collections import defaultdict
 
@@ -825,6 +827,66 @@ def factor_one_bit(tree):
     return new_keys
 
 
+def walk_dispatch(todo, value, nbits):
+    """Walk the bintree branches of @todo as guess_mnemo would, knowing only
+    the first @nbits bits of the instruction, given by @value
+    @todo: list of (fname_set, branch, offset_b), see compile_dispatch_table
+    Return (candidates, frontier)
+    """
+    candidates = set()
+    frontier = []
+    for fname_set, branch, offset_b in todo:
+        (l, fmask, fbits, fname, flen), vals = branch
+        if flen is not None or (l is not None and offset_b + l > nbits):
+            frontier.append((fname_set, branch, offset_b))
+            continue
+        if l is not None:
+            v = (value >> (nbits - offset_b - l)) & ((1 << l) - 1)
+            offset_b += l
+            if v & fmask != fbits:
+                continue
+            if fname is not None:
+                fname_set = fname_set + [(fname, v)]
+        for nb, v in viewitems(vals):
+            if 'mn' in nb:
+                candidates.update(v)
+            else:
+                todo.append((fname_set, (nb, v), offset_b))
+    return candidates, frontier
+
+
+def compile_dispatch_table(tree, nbits=8, max_frontier=8):
+    """Partially walk the bintree @tree for every value of the first @nbits
+    bits of an instruction, as guess_mnemo would.
+
+    Return a list indexed by those bits of (candidates, frontier, subtable):
+     - candidates: set of mnemonics already matched
+     - frontier: list of (fname_set, branch, offset_b) from which
+       guess_mnemo must go on. fname_set is the list of (fname, value) to
+       record in order if the field is not already known, branch the next
+       node of the tree and its sons, offset_b the bits consumed before it
+     - subtable: None, or if the frontier has more than @max_frontier
+       branches (for instance two bytes opcodes), the list of (candidates,
+       frontier) indexed by the next @nbits bits
+    The walk stops on nodes whose length depends on the decoded fields (flen)
+    or which need more bits.
+    """
+    table = []
+    roots = [([], branch, 0) for branch in viewitems(tree)]
+    for value in range(1 << nbits):
+        candidates, frontier = walk_dispatch(list(roots), value, nbits)
+        subtable = None
+        if len(frontier) > max_frontier:
+            subtable = []
+            for next_value in range(1 << nbits):
+                sub_candidates, sub_frontier = walk_dispatch(
+                    list(frontier), (value << nbits) | next_value, 2 * nbits
+                )
+                subtable.append((frozenset(sub_candidates), tuple(sub_frontier)))
+        table.append((frozenset(candidates), tuple(frontier), subtable))
+    return table
+
+
 def factor_fields(tree):
     if not isinstance(tree, dict):
         return tree
@@ -992,6 +1054,30 @@ class instruction(object):
         self.l = None
         self.b = None
 
+    def __getstate__(self):
+        # Architectures may shadow a slot with a class constant (ie
+        # delayslot), which must not be restored on the instance
+        state = {}
+        for name in instruction.__slots__:
+            if not isinstance(getattr(type(self), name), types.MemberDescriptorType):
+                continue
+            if hasattr(self, name):
+                state[name] = getattr(self, name)
+        return state
+
+    def __setstate__(self, state):
+        for name, value in viewitems(state):
+            setattr(self, name, value)
+
+    def copy(self):
+        """Return a copy of the instruction which can be modified (arguments,
+        additional info) without altering this one"""
+        new = self.__class__.__new__(self.__class__)
+        new.__setstate__(self.__getstate__())
+        new.args = list(self.args)
+        new.additional_info = copy.deepcopy(self.additional_info)
+        return new
+
     def gen_args(self, args):
         out = ', '.join([str(x) for x in args])
         return out
@@ -1069,18 +1155,49 @@ class cls_mn(with_metaclass(metamn, object)):
     instruction = instruction
     # Block's offset alignment
     alignment = 1
+    # Optional table built by compile_dispatch_table, indexed by the first
+    # dispatch_bits bits of an instruction
+    dispatch_table = None
+    dispatch_bits = 8
 
     @classmethod
     def guess_mnemo(cls, bs, attrib, pre_dis_info, offset):
-        candidates = []
-
         candidates = set()
 
         fname_values = pre_dis_info
-        todo = [
-            (dict(fname_values), branch, offset * 8)
-            for branch in list(viewitems(cls.bintree))
-        ]
+        offset_b = offset * 8
+        value = None
+        if cls.dispatch_table is not None:
+            try:
+                value = cls.getbits(bs, attrib, offset_b, cls.dispatch_bits)
+            except IOError:
+                # Not enough bytes for the table, walk the whole tree
+                pass
+        if value is None:
+            todo = [
+                (dict(fname_values), branch, offset_b)
+                for branch in list(viewitems(cls.bintree))
+            ]
+        else:
+            # Resume the walk where the table stopped
+            direct, frontier, subtable = cls.dispatch_table[value]
+            candidates.update(direct)
+            if subtable is not None:
+                try:
+                    value = cls.getbits(bs, attrib, offset_b + cls.dispatch_bits,
+                                        cls.dispatch_bits)
+                except IOError:
+                    pass
+                else:
+                    direct, frontier = subtable[value]
+                    candidates.update(direct)
+            todo = []
+            for fname_set, branch, branch_b in frontier:
+                branch_values = dict(fname_values)
+                for fname, v in fname_set:
+                    if not fname in branch_values:
+                        branch_values[fname] = v
+                todo.append((branch_values, branch, offset_b + branch_b))
         for fname_values, branch, offset_b in todo:
             (l, fmask, fbits, fname, flen), vals = branch
 
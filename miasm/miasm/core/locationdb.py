@@ -1,5 +1,7 @@
+import threading
 import warnings
 from builtins import int as int_types
+from functools import wraps
 
 from functools import reduce
 from future.utils import viewitems, viewvalues
@@ -9,6 +11,20 @@ from miasm.expression.expression import LocKey, ExprLoc
 from miasm.expression.modint import moduint, modint
 
 
+# Serializes the changes of the LocationDB, locations may be added from several
+# threads: a lookup and the insertion it decides must not be interleaved
+_loc_db_lock = threading.RLock()
+
+
+def _locked(method):
+    """Run @method with _loc_db_lock held"""
+    @wraps(method)
+    def locked_method(*args, **kwargs):
+        with _loc_db_lock:
+            return method(*args, **kwargs)
+    return locked_method
+
+
 def is_int(a):
     return isinstance(a, (int_types, moduint, modint))
 
@@ -93,6 +109,7 @@ class LocationDB(object):
         name = force_bytes(name)
         return self._name_to_loc_key.get(name)
 
+    @_locked
     def get_or_create_name_location(self, name):
         """
         Return the LocKey of @name if any, create one otherwise.
@@ -111,6 +128,7 @@ class LocationDB(object):
         """
         return self._offset_to_loc_key.get(offset)
 
+    @_locked
     def get_or_create_offset_location(self, offset):
         """
         Return the LocKey of @offset if any, create one otherwise.
@@ -132,6 +150,7 @@ class LocationDB(object):
             return None
         return self.get_location_offset(loc_key)
 
+    @_locked
     def add_location_name(self, loc_key, name):
         """Associate a name @name to a given @loc_key
         @name: str instance
@@ -146,6 +165,7 @@ class LocationDB(object):
         self._loc_key_to_names.setdefault(loc_key, set()).add(name)
         self._name_to_loc_key[name] = loc_key
 
+    @_locked
     def remove_location_name(self, loc_key, name):
         """Disassociate a name @name from a given @loc_key
         Fail if @name is not already associated to @loc_key
@@ -163,6 +183,7 @@ class LocationDB(object):
         del self._name_to_loc_key[name]
         self._loc_key_to_names[loc_key].remove(name)
 
+    @_locked
     def set_location_offset(self, loc_key, offset, force=False):
         """Associate the offset @offset to an LocKey @loc_key
 
@@ -188,6 +209,7 @@ class LocationDB(object):
         self._offset_to_loc_key[offset] = loc_key
         self._loc_key_to_offset[loc_key] = offset
 
+    @_locked
     def unset_location_offset(self, loc_key):
         """Disassociate LocKey @loc_key's offset
 
@@ -231,6 +253,7 @@ class LocationDB(object):
                 return new_name
             i += 1
 
+    @_locked
     def add_location(self, name=None, offset=None, strict=True):
         """Add a new location in the locationDB. Returns the corresponding LocKey.
         If @name is set, also associate a name to this new location.
@@ -314,6 +337,7 @@ class LocationDB(object):
 
         return loc_key
 
+    @_locked
     def remove_location(self, loc_key):
         """
         Delete the location corresponding to @loc_key
@@ -377,6 +401,7 @@ class LocationDB(object):
             )
         return "\n".join(out)
 
+    @_locked
     def merge(self, location_db):
         """Merge with another LocationDB @location_db
 
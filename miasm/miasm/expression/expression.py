@@ -31,7 +31,10 @@
 
 from builtins import zip
 from builtins import range
+import collections
+import threading
 import warnings
+import weakref
 import itertools
 import ctypes
 from builtins import int as int_types
@@ -186,14 +189,37 @@ class LocKey(object):
 
 # IR definitions
 
+# Number of recently created expressions kept alive by Expr.get_object
+RECENT_EXPRS = 1 << 16
+
+# Serializes the insertions in the intern table, expressions may be built by
+# several threads. Reentrant: a dead expression may be forgotten by the thread
+# interning another one
+_intern_lock = threading.RLock()
+
+
+def _forget_expr(ref):
+    "Remove a dead expression from the intern table"
+    # Module globals may already be cleared at interpreter exit
+    if Expr is None or _intern_lock is None:
+        return
+    with _intern_lock:
+        if Expr.args2expr.get(ref.key) is ref:
+            del Expr.args2expr[ref.key]
+
+
 class Expr(object):
 
     "Parent class for Miasm Expressions"
 
-    __slots__ = ["_hash", "_repr", "_size"]
+    __slots__ = ["_hash", "_repr", "_size", "_is_canon", "__weakref__"]
 
+    # Interned expressions: (class, args) -> weak reference to the expression.
+    # An expression leaves the table when its last user releases it, the
+    # last RECENT_EXPRS created ones are kept alive so that the temporaries
+    # built again and again by the simplifications are still shared
     args2expr = {}
-    canon_exprs = set()
+    recent_exprs = collections.deque(maxlen=RECENT_EXPRS)
     use_singleton = True
 
     def set_size(self, _):
@@ -215,20 +241,41 @@ class Expr(object):
     @staticmethod
     def get_object(expr_cls, args):
         if not expr_cls.use_singleton:
-            return object.__new__(expr_cls)
+            expr = object.__new__(expr_cls)
+            expr._is_canon = False
+            return expr
 
-        expr = Expr.args2expr.get((expr_cls, args))
-        if expr is None:
+        key = (expr_cls, args)
+        ref = Expr.args2expr.get(key)
+        if ref is not None:
+            expr = ref()
+            if expr is not None:
+                return expr
+        with _intern_lock:
+            # Another thread may have interned it meanwhile
+            ref = Expr.args2expr.get(key)
+            if ref is not None:
+                expr = ref()
+                if expr is not None:
+                    return expr
             expr = object.__new__(expr_cls)
-            Expr.args2expr[(expr_cls, args)] = expr
+            expr._is_canon = False
+            Expr.args2expr[key] = weakref.KeyedRef(expr, _forget_expr, key)
+            Expr.recent_exprs.append(expr)
         return expr
 
+    @staticmethod
+    def release_recent():
+        """Stop keeping the recently created expressions alive, so that the
+        memory of the expressions which are not used anymore is reclaimed"""
+        Expr.recent_exprs.clear()
+
     def get_is_canon(self):
-        return self in Expr.canon_exprs
+        return self._is_canon
 
     def set_is_canon(self, value):
         assert value is True
-        Expr.canon_exprs.add(self)
+        self._is_canon = True
 
     is_canon = property(get_is_canon, set_is_canon)
 
@@ -455,7 +502,7 @@ class ExprInt(Expr):
      - Constant 0x12345678 on 32bits
      """
 
-    __slots__ = Expr.__slots__ + ["_arg"]
+    __slots__ = ["_arg"]
 
 
     def __init__(self, arg, size):
@@ -588,7 +635,7 @@ class ExprId(Expr):
      - variable v1
      """
 
-    __slots__ = Expr.__slots__ + ["_name"]
+    __slots__ = ["_name"]
 
     def __init__(self, name, size=None):
         """Create an identifier
@@ -656,7 +703,7 @@ class ExprLoc(Expr):
     """An ExprLoc represent a Label in Miasm IR.
     """
 
-    __slots__ = Expr.__slots__ + ["_loc_key"]
+    __slots__ = ["_loc_key"]
 
     def __init__(self, loc_key, size):
         """Create an identifier
@@ -721,7 +768,7 @@ class ExprAssign(Expr):
      - var1 <- 2
     """
 
-    __slots__ = Expr.__slots__ + ["_dst", "_src"]
+    __slots__ = ["_dst", "_src"]
 
     def __init__(self, dst, src):
         """Create an ExprAssign for dst <- src
@@ -836,7 +883,7 @@ class ExprCond(Expr):
      - if (cond) then ... else ...
     """
 
-    __slots__ = Expr.__slots__ + ["_cond", "_src1", "_src2"]
+    __slots__ = ["_cond", "_src1", "_src2"]
 
     def __init__(self, cond, src1, src2):
         """Create an ExprCond
@@ -931,7 +978,7 @@ class ExprMem(Expr):
      - Memory write
     """
 
-    __slots__ = Expr.__slots__ + ["_ptr"]
+    __slots__ = ["_ptr"]
 
     def __init__(self, ptr, size=None):
         """Create an ExprMem
@@ -1034,7 +1081,7 @@ class ExprOp(Expr):
      - parity bit(var1)
     """
 
-    __slots__ = Expr.__slots__ + ["_op", "_args"]
+    __slots__ = ["_op", "_args"]
 
     def __init__(self, op, *args):
         """Create an ExprOp
@@ -1213,7 +1260,7 @@ class ExprOp(Expr):
 
 class ExprSlice(Expr):
 
-    __slots__ = Expr.__slots__ + ["_arg", "_start", "_stop"]
+    __slots__ = ["_arg", "_start", "_stop"]
 
     def __init__(self, arg, start, stop):
 
@@ -1308,7 +1355,7 @@ class ExprCompose(Expr):
     Compose is like a hamburger. It concatenate Expressions
     """
 
-    __slots__ = Expr.__slots__ + ["_args"]
+    __slots__ = ["_args"]
 
     def __init__(self, *args):
         """Create an ExprCompose
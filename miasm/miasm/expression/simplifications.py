@@ -2,7 +2,9 @@
 #                     Simplification methods library                           #
 #                                                                              #
 
+import collections
 import logging
+import threading
 
 from future.utils import viewitems
 
@@ -21,6 +23,9 @@ console_handler.setFormatter(logging.Formatter("%(levelname)-5s: %(message)s"))
 log_exprsimp.addHandler(console_handler)
 log_exprsimp.setLevel(logging.WARNING)
 
+# Default number of expressions remembered by an ExpressionSimplifier
+SIMP_CACHE_SIZE = 1 << 16
+
 
 class ExpressionSimplifier(object):
 
@@ -114,9 +119,18 @@ class ExpressionSimplifier(object):
     }
 
 
-    def __init__(self):
+    def __init__(self, cache_size=SIMP_CACHE_SIZE):
+        """
+        @cache_size: maximum number of expressions kept in the memo of
+        simplified expressions, the least recently used are dropped first
+        """
         self.expr_simp_cb = {}
-        self.simplified_exprs = set()
+        # Expr => its stable simplified form, in least recently used order
+        self.simp_cache = collections.OrderedDict()
+        # Serializes the changes of the memo, which may be shared by threads
+        self.cache_lock = threading.Lock()
+        self.cache_size = cache_size
+        self.reset_stats()
 
     def enable_passes(self, passes):
         """Add passes from @passes
@@ -126,10 +140,58 @@ class ExpressionSimplifier(object):
         """
 
         # Clear cache of simplifiied expressions when adding a new pass
-        self.simplified_exprs.clear()
+        self.clear_cache()
 
         for k, v in viewitems(passes):
             self.expr_simp_cb[k] = fast_unify(self.expr_simp_cb.get(k, []) + v)
+            for simp_func in self.expr_simp_cb[k]:
+                self.pass_stats.setdefault(simp_func, [0, 0])
+
+    def clear_cache(self):
+        """Forget the memoized simplifications"""
+        with self.cache_lock:
+            self.simp_cache.clear()
+
+    def reset_stats(self):
+        """Reset the memo and passes counters"""
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.cache_evictions = 0
+        # simp_func => [calls, rewrites]
+        self.pass_stats = {}
+        for simp_funcs in self.expr_simp_cb.values():
+            for simp_func in simp_funcs:
+                self.pass_stats[simp_func] = [0, 0]
+
+    def stats(self):
+        """Return the counters of the memo and of each pass as a dict:
+         - hits, misses, evictions: lookups of the memo
+         - size, max_size: current and maximum number of memoized expressions
+         - passes: {pass name: {'calls': int, 'rewrites': int}}, a rewrite
+           being a call which changed the expression
+        """
+        passes = {}
+        for simp_func, (calls, rewrites) in viewitems(self.pass_stats):
+            passes[simp_func.__name__] = {'calls': calls, 'rewrites': rewrites}
+        return {
+            'hits': self.cache_hits,
+            'misses': self.cache_misses,
+            'evictions': self.cache_evictions,
+            'size': len(self.simp_cache),
+            'max_size': self.cache_size,
+            'passes': passes,
+        }
+
+    def cache_simplified(self, expressions, e_new):
+        """Remember that each of @expressions simplifies to @e_new"""
+        cache = self.simp_cache
+        with self.cache_lock:
+            for expression in expressions:
+                cache[expression] = e_new
+            cache[e_new] = e_new
+            while len(cache) > self.cache_size:
+                cache.popitem(last=False)
+                self.cache_evictions += 1
 
     def apply_simp(self, expression):
         """Apply enabled simplifications on expression
@@ -138,14 +200,19 @@ class ExpressionSimplifier(object):
 
         cls = expression.__class__
         debug_level = log_exprsimp.level >= logging.DEBUG
+        pass_stats = self.pass_stats
         for simp_func in self.expr_simp_cb.get(cls, []):
             # Apply simplifications
             before = expression
             expression = simp_func(self, expression)
             after = expression
 
-            if debug_level and before != after:
-                log_exprsimp.debug("[%s] %s => %s", simp_func, before, after)
+            counters = pass_stats[simp_func]
+            counters[0] += 1
+            if before is not after:
+                counters[1] += 1
+                if debug_level and before != after:
+                    log_exprsimp.debug("[%s] %s => %s", simp_func, before, after)
 
             # If class changes, stop to prevent wrong simplifications
             if expression.__class__ is not cls:
@@ -158,10 +225,19 @@ class ExpressionSimplifier(object):
         @expression: Expr instance
         Return an Expr instance"""
 
-        if expression in self.simplified_exprs:
-            return expression
+        e_new = self.simp_cache.get(expression)
+        if e_new is not None:
+            self.cache_hits += 1
+            # Move to the most recently used end, unless another thread
+            # evicted it meanwhile
+            with self.cache_lock:
+                if expression in self.simp_cache:
+                    self.simp_cache.move_to_end(expression)
+            return e_new
+        self.cache_misses += 1
 
         # Find a stable state
+        seen = [expression]
         while True:
             # Canonize and simplify
             e_new = self.apply_simp(expression.canonize())
@@ -170,25 +246,32 @@ class ExpressionSimplifier(object):
 
             # Launch recursivity
             expression = self.expr_simp_wrapper(e_new)
-            self.simplified_exprs.add(expression)
+            seen.append(expression)
         # Mark expression as simplified
-        self.simplified_exprs.add(e_new)
+        self.cache_simplified(seen, e_new)
 
         return e_new
 
+    def is_simplified(self, expression):
+        """Return True if @expression is known to be in a stable state"""
+        return self.simp_cache.get(expression) is expression
+
     def expr_simp_wrapper(self, expression, callback=None):
         """Apply enabled simplifications on expression
         @expression: Expr instance
         @manual_callback: If set, call this function instead of normal one
         Return an Expr instance"""
 
-        if expression in self.simplified_exprs:
+        if self.is_simplified(expression):
             return expression
 
         if callback is None:
             callback = self.expr_simp
 
-        return expression.visit(callback, lambda e: e not in self.simplified_exprs)
+        return expression.visit(
+            callback,
+            lambda e: not self.is_simplified(e)
+        )
 
     def __call__(self, expression, callback=None):
         "Wrapper on expr_simp_wrapper"
@@ -21,7 +21,7 @@ import warnings
 
 from future.utils import viewvalues
 
-from miasm.core.asmblock import disasmEngine, AsmBlockBad
+from miasm.core.asmblock import disasmEngine, AsmBlockBad, DecodedInstrCache
 from miasm.core.interval import interval
 from miasm.core.utils import BoundedDict
 from miasm.expression.expression import LocKey
@@ -70,6 +70,7 @@ class JitCore(object):
             follow_call=False,
             dontdis_retcall=False,
             split_dis=self.split_dis,
+            instr_cache=DecodedInstrCache(ir_arch.arch),
         )
 
 
@@ -82,6 +83,7 @@ class JitCore(object):
         self.offset_to_jitted_func.clear()
         self.loc_key_to_block.clear()
         self.blocks_mem_interval = interval()
+        self.mdis.instr_cache.clear()
 
     def add_disassembly_splits(self, *args):
         """The disassembly engine will stop on address in args if they
@@ -259,6 +261,9 @@ class JitCore(object):
             # Remove label -> block link
             del(self.loc_key_to_block[block.loc_key])
 
+            # Its bytes are not monitored anymore, decode them again
+            self.mdis.instr_cache.invalidate(block.ad_min, block.ad_max)
+
         return modified_blocks
 
     def updt_automod_code_range(self, vm, mem_range):
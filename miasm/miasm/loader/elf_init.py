@@ -7,6 +7,7 @@ import struct
 
 from future.utils import PY3, with_metaclass
 
+from miasm.core.address_space import AddressSpace
 from miasm.core.utils import force_bytes
 from miasm.loader import cstruct
 from miasm.loader import elf
@@ -534,6 +535,7 @@ class SHList(object):
     def append(self, item):
         self.do_add_section(item)
         self.shlist.append(item)
+        self.parent.invalidate_section_spaces()
 
     def __getitem__(self, item):
         return self.shlist[item]
@@ -557,6 +559,7 @@ class SHList(object):
         return bytes(self)
 
     def resize(self, sec, diff):
+        self.parent.invalidate_section_spaces()
         for s in self.shlist:
             if s.sh.offset > sec.sh.offset:
                 s.sh.offset += diff
@@ -647,6 +650,7 @@ class PHList(object):
         return self.__bytes__(self)
 
     def resize(self, sec, diff):
+        self.parent.invalidate_section_spaces()
         for p in self.phlist:
             if p.ph.offset > sec.sh.offset:
                 p.ph.offset += diff
@@ -764,6 +768,29 @@ class virt(object):
             rva = item
         self.set(rva, data)
 
+    def segments(self):
+        """Return the layout of the file in the virtual view, for
+        bin_stream_mmap: list of (address, size, file offset, file size), the
+        first ones taking precedence over the next ones. As in get(), sections
+        take precedence over program headers.
+        Sections which are not loaded (without SHF_ALLOC) are skipped."""
+        segments = []
+        for section in self.parent.sh.shlist:
+            if not section.sh.flags & elf.SHF_ALLOC or not section.sh.size:
+                continue
+            if isinstance(section, NoBitsSection):
+                file_size = 0
+            else:
+                file_size = section.sh.size
+            segments.append(
+                (section.sh.addr, section.sh.size, section.sh.offset, file_size)
+            )
+        for phdr in self.parent.ph.phlist:
+            segments.append(
+                (phdr.ph.vaddr, phdr.ph.memsz, phdr.ph.offset, phdr.ph.filesz)
+            )
+        return segments
+
     def max_addr(self):
         # the maximum virtual address is found by retrieving the maximum
         # possible virtual address, either from the program entries, and
@@ -810,6 +837,7 @@ class ELF(object):
 
     def __init__(self, elfstr):
         self._content = elfstr
+        self._section_spaces = None
         self.parse_content()
 
         self._virt = virt(self)
@@ -851,15 +879,29 @@ class ELF(object):
             return repr(self)
         return bytes(self)
 
+    def invalidate_section_spaces(self):
+        """Forget the indexes of the sections and program headers, to call
+        after changing their addresses or sizes"""
+        self._section_spaces = None
+
+    def get_section_spaces(self):
+        """Return the AddressSpace of the sections and the one of the program
+        headers, by virtual address. They are built on first use"""
+        if self._section_spaces is None:
+            section_space = AddressSpace(
+                (s.sh.addr, s.sh.addr + s.sh.size, s) for s in self.sh
+            )
+            ph_space = AddressSpace(
+                (s.ph.vaddr, s.ph.vaddr + s.ph.memsz, s) for s in self.ph
+            )
+            self._section_spaces = section_space, ph_space
+        return self._section_spaces
+
     def getphbyvad(self, ad):
-        for s in self.ph:
-            if s.ph.vaddr <= ad < s.ph.vaddr + s.ph.memsz:
-                return s
+        return self.get_section_spaces()[1].get(ad)
 
     def getsectionbyvad(self, ad):
-        for s in self.sh:
-            if s.sh.addr <= ad < s.sh.addr + s.sh.size:
-                return s
+        return self.get_section_spaces()[0].get(ad)
 
     def getsectionbyname(self, name):
         name = force_bytes(name)
@@ -872,7 +914,4 @@ class ELF(object):
         return None
 
     def is_in_virt_address(self, ad):
-        for s in self.sh:
-            if s.sh.addr <= ad < s.sh.addr + s.sh.size:
-                return True
-        return False
+        return ad in self.get_section_spaces()[0]
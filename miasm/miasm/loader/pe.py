@@ -226,6 +226,7 @@ class SHList(CStruct):
             section.offset = raw_off
             section.rawsize = len(section.data)
             addr = raw_off + section.rawsize
+        self.parent_head.invalidate_section_spaces()
 
     def __repr__(self):
         rep = ["#  section         offset   size   addr     flags   rawsize  "]
@@ -245,6 +246,7 @@ class SHList(CStruct):
 
     def append(self, section):
         self.shlist.append(section)
+        self.parent_head.invalidate_section_spaces()
 
 
 class Rva(CStruct):
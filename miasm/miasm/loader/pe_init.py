@@ -11,6 +11,7 @@ import struct
 from future.builtins import int as int_types
 from future.utils import PY3
 
+from miasm.core.address_space import AddressSpace
 from miasm.loader import pe
 from miasm.loader.strpatchwork import StrPatchwork
 
@@ -125,6 +126,20 @@ class ContentVirtual(object):
             raise ValueError('addr must be int/long')
         self.parent.rva.set(self.parent.virt2rva(addr), data)
 
+    def segments(self):
+        """Return the layout of the file in the virtual view, as loaded, for
+        bin_stream_mmap: list of (address, size, file offset, file size),
+        the first ones taking precedence over the next ones"""
+        image_base = self.parent.NThdr.ImageBase
+        segments = []
+        # Later parts of img_rva overwrite the previous ones
+        for rva, size, offset, file_size in reversed(
+                self.parent.img_rva_segments):
+            segments.append((image_base + rva, size, offset, file_size))
+        # Gaps between the sections are zeros
+        segments.append((image_base, len(self.parent.img_rva), 0, 0))
+        return segments
+
     def max_addr(self):
         section = self.parent.SHList[-1]
         length = section.addr + section.size + self.parent.NThdr.ImageBase
@@ -192,6 +207,7 @@ class PE(object):
                  wsize=32):
         self._rva = ContectRva(self)
         self._virt = ContentVirtual(self)
+        self._section_spaces = None
         self.img_rva = StrPatchwork()
         if pestr is None:
             self._content = StrPatchwork()
@@ -327,6 +343,10 @@ class PE(object):
         self.Opthdr, length = Opthdr.unpack_l(self.content, off, self)
         self.NThdr = pe.NThdr.unpack(self.content, off + length, self)
         self.img_rva[0] = self.content[:self.NThdr.sizeofheaders]
+        # (rva, size, file offset, file size) of the parts of img_rva
+        self.img_rva_segments = [
+            (0, self.NThdr.sizeofheaders, 0, self.NThdr.sizeofheaders)
+        ]
         off += self.Coffhdr.sizeofoptionalheader
         self.SHList = pe.SHList.unpack(self.content, off, self)
 
@@ -361,6 +381,9 @@ class PE(object):
             length = len(data)
             data += b"\x00" * ((((length + 0xfff)) & 0xFFFFF000) - length)
             self.img_rva[section.addr] = data
+            self.img_rva_segments.append(
+                (section.addr, len(data), raw_off, length)
+            )
         # Fix img_rva
         self.img_rva = self.img_rva
 
@@ -424,19 +447,35 @@ class PE(object):
         self.content.__setitem__(item, data)
         return
 
+    def invalidate_section_spaces(self):
+        """Forget the indexes of the sections, to call after changing their
+        addresses or sizes"""
+        self._section_spaces = None
+
+    def get_section_spaces(self):
+        """Return the AddressSpace of the sections by RVA and the one of the
+        sections by file offset. They are built on first use"""
+        if self._section_spaces is None:
+            mask = self.NThdr.sectionalignment - 1
+            shlist = self.SHList.shlist if self.SHList is not None else []
+            # TODO CHECK: some binaries have import rva outside section, but
+            # addresses seems to be rounded
+            rva_space = AddressSpace(
+                (section.addr, (section.addr + section.size + mask) & ~mask,
+                 section)
+                for section in shlist
+            )
+            off_space = AddressSpace(
+                (section.offset, section.offset + section.rawsize, section)
+                for section in shlist
+            )
+            self._section_spaces = rva_space, off_space
+        return self._section_spaces
+
     def getsectionbyrva(self, rva):
         if self.SHList is None:
             return None
-        for section in self.SHList.shlist:
-            """
-            TODO CHECK:
-            some binaries have import rva outside section, but addresses
-            seems to be rounded
-            """
-            mask = self.NThdr.sectionalignment - 1
-            if section.addr <= rva < (section.addr + section.size + mask) & ~(mask):
-                return section
-        return None
+        return self.get_section_spaces()[0].get(rva)
 
     def getsectionbyvad(self, vad):
         return self.getsectionbyrva(self.virt2rva(vad))
@@ -444,10 +483,7 @@ class PE(object):
     def getsectionbyoff(self, off):
         if self.SHList is None:
             return None
-        for section in self.SHList.shlist:
-            if section.offset <= off < section.offset + section.rawsize:
-                return section
-        return None
+        return self.get_section_spaces()[1].get(off)
 
     def getsectionbyname(self, name):
         if self.SHList is None:
@@ -496,10 +532,8 @@ class PE(object):
         if addr < self.NThdr.ImageBase:
             return False
         addr = self.virt2rva(addr)
-        for section in self.SHList.shlist:
-            if section.addr <= addr < section.addr + section.size:
-                return True
-        return False
+        section = self.getsectionbyrva(addr)
+        return section is not None and addr < section.addr + section.size
 
     def get_drva(self):
         print('Deprecated: Use PE.rva instead of PE.drva')